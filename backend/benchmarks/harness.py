@@ -0,0 +1,157 @@
+# benchmarks/harness.py
+
+# Phần dùng chung của các scenario: đếm query, đo latency, seed dữ liệu, client ASGI.
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from devices.models import Device, Room
+
+
+class QueryCounter:
+    """
+    Đếm mọi query trên mọi connection (cả connection của thread sync_to_async),
+    bằng execute_wrapper gắn vào connection lúc nó được tạo.
+    latency > 0 -> mỗi query chờ thêm latency giây (giả lập round-trip tới Postgres qua mạng,
+    SQLite cùng process nhanh hơn thực tế nhiều).
+    """
+    def __init__(self):
+        self.count = 0
+        self.latency = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def install(self):
+        connection_created.connect(self.on_connection_created, weak=False)
+        for connection in connections.all(initialized_only=True):
+            self.attach(connection)
+
+    def on_connection_created(self, sender, connection, **kwargs):
+        self.attach(connection)
+
+    def attach(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+query_counter = QueryCounter()
+
+
+@dataclass
+class Result:
+    name: str
+    latencies: list = field(default_factory=list)   # giây / operation
+    elapsed: float = 0.0
+    queries: int = 0
+    errors: int = 0
+
+    @property
+    def ops(self):
+        return len(self.latencies)
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+    def summary(self):
+        return {
+            'ops': self.ops,
+            'errors': self.errors,
+            'throughput': round(self.ops / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': round(self.percentile(0.50) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            'queries_per_op': round(self.queries / self.ops, 3) if self.ops else 0.0,
+        }
+
+
+class measure:
+    """
+    async with measure(result): ...  -> đo tổng thời gian + số query của cả scenario.
+    """
+    def __init__(self, result):
+        self.result = result
+
+    async def __aenter__(self):
+        self.queries = query_counter.count
+        self.start = time.perf_counter()
+        return self.result
+
+    async def __aexit__(self, *exc):
+        self.result.elapsed = time.perf_counter() - self.start
+        self.result.queries = query_counter.count - self.queries
+
+
+@dataclass
+class Client:
+    user_id: int
+    room_id: int
+    device_ids: list
+    token: str
+    socket: WebsocketCommunicator = None
+
+
+def seed(clients, devices_per_room):
+    """
+    Mỗi client = 1 user, 1 room, devices_per_room device (dimmableLight). Chạy trước event loop.
+    """
+    User = get_user_model()
+    User.objects.bulk_create(
+        User(email=f'bench{i}@example.com', name=f'bench{i}', password='!') for i in range(clients)
+    )
+    users = list(User.objects.filter(email__startswith='bench').order_by('id'))
+    rooms = Room.objects.bulk_create(Room(user=user, name=f'Room {user.id}') for user in users)
+    Device.objects.bulk_create(
+        Device(
+            room=room,
+            name=f'Device {j}',
+            icon_asset='assets/icons/light.png',
+            device_type='dimmableLight',
+            attributes={'brightness': 100},
+        )
+        for room in rooms
+        for j in range(devices_per_room)
+    )
+    device_ids = {}
+    for device_id, room_id in Device.objects.order_by('id').values_list('id', 'room_id'):
+        device_ids.setdefault(room_id, []).append(device_id)
+    return [
+        Client(user.id, room.id, device_ids[room.id], str(AccessToken.for_user(user)))
+        for user, room in zip(users, rooms)
+    ]
+
+
+async def http(application, client, method, path, body=None, extra_headers=None):
+    """
+    1 request REST đi qua asgi.application (giống daphne), trả về (status, json).
+    extra_headers ghi đè header mặc định (vd: authorization của gateway).
+    """
+    headers = {'authorization': f'Bearer {client.token}', 'host': 'localhost', **(extra_headers or {})}
+    headers = [(name.encode(), value.encode()) for name, value in headers.items()]
+    payload = b''
+    if body is not None:
+        payload = json.dumps(body).encode()
+        headers.append((b'content-type', b'application/json'))
+        headers.append((b'content-length', str(len(payload)).encode()))
+    communicator = HttpCommunicator(application, method, path, body=payload, headers=headers)
+    response = await communicator.get_response(timeout=30)
+    # Đóng request như server thật -> Django dừng task chờ disconnect.
+    await communicator.send_input({'type': 'http.disconnect'})
+    await communicator.wait(timeout=30)
+    data = json.loads(response['body']) if response['body'] else None
+    return response['status'], data
@@ -0,0 +1,166 @@
+# benchmarks/run.py
+
+"""
+Benchmark asgi.application (JWT handshake, WebSocket command storm, REST list/create).
+
+Chạy từ thư mục backend/:
+    python -m benchmarks.run                                  # SQLite + in-memory channel layer
+    BENCH_DB=postgres python -m benchmarks.run                # Postgres local (DB BENCH_DB_NAME)
+    BENCH_CHANNEL_LAYER=sharded BENCH_REDIS_SHARDS=redis://localhost:6379,redis://localhost:6380 \
+        python -m benchmarks.run --scenario ws_fanout --fanout 2000   # channel layer trên Redis thật
+    python -m benchmarks.run --clients 50 --commands 200
+    python -m benchmarks.run --db-latency 2                   # +2ms mỗi query (giả lập DB qua mạng)
+    python -m benchmarks.run --save benchmarks/baseline.json  # ghi baseline mới
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+--compare: queries/op tăng so với baseline -> exit 1 (số query không phụ thuộc máy).
+p99 chậm hơn quá --tolerance chỉ in cảnh báo, thêm --fail-on-latency để exit 1.
+Baseline chỉ so được khi cùng --clients/--commands/--requests/--devices/--fanout/--db-latency và channel layer.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=20, help='số client (mỗi client 1 user, 1 room)')
+    parser.add_argument('--devices', type=int, default=10, help='số device mỗi room')
+    parser.add_argument('--commands', type=int, default=50, help='số lệnh WebSocket mỗi client')
+    parser.add_argument('--fanout', type=int, default=200, help='số socket trong room của scenario ws_fanout')
+    parser.add_argument('--requests', type=int, default=400, help='tổng số request REST')
+    parser.add_argument('--db-latency', type=float, default=0, help='ms chờ thêm mỗi query')
+    parser.add_argument('--scenario', action='append', help='chỉ chạy scenario này (lặp lại được)')
+    parser.add_argument('--save', metavar='PATH', help='ghi kết quả làm baseline')
+    parser.add_argument('--compare', metavar='PATH', help='so với baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='p99 chậm hơn bao nhiêu thì cảnh báo')
+    parser.add_argument('--fail-on-latency', action='store_true')
+    return parser.parse_args(argv)
+
+
+def setup_database():
+    from django.conf import settings
+    from django.core.management import call_command
+
+    database = settings.DATABASES['default']
+    if database['ENGINE'].endswith('sqlite3') and os.path.exists(database['NAME']):
+        os.remove(database['NAME'])
+    call_command('migrate', verbosity=0)
+    if not database['ENGINE'].endswith('sqlite3'):
+        call_command('flush', interactive=False, verbosity=0)
+
+
+async def run_scenarios(names, clients, options):
+    from home_electronics_backend.asgi import application
+
+    from .scenarios import SCENARIOS
+
+    results = {}
+    for name in names:
+        result = await SCENARIOS[name](application, clients, options)
+        results[name] = result.summary()
+    return results
+
+
+def print_report(results):
+    header = f"{'scenario':<12}{'ops':>8}{'err':>6}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'q/op':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, row in results.items():
+        print(
+            f"{name:<12}{row['ops']:>8}{row['errors']:>6}{row['throughput']:>10}"
+            f"{row['p50_ms']:>10}{row['p99_ms']:>10}{row['queries_per_op']:>8}"
+        )
+
+
+def compare(results, baseline, options):
+    """
+    Trả về danh sách dòng regression (rỗng = ok). In luôn cảnh báo latency.
+    """
+    regressions = []
+    for name, row in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if row['queries_per_op'] > base['queries_per_op'] + 0.01:
+            regressions.append(f"{name}: queries/op {base['queries_per_op']} -> {row['queries_per_op']}")
+        if row['errors'] > base['errors']:
+            regressions.append(f"{name}: errors {base['errors']} -> {row['errors']}")
+        if base['p99_ms'] and row['p99_ms'] > base['p99_ms'] * (1 + options.tolerance):
+            message = f"{name}: p99 {base['p99_ms']}ms -> {row['p99_ms']}ms"
+            if options.fail_on_latency:
+                regressions.append(message)
+            else:
+                print(f'WARNING {message}')
+    return regressions
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+
+    from .harness import query_counter, seed
+    from .scenarios import SCENARIOS, SOCKET_SCENARIOS
+
+    names = set(options.scenario or SCENARIOS)
+    unknown = names - set(SCENARIOS)
+    if unknown:
+        sys.exit(f'Unknown scenario: {", ".join(sorted(unknown))}')
+    if names & SOCKET_SCENARIOS:
+        # Các scenario ws_* dùng socket mở ở handshake.
+        names.add('handshake')
+    names = [name for name in SCENARIOS if name in names]
+
+    setup_database()
+    clients = seed(options.clients, options.devices)
+    query_counter.install()
+    query_counter.latency = options.db_latency / 1000
+
+    results = asyncio.run(run_scenarios(names, clients, options))
+    print_report(results)
+
+    report = {
+        'meta': {
+            'clients': options.clients,
+            'devices': options.devices,
+            'commands': options.commands,
+            'requests': options.requests,
+            'fanout': options.fanout,
+            'db_latency_ms': options.db_latency,
+            'database': connection.vendor,
+            'channel_layer': settings.BENCH_CHANNEL_LAYER,
+            'python': platform.python_version(),
+        },
+        'results': results,
+    }
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'] != {**report['meta'], 'python': baseline['meta'].get('python')}:
+            print(f"WARNING baseline chạy với tham số khác: {baseline['meta']}")
+        regressions = compare(results, baseline, options)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# benchmarks/scenarios.py
+
+# Mỗi scenario: async fn(application, clients, options) -> Result.
+# Chạy theo thứ tự trong SCENARIOS (handshake mở socket cho các scenario ws_*, ws_storm đóng lại).
+
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+
+from devices.models import Gateway, Scene, SceneTarget
+from devices.state_cache import device_state_cache
+from devices.wire import JSON_SUBPROTOCOL
+
+from .harness import Result, http, measure
+
+SCENARIOS = {}
+SOCKET_SCENARIOS = set()   # cần socket mở sẵn từ handshake
+
+
+def scenario(name, needs_sockets=False):
+    def decorator(func):
+        SCENARIOS[name] = func
+        if needs_sockets:
+            SOCKET_SCENARIOS.add(name)
+        return func
+    return decorator
+
+
+@scenario('handshake')
+async def handshake(application, clients, options):
+    """
+    N client connect cùng lúc: JWT (TokenAuthMiddleware) + check room + snapshot.
+    Latency = từ lúc connect tới lúc nhận xong snapshot.
+    """
+    result = Result('handshake')
+
+    async def connect(client):
+        start = time.perf_counter()
+        socket = WebsocketCommunicator(application, f'/ws/devices/{client.room_id}/?token={client.token}', subprotocols=[JSON_SUBPROTOCOL])
+        connected, _ = await socket.connect(timeout=30)
+        if not connected:
+            result.errors += 1
+            return
+        await socket.receive_json_from(timeout=30)   # snapshot
+        result.latencies.append(time.perf_counter() - start)
+        client.socket = socket
+
+    async with measure(result):
+        await asyncio.gather(*(connect(client) for client in clients))
+    return result
+
+
+@scenario('ws_cold', needs_sockets=True)
+async def ws_cold(application, clients, options):
+    """
+    Cache trống (vd: worker vừa restart), mọi client gửi 1 lệnh cùng lúc
+    -> mỗi lệnh phải load device từ DB trước khi áp dụng.
+    Đo các room có load song song được trong 1 worker không (chạy kèm --db-latency để thấy rõ).
+    """
+    result = Result('ws_cold')
+    await device_state_cache.flush()
+    device_state_cache.clear()
+
+    async def command(client):
+        device_id = client.device_ids[0]
+        start = time.perf_counter()
+        await client.socket.send_json_to({'device_id': device_id, 'attributes': {'is_on': True}})
+        frame = await client.socket.receive_json_from(timeout=30)
+        if frame.get('device_id') != device_id:
+            result.errors += 1
+            return
+        result.latencies.append(time.perf_counter() - start)
+
+    async with measure(result):
+        await asyncio.gather(*(command(client) for client in clients if client.socket))
+    return result
+
+
+@scenario('ws_storm', needs_sockets=True)
+async def ws_storm(application, clients, options):
+    """
+    Mỗi client gửi options.commands lệnh brightness liên tiếp (chờ broadcast của lệnh trước),
+    tất cả client chạy song song. Latency = gửi lệnh -> nhận broadcast của chính lệnh đó.
+    Số query gồm cả lần flush cuối của device_state_cache.
+    """
+    result = Result('ws_storm')
+
+    async def storm(client):
+        rng = random.Random(client.user_id)
+        brightness = dict.fromkeys(client.device_ids, 100)
+        for _ in range(options.commands):
+            device_id = rng.choice(client.device_ids)
+            # Luôn khác giá trị cũ -> lệnh nào cũng có broadcast.
+            brightness[device_id] = (brightness[device_id] + 1) % 101
+            start = time.perf_counter()
+            await client.socket.send_json_to({'device_id': device_id, 'attributes': {'brightness': brightness[device_id]}})
+            frame = await client.socket.receive_json_from(timeout=30)
+            if frame.get('device_id') != device_id:
+                result.errors += 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+
+    async with measure(result):
+        await asyncio.gather(*(storm(client) for client in clients if client.socket))
+        await device_state_cache.flush()
+
+    for client in clients:
+        if client.socket:
+            await client.socket.disconnect()
+            client.socket = None
+    return result
+
+
+@scenario('ws_fanout')
+async def ws_fanout(application, clients, options):
+    """
+    1 room lớn: options.fanout socket cùng mở room của client đầu tiên, socket đầu gửi options.commands // 5 lệnh.
+    Latency = gửi lệnh -> socket cuối cùng nhận được broadcast (đo chi phí phía nhận của fan-out).
+    """
+    result = Result('ws_fanout')
+    owner = clients[0]
+    sockets = []
+    for _ in range(options.fanout):
+        socket = WebsocketCommunicator(application, f'/ws/devices/{owner.room_id}/?token={owner.token}', subprotocols=[JSON_SUBPROTOCOL])
+        connected, _ = await socket.connect(timeout=30)
+        if not connected:
+            result.errors += 1
+            continue
+        await socket.receive_json_from(timeout=30)   # snapshot
+        sockets.append(socket)
+
+    async with measure(result):
+        device_id = owner.device_ids[0]
+        for i in range(max(1, options.commands // 5)):
+            start = time.perf_counter()
+            await sockets[0].send_json_to({'device_id': device_id, 'attributes': {'brightness': i % 100}})
+            frames = await asyncio.gather(*(socket.receive_from(timeout=30) for socket in sockets))
+            if not all(f'"device_id":{device_id},' in frame.replace(' ', '') for frame in frames):
+                result.errors += 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+        await device_state_cache.flush()
+
+    for socket in sockets:
+        await socket.disconnect()
+    return result
+
+
+@scenario('rest_mix')
+async def rest_mix(application, clients, options):
+    """
+    options.requests request REST, chia đều cho các client chạy song song:
+    ~80% GET /api/devices/?room=<id>, ~20% POST /api/devices/.
+    """
+    result = Result('rest_mix')
+    per_client = max(1, options.requests // len(clients))
+
+    async def mix(client):
+        rng = random.Random(client.user_id)
+        for i in range(per_client):
+            start = time.perf_counter()
+            if rng.random() < 0.8:
+                status, _ = await http(application, client, 'GET', f'/api/devices/?room={client.room_id}')
+                expected = 200
+            else:
+                status, _ = await http(application, client, 'POST', '/api/devices/', {
+                    'room': client.room_id,
+                    'name': f'Bench {i}',
+                    'icon_asset': 'assets/icons/light.png',
+                    'device_type': 'dimmableLight',
+                })
+                expected = 201
+            if status != expected:
+                result.errors += 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+
+    async with measure(result):
+        await asyncio.gather(*(mix(client) for client in clients))
+    return result
+
+
+@scenario('gateway')
+async def gateway(application, clients, options):
+    """
+    Mỗi client có 1 gateway, gửi options.commands // 5 lô POST /api/gateway/reports/,
+    mỗi lô báo state toàn bộ device của room, chỉ ~1/2 device đổi brightness (phần còn lại bị dedupe).
+    """
+    result = Result('gateway')
+
+    def create_gateways():
+        keys = []
+        for client in clients:
+            gateway = Gateway(user_id=client.user_id, name='Bench')
+            keys.append(gateway.set_new_key())
+            gateway.save()
+        return keys
+
+    keys = await sync_to_async(create_gateways)()
+
+    async def report(client, key):
+        headers = {'authorization': f'Gateway {key}'}
+        for i in range(max(1, options.commands // 5)):
+            reports = [
+                [device_id, True, {'brightness': (i if j % 2 else 0)}]
+                for j, device_id in enumerate(client.device_ids)
+            ]
+            start = time.perf_counter()
+            status, _ = await http(application, client, 'POST', '/api/gateway/reports/', {'reports': reports}, headers)
+            if status != 200:
+                result.errors += 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+
+    async with measure(result):
+        await asyncio.gather(*(report(client, key) for client, key in zip(clients, keys)))
+    return result
+
+
+@scenario('scene')
+async def scene(application, clients, options):
+    """
+    Mỗi client có 2 scene trên toàn bộ device của room ("sáng" / "tối"), áp dụng xen kẽ
+    options.commands // 5 lần bằng POST /api/scenes/<id>/apply/ (plan nằm trong cache sau lần đầu).
+    """
+    result = Result('scene')
+
+    def create_scenes():
+        scene_ids = []
+        for client in clients:
+            pair = []
+            for name, brightness in (('Bright', 100), ('Dim', 10)):
+                scene = Scene.objects.create(user_id=client.user_id, name=name)
+                SceneTarget.objects.bulk_create([
+                    SceneTarget(scene=scene, device_id=device_id, attributes={'is_on': True, 'brightness': brightness})
+                    for device_id in client.device_ids
+                ])
+                pair.append(scene.pk)
+            scene_ids.append(pair)
+        return scene_ids
+
+    scene_ids = await sync_to_async(create_scenes)()
+
+    async def apply(client, pair):
+        for i in range(max(1, options.commands // 5)):
+            start = time.perf_counter()
+            status, _ = await http(application, client, 'POST', f'/api/scenes/{pair[i % 2]}/apply/')
+            if status != 200:
+                result.errors += 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+
+    async with measure(result):
+        await asyncio.gather(*(apply(client, pair) for client, pair in zip(clients, scene_ids)))
+    return result
+
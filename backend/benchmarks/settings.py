@@ -0,0 +1,91 @@
+# benchmarks/settings.py
+
+# Settings cho benchmark: app thật (asgi.application), chỉ đổi hạ tầng:
+#   - Channel layer in-memory, cache LocMem (không cần Redis).
+#   - DB: SQLite (file tạm, xoá mỗi lần chạy) hoặc Postgres local khi BENCH_DB=postgres.
+
+import os
+import tempfile
+
+# settings gốc đọc các biến này lúc import.
+os.environ.setdefault('REDIS_HOST', 'localhost')
+os.environ.setdefault('REDIS_PORT', '6379')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('LOG_LEVEL_DEVICES', 'WARNING')
+
+from home_electronics_backend.settings import *  # noqa: E402,F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+if os.getenv('BENCH_DB') == 'postgres':
+    # DB riêng cho benchmark (bị flush mỗi lần chạy), dùng chung DB_HOST/DB_USER/... với app.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('BENCH_DB_NAME', 'home_electronics_bench'),
+            'USER': os.getenv('DB_USER'),
+            'PASSWORD': os.getenv('DB_PASSWORD'),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 60,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('BENCH_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'home_electronics_bench.sqlite3')),
+            'CONN_MAX_AGE': 60,
+        }
+    }
+
+# BENCH_CHANNEL_LAYER: memory (mặc định, không cần Redis) | redis (RedisChannelLayer trên REDIS_HOST/PORT)
+# | sharded (ShardedChannelLayer trên các Redis trong BENCH_REDIS_SHARDS, vd: 2-4 Redis local khác port).
+BENCH_CHANNEL_LAYER = os.getenv('BENCH_CHANNEL_LAYER', 'memory')
+if BENCH_CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [(os.getenv('REDIS_HOST'), int(os.getenv('REDIS_PORT')))], 'capacity': 10000},
+        },
+    }
+elif BENCH_CHANNEL_LAYER == 'sharded':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'home_electronics_backend.channel_layers.ShardedChannelLayer',
+            'CONFIG': {
+                'hosts': os.getenv('BENCH_REDIS_SHARDS', 'redis://localhost:6379,redis://localhost:6380').split(','),
+                'capacity': 10000,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Password hasher nhanh: seed hàng trăm user không tốn vài giây PBKDF2.
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# Đo năng lực server: không gộp update, không giới hạn message/giây của client.
+DEVICE_WS_THROTTLE = {
+    'COALESCE_WINDOW': 0,
+    'RATE': 1e9,
+    'BURST': 1e9,
+}
+
+# Chỉ flush khi scenario gọi device_state_cache.flush() (hoặc vượt MAX_PENDING)
+# -> queries/op không phụ thuộc scenario chạy lâu hay nhanh hơn chu kỳ flush.
+DEVICE_STATE_CACHE = {
+    **DEVICE_STATE_CACHE,
+    'FLUSH_INTERVAL': 3600,
+}
@@ -0,0 +1,136 @@
+# devices/attribute_schemas.py
+from .models import Device
+
+# Các key attributes hợp lệ theo loại device. Key không có trong schema của loại đó -> bị từ chối
+# (REST, WebSocket, gateway, schedule) trước khi ghi gì xuống DB / cache / broadcast.
+# is_on là field riêng của Device, không nằm trong attributes.
+# Spec của 1 key:
+#     - type: 'bool' | 'int' | 'number' | 'string' | 'enum'
+#     - min / max (int, number), max_length (string), choices (enum)
+#     - default: điền vào lúc tạo device nếu client không gửi.
+# Thêm key mới -> thêm luôn id của key đó vào wire.ATTRIBUTE_KEYS (subprotocol msgpack.v1).
+ATTRIBUTE_SCHEMAS = {
+    Device.DeviceType.BINARY_SWITCH: {},
+    Device.DeviceType.DIMMABLE_LIGHT: {
+        'brightness': {'type': 'int', 'min': 0, 'max': 100, 'default': 100},
+    },
+}
+
+
+class AttributeSchemaError(ValueError):
+    # errors = {key: message}, trả nguyên cho client (400 / frame error).
+    def __init__(self, errors):
+        super().__init__('; '.join(f'{key}: {message}' for key, message in errors.items()))
+        self.errors = errors
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _compile_field(spec):
+    """
+    Spec -> hàm check(value) trả về value hợp lệ hoặc raise ValueError(message).
+    Dựng 1 lần lúc import: mỗi lần validate chỉ còn vài phép so sánh, không đọc lại spec.
+    """
+    kind = spec['type']
+    low, high = spec.get('min'), spec.get('max')
+
+    def check_range(value):
+        if low is not None and value < low:
+            raise ValueError(f'Ensure this value is greater than or equal to {low}.')
+        if high is not None and value > high:
+            raise ValueError(f'Ensure this value is less than or equal to {high}.')
+        return value
+
+    if kind == 'bool':
+        def check(value):
+            if not isinstance(value, bool):
+                raise ValueError('Must be a valid boolean.')
+            return value
+    elif kind == 'int':
+        def check(value):
+            if not _is_int(value):
+                raise ValueError('A valid integer is required.')
+            return check_range(value)
+    elif kind == 'number':
+        def check(value):
+            if not (_is_int(value) or isinstance(value, float)) or value != value:
+                raise ValueError('A valid number is required.')
+            return check_range(value)
+    elif kind == 'string':
+        max_length = spec.get('max_length')
+
+        def check(value):
+            if not isinstance(value, str):
+                raise ValueError('Not a valid string.')
+            if max_length is not None and len(value) > max_length:
+                raise ValueError(f'Ensure this field has no more than {max_length} characters.')
+            return value
+    elif kind == 'enum':
+        choices = frozenset(spec['choices'])
+
+        def check(value):
+            if not isinstance(value, str) or value not in choices:
+                raise ValueError(f'"{value}" is not a valid choice.')
+            return value
+    else:
+        raise ValueError(f'Unknown attribute type {kind!r}.')
+
+    if 'default' in spec:
+        check(spec['default'])
+    return check
+
+
+class AttributeSchema:
+    """
+    Schema đã compile của 1 loại device: {key: check} + attributes mặc định.
+    """
+    def __init__(self, spec):
+        self.checks = {key: _compile_field(field) for key, field in spec.items()}
+        self.defaults = {key: field['default'] for key, field in spec.items() if 'default' in field}
+
+    def validate(self, attributes, partial=True):
+        """
+        attributes (chỉ các key gửi lên) -> dict đã kiểm tra.
+        partial=False (tạo device): điền default cho key không gửi.
+        Raise AttributeSchemaError nếu có key lạ / sai kiểu / ngoài khoảng.
+        """
+        if not isinstance(attributes, dict):
+            raise AttributeSchemaError({'attributes': 'Expected an object.'})
+        errors = {}
+        for key, value in attributes.items():
+            check = self.checks.get(key)
+            if check is None:
+                errors[key] = 'Unknown attribute for this device type.'
+                continue
+            try:
+                check(value)
+            except ValueError as e:
+                errors[key] = str(e)
+        if errors:
+            raise AttributeSchemaError(errors)
+        return attributes if partial else {**self.defaults, **attributes}
+
+    def validate_state(self, update):
+        """
+        Update dạng WebSocket / gateway / schedule: {is_on, key khác...}.
+        is_on (nếu có) phải là bool, các key khác kiểm tra như validate().
+        """
+        if 'is_on' not in update:
+            return self.validate(update)
+        if not isinstance(update['is_on'], bool):
+            raise AttributeSchemaError({'is_on': 'Must be a valid boolean.'})
+        self.validate({key: value for key, value in update.items() if key != 'is_on'})
+        return update
+
+
+SCHEMAS = {device_type: AttributeSchema(spec) for device_type, spec in ATTRIBUTE_SCHEMAS.items()}
+
+
+def get_schema(device_type):
+    # Raise AttributeSchemaError nếu loại device không có schema.
+    try:
+        return SCHEMAS[device_type]
+    except KeyError:
+        raise AttributeSchemaError({'device_type': f'"{device_type}" is not a valid choice.'}) from None
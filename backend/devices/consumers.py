@@ -1,11 +1,75 @@
 # /home/trand/D/personal/home_electronics_backend/devices/consumers.py
 import json
+import logging
+import time
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from asgiref.sync import sync_to_async
+from .attribute_schemas import AttributeSchemaError, get_schema
+from .ingestion import authenticate_gateway, ingest_reports, parse_reports
 from .models import Device, Room
+from .realtime import (
+    encode_frame, publish_device_states, room_group_name, send_room_event, state_event, state_frame, state_payload,
+)
+from .state_cache import device_state_cache
+from .throttling import TokenBucket, get_config as get_throttle_config, update_coalescer
+from .wire import MSGPACK_SUBPROTOCOL, choose_subprotocol, decode_binary, encode_binary
 from django.core.exceptions import PermissionDenied
+from home_electronics_backend.log import log_event
+from home_electronics_backend.metrics import (
+    WS_CONNECTIONS, WS_CONNECTS, WS_MESSAGES, WS_RECEIVE_TO_BROADCAST, timed_sync_to_async,
+)
+
+# Cấu hình trong settings.LOGGING: DEBUG mới log payload, INFO chỉ log connect/disconnect/...
+logger = logging.getLogger(__name__)
+
+
+class FrameProtocolMixin:
+    """
+    Encoding của frame theo subprotocol client chọn lúc connect (devices/wire.py):
+        - mặc định / json.v1: frame text JSON.
+        - msgpack.v1: frame binary MessagePack, key số nguyên -> nhỏ hơn, parse nhanh hơn
+          cho client chạy pin và gateway.
+    Frame nhận vào được decode theo loại frame (text / bytes), xử lý như nhau sau khi decode.
+    Không chọn subprotocol (legacy) -> client cũ chỉ hiểu frame state của 1 device:
+    không gửi snapshot lúc connect, frame batch được tách thành từng device.
+    """
+    binary = False
+    legacy = True
+
+    async def accept_protocol(self):
+        subprotocol = choose_subprotocol(self.scope.get('subprotocols'))
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.legacy = subprotocol is None
+        await self.accept(subprotocol=subprotocol)
+
+    @staticmethod
+    def decode_frame(text_data, bytes_data):
+        # Raise ValueError (JSONDecodeError là ValueError) nếu sai format.
+        if bytes_data is not None:
+            return decode_binary(bytes_data)
+        return json.loads(text_data)
+
+    def encode(self, frame):
+        return encode_binary(frame) if self.binary else encode_frame(frame)
+
+    async def send_encoded(self, data):
+        if self.binary:
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
+
+    async def send_frame(self, frame):
+        await self.send_encoded(self.encode(frame))
+
+
+class DeviceConsumer(FrameProtocolMixin, AsyncWebsocketConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Giới hạn số message / giây của connection này (settings.DEVICE_WS_THROTTLE).
+        config = get_throttle_config()
+        self.rate_limit = TokenBucket(config['RATE'], config['BURST'])
+        self.throttled = False
 
-class DeviceConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # 1. Lấy room_id từ URL
         # 2. Map sang group name: room_1, room_2,...
@@ -13,136 +77,518 @@ class DeviceConsumer(AsyncWebsocketConsumer):
         # 4. Nếu anonymous -> close()
         # 5. Check quyền bằng check_room_owner: Chỉ cho phép user sở hữu Room đó connect.
         # 6. Nếu pass: Đăng ký WebSocket hiện tại vào group trên Redis.
+        # 7. Load state các device trong room (1 query), giữ set id trong bộ nhớ suốt connection.
+        # 8. Gửi snapshot state cả room -> client không cần gọi lại GET /api/rooms/<id>/
+        #    (chỉ client có chọn subprotocol, client cũ không hiểu frame snapshot).
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         
         # TÊN GROUP NAME
-        self.room_group_name = f'room_{self.room_id}'
-        
-        print(f"🔌 [CONNECT] Client connected to Room: {self.room_id}")
-        print(f"👉 [GROUP NAME] Code uses: '{self.room_group_name}'")
-        print(f"🔑 [REDIS KEY] Actual key in Redis: 'asgi:group:{self.room_group_name}'")
+        self.room_group_name = room_group_name(self.room_id)
 
         self.user = self.scope.get('user')
 
         if not self.user or self.user.is_anonymous:
+            WS_CONNECTS.labels('anonymous').inc()
             await self.close()
             return
 
         is_owner = await self.check_room_owner(self.room_id, self.user.id)
         if not is_owner:
-            print(f"⛔ [DENIED] User {self.user.id} is not owner of Room {self.room_id}") # Log thêm nếu bị từ chối
+            log_event(logger, logging.WARNING, 'ws.denied', room_id=self.room_id, user_id=self.user.id)
+            WS_CONNECTS.labels('denied').inc()
             await self.close()
             return
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_protocol()
+        WS_CONNECTS.labels('accepted').inc()
+        WS_CONNECTIONS.track(self.room_id)
+        device_state_cache.watch([self.room_id])
+        self.counted = True
+        log_event(logger, logging.INFO, 'ws.connect', room_id=self.room_id, user_id=self.user.id, group=self.room_group_name)
+
+        # Đọc state SAU khi join group: update nào tới sau lúc đọc đều đi qua group,
+        # update nằm giữa join và đọc thì có ở cả 2 -> client bỏ broadcast có version <= snapshot.
+        entries = await device_state_cache.get_room(self.room_id)
+
+        # Quyền sở hữu room đã check ở trên -> device thuộc room = device user được điều khiển.
+        # device_id -> room_id, được cập nhật qua event room_devices_changed khi DeviceViewSet thêm/chuyển/xoá device.
+        self.device_rooms = dict.fromkeys(entries, self.room_id)
+
+        if not self.legacy:
+            await self.send_states('snapshot', entries)
 
     async def disconnect(self, close_code):
-        print(f"❌ [DISCONNECT] Client left Room: {self.room_id}") # Log khi ngắt kết nối
+        log_event(logger, logging.INFO, 'ws.disconnect', room_id=self.room_id, code=close_code)
+        if getattr(self, 'counted', False):
+            WS_CONNECTIONS.untrack(self.room_id)
+            device_state_cache.unwatch([self.room_id])
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     # App gửi tới thì hàm này nhận
-    async def receive(self, text_data):
-        print(f"📩 [RECEIVE] App sent to Room {self.room_id}: {text_data}")
+    async def receive(self, text_data=None, bytes_data=None):
+        received_at = time.perf_counter()
+        # Payload chỉ log ở DEBUG (có sample/rate limit trong settings.LOGGING).
+        log_event(
+            logger, logging.DEBUG, 'ws.receive', room_id=self.room_id,
+            payload=text_data if bytes_data is None else bytes_data.hex(),
+        )
 
-        try:
-            data = json.loads(text_data)
-            device_id = data.get('device_id')
-            attributes = data.get('attributes')
+        # Hết token -> bỏ message trước cả khi decode.
+        # Chỉ báo lỗi 1 lần cho mỗi đợt bị chặn, không gửi lỗi cho từng message bị bỏ.
+        retry_after = self.rate_limit.take()
+        if retry_after:
+            WS_MESSAGES.labels('throttled').inc()
+            if not self.throttled:
+                self.throttled = True
+                log_event(logger, logging.WARNING, 'ws.throttled', room_id=self.room_id, user_id=self.user.id)
+                await self.send_frame({
+                    'error': 'Rate limit exceeded.',
+                    'retry_after': round(retry_after, 3),
+                })
+            return
+        self.throttled = False
 
-            if device_id is None or attributes is None or not isinstance(attributes, dict):
-                return
+        try:
+            data = self.decode_frame(text_data, bytes_data)
+        except ValueError:
+            WS_MESSAGES.labels('invalid').inc()
+            log_event(logger, logging.DEBUG, 'ws.bad_frame', room_id=self.room_id)
+            return
 
-            # Cập nhật DB và 
-            # trả về state mới { device_id, is_on, attributes }
-            updated_device_state = await self.update_device_state(device_id, attributes, self.user)
-
-            # Gửi message tới group của phòng
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'device_state_update',  # tên hàm handler được gọi khi message được group_send()
-                    'state': updated_device_state,  # state là data bạn muốn gửi xuống client
-                }
-            )
+        try:
+            await self.handle_message(data, received_at)
         except PermissionDenied:
-            await self.send(text_data=json.dumps({'error': 'Permission denied.'}))
+            await self.send_frame({'error': 'Permission denied.'})
+        except AttributeSchemaError as e:
+            # errors = {device_id: {key: lỗi}}, cả message (kể cả batch) bị bỏ.
+            WS_MESSAGES.labels('invalid').inc()
+            await self.send_frame({'error': 'Invalid attributes.', 'errors': e.errors})
         except Device.DoesNotExist:
             pass
-        except json.JSONDecodeError:
-            pass
+
+    async def handle_message(self, data, received_at):
+        message_type = data.get('type') if isinstance(data, dict) else None
+
+        # Batch: {"type": "batch", "updates": [{device_id, attributes}, ...]}
+        if message_type == 'batch':
+            WS_MESSAGES.labels('batch').inc()
+            if await self.receive_batch(data.get('updates')):
+                WS_RECEIVE_TO_BROADCAST.labels('batch').observe(time.perf_counter() - received_at)
+            return
+
+        # Client thấy version bị nhảy cóc -> xin lại state đầy đủ: {"type": "resync", "device_ids": [...]}
+        if message_type == 'resync':
+            WS_MESSAGES.labels('resync').inc()
+            await self.receive_resync(data.get('device_ids'))
+            return
+
+        update = self.parse_update(data)
+        if update is None:
+            WS_MESSAGES.labels('invalid').inc()
+            return
+        device_id, attributes = update
+        WS_MESSAGES.labels('update').inc()
+
+        if device_id not in self.device_rooms:
+            raise PermissionDenied("Device is not in the connected room.")
+
+        # Kiểm tra schema trước cả khi gộp / merge: entry đã có trong cache từ lúc connect.
+        self.validate_updates(await device_state_cache.get_many([device_id]), {device_id: attributes})
+
+        # Đang trong cửa sổ gộp của device -> chỉ giữ giá trị mới nhất, áp dụng khi hết cửa sổ.
+        if not update_coalescer.submit(device_id, attributes, self.apply_update):
+            WS_MESSAGES.labels('coalesced').inc()
+            return
+
+        await self.apply_update(device_id, attributes, received_at)
+
+    async def apply_update(self, device_id, attributes, received_at=None):
+        # Cập nhật state (cache, flush DB theo lô) và
+        # trả về phần thay đổi { device_id, room_id, is_on, attributes (key đổi), version }
+        updated_device_state = await self.update_device_state(device_id, attributes, self.user)
+
+        # Không có gì đổi -> không broadcast cho cả room.
+        if updated_device_state is None:
+            return
+
+        # Log 1 lần ở phía gửi, không log trong device_state_update (chạy 1 lần cho mỗi socket).
+        log_event(logger, logging.DEBUG, 'ws.broadcast', room_id=updated_device_state['room_id'], state=updated_device_state)
+
+        # Gửi message tới group của room chứa device, frame encode sẵn 1 lần ở đây (state_event).
+        await self.broadcast(updated_device_state['room_id'], state_event([updated_device_state]))
+        if received_at is not None:
+            WS_RECEIVE_TO_BROADCAST.labels('update').observe(time.perf_counter() - received_at)
+
+    async def receive_batch(self, updates):
+        """
+        Nhiều device trong 1 frame (vd: scene "tắt hết đèn phòng khách"):
+            - Check quyền cả batch bằng 1 query (chỉ các device chưa có trong cache).
+            - Ghi xuống DB cùng 1 lần bulk_update (flush của device_state_cache).
+            - Broadcast 1 event cho mỗi room chứa tất cả state -> client vẽ lại 1 lần.
+        Nếu có 1 device không hợp lệ -> bỏ cả batch, không áp dụng gì.
+        Trả về True nếu có broadcast.
+        """
+        if not isinstance(updates, list):
+            return False
+
+        merged = {}
+        for item in updates:
+            update = self.parse_update(item)
+            if update is None:
+                continue
+            device_id, attributes = update
+            # Cùng 1 device xuất hiện nhiều lần -> gộp, giá trị sau ghi đè giá trị trước.
+            merged.setdefault(device_id, {}).update(attributes)
+
+        if not merged:
+            return False
+
+        updated_device_states = await self.update_device_states(merged, self.user)
+        if not updated_device_states:
+            return False
+
+        by_room = {}
+        for state in updated_device_states:
+            by_room.setdefault(state['room_id'], []).append(state)
+
+        for room_id, states in by_room.items():
+            log_event(logger, logging.DEBUG, 'ws.broadcast', room_id=room_id, count=len(states))
+            await self.broadcast(room_id, state_event(states, batch=True))
+        return True
+
+    async def broadcast(self, room_id, event):
+        await send_room_event(self.channel_layer, room_id, event)
+
+    async def receive_resync(self, device_ids=None):
+        """
+        Gửi state đầy đủ (kèm version) của các device socket này được điều khiển, chỉ cho socket này.
+        Không truyền device_ids -> gửi tất cả.
+        """
+        if isinstance(device_ids, list):
+            wanted = set()
+            for device_id in device_ids:
+                try:
+                    wanted.add(int(device_id))
+                except (TypeError, ValueError):
+                    continue
+            wanted &= self.device_rooms.keys()
+        else:
+            wanted = set(self.device_rooms)
+
+        entries = await device_state_cache.get_many(sorted(wanted))
+        await self.send_states('resync', entries)
+
+    async def send_states(self, frame_type, entries, **extra):
+        # State đầy đủ của nhiều device, mỗi device kèm version (= số thứ tự update của device đó).
+        await self.send_frame({
+            'type': frame_type,
+            **extra,
+            'devices': [
+                device_state_cache.full_state(device_id, entry)
+                for device_id, entry in entries.items()
+            ],
+        })
+
+    @staticmethod
+    def parse_update(data):
+        """
+        {device_id, attributes} -> (device_id kiểu int, attributes) hoặc None nếu sai format.
+        """
+        if not isinstance(data, dict):
+            return None
+
+        device_id = data.get('device_id')
+        attributes = data.get('attributes')
+
+        if device_id is None or attributes is None or not isinstance(attributes, dict):
+            return None
+
+        # Cache key theo id kiểu int -> "12" và 12 là cùng 1 device
+        try:
+            return int(device_id), attributes
+        except (TypeError, ValueError):
+            return None
 
     """
     Khi group_send() được gọi:
         - Channels tìm tất cả consumers đang nằm trong group room_<room_id>
         - Channels gọi method device_state_update() trên TỪNG consumer
         - Trong mỗi device_state_update(), bạn gọi self.send()
+    Event có 'text' / 'bytes': frame đã encode ở phía gửi (state_event) -> chỉ forward đúng loại
+    socket này chọn lúc connect, không encode lại.
+    Event có 'persisted' (scheduler,... đã ghi thẳng DB) -> merge vào cache của process này trước khi gửi,
+    chỉ encode lại khi cache của process này đổi version (đang có change chưa flush).
+    Client cũ (legacy) nhận batch dưới dạng từng frame 1 device ('texts', cũng encode sẵn ở phía gửi).
     """
     async def device_state_update(self, event):
-        state = event['state']
-
-        print(f"📢 [BROADCAST] Server replying to Room {self.room_id}: {state}")
+        # Chạy 1 lần cho mỗi socket trong room -> không log, không encode gì ở đây.
+        if 'persisted' in event:
+            states = [device_state_cache.absorb(state, event['persisted']) for state in event['states']]
+            if states != event['states']:
+                for frame in self.state_frames(states, event['batch']):
+                    await self.send_frame(frame)
+                return
+        if self.legacy and 'texts' in event:
+            for text in event['texts']:
+                await self.send(text_data=text)
+            return
+        await self.send_encoded(event['bytes'] if self.binary else event['text'])
 
-        # Gửi toàn bộ state mới tới WebSocket client
-        await self.send(text_data=json.dumps({
-            'device_id': state['device_id'],
-            'is_on': state['is_on'],
-            'attributes': state['attributes']
-        }))
+    def state_frames(self, states, batch):
+        if batch and self.legacy:
+            return [state_payload(state) for state in states]
+        return [state_frame(states, batch)]
 
     """
     Check double permission:
         1. Device phải thuộc về Room mà user đang connect.
         2. Room phải thuộc về chính user đó.
+    Cả 2 điều kiện được gói trong dict device_rooms (load lúc connect / subscribe).
     is_on vẫn là field riêng -> Thuận tiện cho query/filter.
+    State lấy từ device_state_cache: chỉ lần đầu mới query DB,
+    thay đổi được gộp lại và ghi xuống DB theo lô (write-behind).
     """
-    @sync_to_async
-    def update_device_state(self, device_id, new_attributes, user):
-        device = Device.objects.select_related('room__user').get(id=device_id)
-        
-        # kiểm tra quyền sở hữu của thiết bị.
-        if device.room.user != user:
-            raise PermissionDenied("You do not have permission to control this device.")
-        
+    async def update_device_state(self, device_id, new_attributes, user):
         # kiểm tra device có nằm trong room mà WebSocket kết nối hay không.
-        if str(device.room.id) != str(self.room_id):
+        # Room đã được check là của user lúc connect -> chỉ cần tra set, không join DB.
+        if device_id not in self.device_rooms:
             raise PermissionDenied("Device is not in the connected room.")
 
-        # Cập nhật is_on, has_changed = True nếu !is_on
-        has_changed = False
-        if 'is_on' in new_attributes and isinstance(new_attributes['is_on'], bool):
-            if device.is_on != new_attributes['is_on']:
-                device.is_on = new_attributes['is_on']
-                has_changed = True
-
-        # Cập nhật JSONField attributes
-        # JSONField có thể None -> tránh lỗi
-        current_attributes = device.attributes or {}
-        for key, value in new_attributes.items():
-            if key != 'is_on': # vòng lặp update từng key.
-                if current_attributes.get(key) != value:
-                    current_attributes[key] = value
-                    has_changed = True
-        
-        # Gán lại JSON
-        device.attributes = current_attributes
-
-        # Nếu có thay đổi -> Lưu vào database.
-        if has_changed:
-            device.save(update_fields=['is_on', 'attributes'])
-
-        # Trả về trạng thái đầy đủ sau khi cập nhật
-        return {
-            'device_id': device.id,
-            'is_on': device.is_on,
-            'attributes': device.attributes,
+        await device_state_cache.get(device_id)
+
+        # Merge trong bộ nhớ, trả về delta (None nếu không đổi gì)
+        return device_state_cache.apply(device_id, new_attributes)
+
+    async def update_device_states(self, updates, user):
+        """
+        Bản batch của update_device_state: updates = {device_id: attributes}.
+        Check quyền tất cả trước, rồi mới merge -> không có batch áp dụng dở dang.
+        Chỉ trả về delta của các device thực sự thay đổi.
+        """
+        if not self.device_rooms.keys() >= updates.keys():
+            raise PermissionDenied("Device is not in the connected room.")
+
+        # Update đơn lẻ còn chờ trong cửa sổ gộp cũ hơn batch -> áp dụng luôn cùng batch, batch ghi đè.
+        updates = {
+            device_id: {**update_coalescer.take_pending(device_id), **attributes}
+            for device_id, attributes in updates.items()
         }
 
+        entries = await device_state_cache.get_many(list(updates))
+        if len(entries) != len(updates):
+            raise Device.DoesNotExist
+        self.validate_updates(entries, updates)
+
+        deltas = [
+            device_state_cache.apply(device_id, attributes)
+            for device_id, attributes in updates.items()
+        ]
+        return [delta for delta in deltas if delta is not None]
+
+    @staticmethod
+    def validate_updates(entries, updates):
+        """
+        Kiểm tra {device_id: {is_on, key khác...}} theo schema của loại device (devices/attribute_schemas.py).
+        Raise AttributeSchemaError({device_id: {key: lỗi}}) nếu có device không hợp lệ, Device.DoesNotExist nếu thiếu entry.
+        """
+        errors = {}
+        for device_id, attributes in updates.items():
+            entry = entries.get(device_id)
+            if entry is None:
+                raise Device.DoesNotExist
+            try:
+                get_schema(entry['device_type']).validate_state(attributes)
+            except AttributeSchemaError as e:
+                errors[device_id] = e.errors
+        if errors:
+            raise AttributeSchemaError(errors)
+
     # Dùng để kiểm tra quyền trước khi join WebSocket room.
-    @sync_to_async
+    @timed_sync_to_async('check_room_owner', thread_sensitive=False)
     def check_room_owner(self, room_id, user_id):
         return Room.objects.filter(pk=room_id, user_id=user_id).exists()
 
+    # DeviceViewSet tạo/chuyển/xoá device -> cập nhật device_rooms, không gửi gì xuống client.
+    async def room_devices_changed(self, event):
+        room_id = event['room_id']
+        for device_id in event['added']:
+            self.device_rooms[device_id] = room_id
+        for device_id in event['removed']:
+            # Device chuyển room: event "added" của room mới có thể tới trước -> chỉ xoá nếu còn thuộc room này.
+            if self.device_rooms.get(device_id) == room_id:
+                del self.device_rooms[device_id]
+
+class UserDeviceConsumer(DeviceConsumer):
+    """
+    1 socket cho mọi room của user (ws/devices/): màn hình tổng quan không cần mở 1 socket / room.
+        - Xác thực 1 lần lúc connect, chưa join room nào.
+        - {"type": "subscribe", "room_ids": [1, 2]}: check quyền tất cả room bằng 1 query,
+          join group các room, load state bằng 1 query, gửi snapshot từng room.
+        - {"type": "unsubscribe", "room_ids": [2]}: rời group, bỏ device của room đó.
+        - Lệnh điều khiển (update/batch/resync) giống DeviceConsumer, route theo device -> room
+          (device_rooms), broadcast tới đúng group của room chứa device.
+    """
+    async def connect(self):
+        self.room_id = None
+        self.room_ids = set()
+        self.device_rooms = {}
+        self.user = self.scope.get('user')
+
+        if not self.user or self.user.is_anonymous:
+            WS_CONNECTS.labels('anonymous').inc()
+            await self.close()
+            return
+
+        await self.accept_protocol()
+        WS_CONNECTS.labels('accepted').inc()
+        log_event(logger, logging.INFO, 'ws.connect', user_id=self.user.id)
+
+    async def disconnect(self, close_code):
+        log_event(logger, logging.INFO, 'ws.disconnect', user_id=getattr(self.user, 'id', None), code=close_code)
+        for room_id in self.room_ids:
+            WS_CONNECTIONS.untrack(room_id)
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+        device_state_cache.unwatch(self.room_ids)
+        self.room_ids = set()
+
+    async def handle_message(self, data, received_at):
+        message_type = data.get('type') if isinstance(data, dict) else None
+
+        if message_type == 'subscribe':
+            WS_MESSAGES.labels('subscribe').inc()
+            await self.subscribe(self.parse_ids(data.get('room_ids')))
+            return
+
+        if message_type == 'unsubscribe':
+            WS_MESSAGES.labels('unsubscribe').inc()
+            await self.unsubscribe(self.parse_ids(data.get('room_ids')))
+            return
+
+        await super().handle_message(data, received_at)
+
+    @staticmethod
+    def parse_ids(values):
+        ids = set()
+        for value in values if isinstance(values, list) else ():
+            try:
+                ids.add(int(value))
+            except (TypeError, ValueError):
+                continue
+        return ids
+
+    async def subscribe(self, room_ids):
+        room_ids -= self.room_ids
+        if not room_ids:
+            return
+
+        owned = await self.owned_rooms(room_ids, self.user.id)
+        denied = room_ids - owned
+        if denied:
+            log_event(logger, logging.WARNING, 'ws.denied', room_ids=sorted(denied), user_id=self.user.id)
+            await self.send_frame({'error': 'Permission denied.', 'room_ids': sorted(denied)})
+        if not owned:
+            return
+
+        # Join group trước rồi mới đọc state (giống DeviceConsumer.connect).
+        for room_id in owned:
+            await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+            WS_CONNECTIONS.track(room_id)
+        device_state_cache.watch(owned)
+        self.room_ids |= owned
+
+        entries = await device_state_cache.get_rooms(sorted(owned))
+        by_room = {room_id: {} for room_id in owned}
+        for device_id, entry in entries.items():
+            self.device_rooms[device_id] = entry['room_id']
+            by_room[entry['room_id']][device_id] = entry
+
+        for room_id in sorted(by_room):
+            await self.send_states('snapshot', by_room[room_id], room_id=room_id)
+
+    async def unsubscribe(self, room_ids):
+        room_ids &= self.room_ids
+        for room_id in room_ids:
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+            WS_CONNECTIONS.untrack(room_id)
+        device_state_cache.unwatch(room_ids)
+        self.room_ids -= room_ids
+        self.device_rooms = {
+            device_id: room_id
+            for device_id, room_id in self.device_rooms.items()
+            if room_id not in room_ids
+        }
+
+    async def room_devices_changed(self, event):
+        # Event của room vừa unsubscribe còn trên đường tới -> bỏ qua.
+        if event['room_id'] in self.room_ids:
+            await super().room_devices_changed(event)
+
+    @timed_sync_to_async('owned_rooms', thread_sensitive=False)
+    def owned_rooms(self, room_ids, user_id):
+        return set(Room.objects.filter(pk__in=room_ids, user_id=user_id).values_list('id', flat=True))
+
+
+class GatewayConsumer(FrameProtocolMixin, AsyncWebsocketConsumer):
+    """
+    ws/gateway/ : gateway vật lý giữ 1 kết nối, gửi lô report state thật của device:
+        {"seq": 12, "reports": [[device_id, is_on, {attributes}], ...]}
+    -> {"type": "ack", "seq": 12, "changed": n, "unknown": [...], "rejected": {device_id: {key: lỗi}}}
+       hoặc {"type": "error", "seq", "error"}.
+    Xác thực: header "Authorization: Gateway <key>" hoặc ?key=<key> (firmware không set được header).
+    Xử lý giống POST /api/gateway/reports/ (devices/ingestion.py): bỏ giá trị không đổi,
+    ghi 1 lần, broadcast 1 event cho mỗi room. Gateway không join group nào.
+    """
+    async def connect(self):
+        key = parse_qs(self.scope.get('query_string', b'').decode()).get('key', [None])[0]
+        authorization = dict(self.scope.get('headers', [])).get(b'authorization', b'').decode(errors='ignore').split()
+        if len(authorization) == 2 and authorization[0].lower() == 'gateway':
+            key = authorization[1]
+
+        self.gateway = await self.authenticate_gateway(key) if key else None
+        if self.gateway is None:
+            WS_CONNECTS.labels('denied').inc()
+            await self.close()
+            return
+
+        await self.accept_protocol()
+        WS_CONNECTS.labels('accepted').inc()
+        log_event(logger, logging.INFO, 'gateway.connect', gateway_id=self.gateway.id, user_id=self.gateway.user_id)
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'gateway', None) is not None:
+            log_event(logger, logging.INFO, 'gateway.disconnect', gateway_id=self.gateway.id, code=close_code)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        seq = None
+        try:
+            data = self.decode_frame(text_data, bytes_data)
+            seq = data.get('seq') if isinstance(data, dict) else None
+            reports = parse_reports(data)
+        except ValueError as e:
+            WS_MESSAGES.labels('invalid').inc()
+            await self.send_frame({'type': 'error', 'seq': seq, 'error': str(e)})
+            return
+
+        WS_MESSAGES.labels('gateway').inc()
+        states, unknown, rejected = await self.ingest_reports(self.gateway, reports)
+        if states:
+            await publish_device_states(self.channel_layer, states, persisted=True)
+        await self.send_frame({
+            'type': 'ack', 'seq': seq, 'changed': len(states), 'unknown': unknown, 'rejected': rejected,
+        })
+
+    @timed_sync_to_async('authenticate_gateway', thread_sensitive=False)
+    def authenticate_gateway(self, key):
+        return authenticate_gateway(key)
+
+    # Ghi DB (merge_states, event lịch sử) -> chạy trên thread sync dùng chung như GatewayReportView,
+    # không chen ngang giữa evict() và save() của một request REST.
+    @timed_sync_to_async('ingest_reports')
+    def ingest_reports(self, gateway, reports):
+        return ingest_reports(gateway, reports)
+
+
 """
 Client gửi WebSocket message:
 {
@@ -153,12 +599,51 @@ Client gửi WebSocket message:
 ↓
 Consumer gọi update_device_state()
 ↓
-1. Lấy device + user
-2. Check user sở hữu room
-3. Check device thuộc room của WebSocket
-4. Update is_on
-5. Update attributes JSON
-6. Save nếu có thay đổi
-7. Trả về trạng thái mới
-8. Consumer broadcast cho toàn room
-"""
\ No newline at end of file
+1. Check device thuộc room của WebSocket (tra dict device_rooms load lúc connect,
+   quyền sở hữu room đã check 1 lần trong connect())
+2. Lấy device từ device_state_cache (miss -> query DB 1 lần)
+3. Update is_on
+4. Update attributes JSON
+5. Có thay đổi -> version + 1, ghi lại change chờ flush (merge xuống DB theo lô, state_merge.py)
+6. Trả về delta: chỉ các key đổi + version (không đổi gì -> None)
+7. Consumer broadcast delta cho toàn room (None -> không broadcast)
+
+Client chọn subprotocol "json.v1" (hoặc "msgpack.v1") lúc connect -> ngay sau khi connect, server gửi snapshot cả room:
+{"type": "snapshot", "devices": [{device_id, is_on, attributes (đầy đủ), version}, ...]}
+Broadcast nào có version <= version trong snapshot của device đó thì bỏ qua.
+Không chọn subprotocol (app cũ) -> không có snapshot, frame batch bên dưới được gửi thành từng frame 1 device.
+
+Attributes sai schema của loại device (key lạ, sai kiểu, ngoài khoảng, xem devices/attribute_schemas.py)
+-> {"error": "Invalid attributes.", "errors": {device_id: {key: lỗi}}}, cả message không được áp dụng.
+
+Client thấy version nhảy cóc (nhận 7 sau 5) -> gửi:
+{"type": "resync"}  hoặc  {"type": "resync", "device_ids": [12]}
+-> server trả riêng cho socket đó:
+{"type": "resync", "devices": [{device_id, is_on, attributes (đầy đủ), version}, ...]}
+
+Batch:
+{
+    "type": "batch",
+    "updates": [
+        {"device_id": 12, "attributes": {"is_on": false}},
+        {"device_id": 13, "attributes": {"is_on": false}}
+    ]
+}
+-> 1 lần check quyền, 1 lần bulk_update, 1 broadcast:
+{
+    "type": "batch",
+    "devices": [{device_id, is_on, attributes}, ...]
+}
+
+Multiplex (1 socket cho mọi room của user): ws/devices/?token=...
+{"type": "subscribe", "room_ids": [1, 2]}
+-> {"type": "snapshot", "room_id": 1, "devices": [...]}, {"type": "snapshot", "room_id": 2, "devices": [...]}
+   room không thuộc user -> {"error": "Permission denied.", "room_ids": [...]}
+{"type": "unsubscribe", "room_ids": [2]}
+Lệnh điều khiển / batch / resync giống hệt endpoint theo room; mọi frame state đều có room_id.
+
+Binary (mọi endpoint, kể cả ws/gateway/): client gửi subprotocol "msgpack.v1" lúc connect
+-> mọi frame (2 chiều) là MessagePack, key số nguyên theo devices/wire.py (GET /api/ws-schema/):
+{1: 12, 4: {0: true, 1: 80}}  ==  {"device_id": 12, "attributes": {"is_on": true, "brightness": 80}}
+Key chưa có trong bảng vẫn gửi dạng chuỗi. Không gửi subprotocol / "json.v1" -> JSON như trên.
+"""
@@ -0,0 +1,262 @@
+# devices/history.py
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Device, DeviceStateEvent, DeviceUsageRollup
+
+DEFAULTS = {
+    # Event thô giữ bao nhiêu ngày (sau khi đã compact).
+    'RAW_RETENTION_DAYS': 7,
+    # Bucket phút giữ bao nhiêu ngày (sau khi đã gom vào bucket giờ).
+    'MINUTE_RETENTION_DAYS': 2,
+    # Chỉ compact tới (now - SETTLE_SECONDS): event được ghi trễ tối đa 1 chu kỳ flush.
+    'SETTLE_SECONDS': 60,
+}
+
+MINUTE = timedelta(minutes=1)
+HOUR = timedelta(hours=1)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DEVICE_HISTORY', {})}
+
+
+def brightness_of(attributes):
+    brightness = (attributes or {}).get('brightness')
+    return brightness if isinstance(brightness, int) and not isinstance(brightness, bool) and brightness >= 0 else None
+
+
+def record_state_events(devices, recorded_at=None):
+    """
+    Ghi 1 event cho mỗi device (state hiện tại của instance) bằng 1 câu bulk_create.
+    Dùng cho REST create/update, đường WebSocket đi qua device_state_cache.flush().
+    """
+    recorded_at = recorded_at or timezone.now()
+    DeviceStateEvent.objects.bulk_create([
+        DeviceStateEvent(
+            device_id=device.pk,
+            recorded_at=recorded_at,
+            is_on=device.is_on,
+            brightness=brightness_of(device.attributes),
+        )
+        for device in devices
+    ])
+
+
+# --- Compaction: event thô -> bucket phút -> bucket giờ ---
+def floor_minute(value):
+    return value.replace(second=0, microsecond=0)
+
+
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def compact(now=None):
+    """
+    Chạy định kỳ (manage.py compact_device_history, vd: cron mỗi 5 phút).
+    Trả về (số bucket phút, số bucket giờ, số event thô đã xoá, số bucket phút đã xoá).
+    """
+    config = get_config()
+    now = now or timezone.now()
+    cutoff = floor_minute(now - timedelta(seconds=config['SETTLE_SECONDS']))
+
+    with transaction.atomic():
+        minutes = compact_minutes(cutoff)
+        hours = compact_hours(floor_hour(cutoff))
+
+    # Xoá theo khoảng thời gian (thay cho drop partition): chỉ xoá phần đã được compact.
+    raw_deleted, _ = DeviceStateEvent.objects.filter(
+        recorded_at__lt=cutoff - timedelta(days=config['RAW_RETENTION_DAYS'])
+    ).delete()
+    minute_deleted, _ = DeviceUsageRollup.objects.filter(
+        granularity=DeviceUsageRollup.Granularity.MINUTE,
+        bucket_start__lt=floor_hour(cutoff) - timedelta(days=config['MINUTE_RETENTION_DAYS']),
+    ).delete()
+    return minutes, hours, raw_deleted, minute_deleted
+
+
+def compact_minutes(cutoff):
+    """
+    Gom event trong [watermark, cutoff) thành bucket phút.
+    Device đang bật mà không có event nào vẫn được tính đủ 60s mỗi phút.
+    """
+    minute_rollups = DeviceUsageRollup.objects.filter(granularity=DeviceUsageRollup.Granularity.MINUTE)
+    last_bucket = minute_rollups.aggregate(last=Max('bucket_start'))['last']
+    if last_bucket is not None:
+        start = last_bucket + MINUTE
+    else:
+        first_event = DeviceStateEvent.objects.aggregate(first=Min('recorded_at'))['first']
+        if first_event is None:
+            return 0
+        start = floor_minute(first_event)
+    if start >= cutoff:
+        return 0
+
+    # State đầu window: lấy từ bucket phút ngay trước (lần compact trước).
+    carry = {
+        device_id: (ends_on, ends_brightness)
+        for device_id, ends_on, ends_brightness in minute_rollups.filter(
+            bucket_start=start - MINUTE
+        ).values_list('device_id', 'ends_on', 'ends_brightness')
+    }
+
+    events = defaultdict(list)
+    for device_id, recorded_at, is_on, brightness in DeviceStateEvent.objects.filter(
+        recorded_at__gte=start, recorded_at__lt=cutoff
+    ).order_by('device_id', 'recorded_at', 'id').values_list('device_id', 'recorded_at', 'is_on', 'brightness'):
+        events[device_id].append((recorded_at, is_on, brightness))
+
+    # Device có event nhưng không có bucket trước đó -> state = event gần nhất trước window (1 query).
+    missing = [device_id for device_id in events if device_id not in carry]
+    if missing:
+        previous = DeviceStateEvent.objects.filter(
+            device=OuterRef('pk'), recorded_at__lt=start
+        ).order_by('-recorded_at', '-id')
+        for device_id, is_on, brightness in Device.objects.filter(id__in=missing).annotate(
+            last_on=Subquery(previous.values('is_on')[:1]),
+            last_brightness=Subquery(previous.values('brightness')[:1]),
+        ).values_list('id', 'last_on', 'last_brightness'):
+            carry[device_id] = (bool(is_on), brightness)
+
+    rollups = []
+    for device_id in set(carry) | set(events):
+        is_on, brightness = carry.get(device_id, (False, None))
+        device_events = events.get(device_id, [])
+        if not is_on and not device_events:
+            continue
+        rollups.extend(integrate_minutes(device_id, start, cutoff, is_on, brightness, device_events))
+
+    DeviceUsageRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def integrate_minutes(device_id, start, cutoff, is_on, brightness, events):
+    """
+    Tính on_seconds / brightness_seconds cho từng phút trong [start, cutoff).
+    Chỉ tạo bucket cho phút có bật hoặc có event, và luôn tạo bucket cuối nếu đang bật
+    (để lần compact sau biết state đầu window).
+    """
+    rollups = []
+    index = 0
+    bucket = start
+    while bucket < cutoff:
+        bucket_end = bucket + MINUTE
+        on_seconds = brightness_seconds = 0.0
+        cursor = bucket
+        had_event = False
+
+        while index < len(events) and events[index][0] < bucket_end:
+            recorded_at, next_on, next_brightness = events[index]
+            if is_on:
+                seconds = (recorded_at - cursor).total_seconds()
+                on_seconds += seconds
+                brightness_seconds += seconds * (brightness or 0)
+            cursor, is_on, brightness = recorded_at, next_on, next_brightness
+            had_event = True
+            index += 1
+
+        if is_on:
+            seconds = (bucket_end - cursor).total_seconds()
+            on_seconds += seconds
+            brightness_seconds += seconds * (brightness or 0)
+
+        if on_seconds or had_event:
+            rollups.append(DeviceUsageRollup(
+                device_id=device_id,
+                granularity=DeviceUsageRollup.Granularity.MINUTE,
+                bucket_start=bucket,
+                on_seconds=on_seconds,
+                brightness_seconds=brightness_seconds,
+                ends_on=is_on,
+                ends_brightness=brightness,
+            ))
+
+        # Đang tắt và hết event -> các phút còn lại đều = 0, bỏ qua luôn.
+        if not is_on and index >= len(events):
+            break
+        bucket = bucket_end
+    return rollups
+
+
+def compact_hours(end):
+    """
+    Gom bucket phút của các giờ đã trọn vẹn [watermark, end) thành bucket giờ (1 query aggregate).
+    """
+    hour_rollups = DeviceUsageRollup.objects.filter(granularity=DeviceUsageRollup.Granularity.HOUR)
+    minute_rollups = DeviceUsageRollup.objects.filter(granularity=DeviceUsageRollup.Granularity.MINUTE)
+
+    last_bucket = hour_rollups.aggregate(last=Max('bucket_start'))['last']
+    if last_bucket is not None:
+        start = last_bucket + HOUR
+    else:
+        first_minute = minute_rollups.aggregate(first=Min('bucket_start'))['first']
+        if first_minute is None:
+            return 0
+        start = floor_hour(first_minute)
+    if start >= end:
+        return 0
+
+    rows = minute_rollups.filter(bucket_start__gte=start, bucket_start__lt=end).annotate(
+        hour=TruncHour('bucket_start')
+    ).values('device_id', 'hour').annotate(
+        on_seconds_sum=Sum('on_seconds'),
+        brightness_seconds_sum=Sum('brightness_seconds'),
+    )
+    rollups = [
+        DeviceUsageRollup(
+            device_id=row['device_id'],
+            granularity=DeviceUsageRollup.Granularity.HOUR,
+            bucket_start=row['hour'],
+            on_seconds=row['on_seconds_sum'],
+            brightness_seconds=row['brightness_seconds_sum'],
+        )
+        for row in rows
+    ]
+    DeviceUsageRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+# --- Range query ---
+def usage_summary(devices, start, end):
+    """
+    Tổng on-hours / avg brightness của từng device trong [start, end).
+    Đọc bucket giờ, phần cuối chưa gom thành giờ thì đọc bucket phút -> 3 query aggregate.
+    Phần chưa compact (vài phút gần nhất) chưa được tính.
+    """
+    # Watermark bucket giờ (toàn bảng, đi theo index granularity + bucket_start).
+    hour_end = DeviceUsageRollup.objects.filter(granularity=DeviceUsageRollup.Granularity.HOUR).aggregate(
+        last=Max('bucket_start')
+    )['last']
+    hour_end = min(end, hour_end + HOUR) if hour_end is not None else start
+
+    rollups = DeviceUsageRollup.objects.filter(device__in=devices)
+    totals = defaultdict(lambda: [0.0, 0.0])
+    ranges = [
+        (DeviceUsageRollup.Granularity.HOUR, start, hour_end),
+        (DeviceUsageRollup.Granularity.MINUTE, max(start, hour_end), end),
+    ]
+    for granularity, range_start, range_end in ranges:
+        if range_start >= range_end:
+            continue
+        for row in rollups.filter(
+            granularity=granularity, bucket_start__gte=range_start, bucket_start__lt=range_end
+        ).values('device_id').annotate(on_seconds_sum=Sum('on_seconds'), brightness_seconds_sum=Sum('brightness_seconds')):
+            totals[row['device_id']][0] += row['on_seconds_sum']
+            totals[row['device_id']][1] += row['brightness_seconds_sum']
+
+    return [
+        {
+            'device_id': device_id,
+            'on_hours': round(on_seconds / 3600, 3),
+            # Device không có brightness (binarySwitch) -> None thay vì 0.
+            'avg_brightness': round(brightness_seconds / on_seconds, 1) if on_seconds and brightness_seconds else None,
+        }
+        for device_id, (on_seconds, brightness_seconds) in sorted(totals.items())
+    ]
@@ -0,0 +1,95 @@
+# devices/http_cache.py
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+DEFAULTS = {
+    # Response đã serialize được giữ bao lâu (giây). Có ghi thì revision đổi -> key cũ tự bỏ.
+    'TIMEOUT': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DEVICE_RESPONSE_CACHE', {})}
+
+
+def revision_key(user_id):
+    return f'devices:rev:{user_id}'
+
+
+def get_revision(user_id):
+    """
+    Revision của "nhà" (rooms + devices) của user: thời điểm (ns) lần ghi gần nhất.
+    Chưa có (cache mới khởi động) -> lấy thời điểm hiện tại, client sẽ tải lại 1 lần.
+    """
+    revision = cache.get(revision_key(user_id))
+    if revision is None:
+        cache.add(revision_key(user_id), time.time_ns(), None)
+        revision = cache.get(revision_key(user_id))
+    return revision
+
+
+def bump_revision(user_id):
+    # Gọi sau mọi thao tác ghi room/device của user -> ETag đổi, response cache cũ hết hiệu lực.
+    cache.set(revision_key(user_id), time.time_ns(), None)
+
+
+def bump_revisions(user_ids):
+    now = time.time_ns()
+    cache.set_many({revision_key(user_id): now for user_id in user_ids}, None)
+
+
+class ConditionalCacheMixin:
+    """
+    Mixin cho ViewSet list/retrieve theo user:
+        - ETag / Last-Modified lấy từ revision của user -> nhà không đổi thì trả 304, không serialize gì.
+        - Response đã serialize được cache theo (user, revision, URL) -> lần GET sau không chạm DB.
+    Các thao tác ghi phải gọi bump_revision(user_id).
+    """
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalCacheMixin, self).retrieve(request, *args, **kwargs))
+
+    def conditional_response(self, request, build_response):
+        user_id = request.user.id
+        revision = get_revision(user_id)
+        path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()[:12]
+        etag = f'"{revision:x}-{path_hash}"'
+        last_modified = revision // 1_000_000_000
+
+        if self.is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache_key = f'devices:resp:{user_id}:{revision}:{path_hash}'
+            data = cache.get(cache_key)
+            if data is None:
+                response = build_response()
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(cache_key, response.data, get_config()['TIMEOUT'])
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Response riêng của từng user, client phải hỏi lại (conditional) mỗi lần dùng.
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @staticmethod
+    def is_not_modified(request, etag, last_modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            # Có If-None-Match thì bỏ qua If-Modified-Since (RFC 9110).
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+        return if_modified_since is not None and last_modified <= if_modified_since
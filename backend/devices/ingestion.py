@@ -0,0 +1,140 @@
+# devices/ingestion.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import authentication, exceptions
+
+from .attribute_schemas import AttributeSchemaError, get_schema
+from .models import Device, Gateway
+from .state_cache import device_state_cache
+from .state_merge import apply_device_updates
+
+DEFAULTS = {
+    # Số report tối đa trong 1 lô (HTTP hoặc 1 message WebSocket).
+    'MAX_REPORTS': 1000,
+    # last_seen_at của gateway chỉ ghi lại nếu đã cũ hơn bao nhiêu giây (không UPDATE mỗi lô).
+    'LAST_SEEN_INTERVAL': 60,
+}
+
+_MISSING = object()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DEVICE_INGESTION', {})}
+
+
+def authenticate_gateway(key):
+    """
+    key thô -> Gateway (kèm user) hoặc None. Lookup theo SHA-256 của key (unique index), 1 query.
+    """
+    if not key:
+        return None
+    try:
+        gateway = Gateway.objects.select_related('user').get(key_hash=Gateway.hash_key(key), user__is_active=True)
+    except Gateway.DoesNotExist:
+        return None
+
+    now = timezone.now()
+    if gateway.last_seen_at is None or now - gateway.last_seen_at > timedelta(seconds=get_config()['LAST_SEEN_INTERVAL']):
+        Gateway.objects.filter(pk=gateway.pk).update(last_seen_at=now)
+        gateway.last_seen_at = now
+    return gateway
+
+
+class GatewayAuthentication(authentication.BaseAuthentication):
+    """
+    Header "Authorization: Gateway <key>" -> request.user = chủ gateway, request.auth = gateway.
+    """
+    keyword = 'Gateway'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid gateway header.')
+        gateway = authenticate_gateway(auth[1].decode(errors='ignore'))
+        if gateway is None:
+            raise exceptions.AuthenticationFailed('Invalid gateway key.')
+        return gateway.user, gateway
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+def parse_reports(data):
+    """
+    Lô report dạng gọn: {"reports": [[device_id, is_on, {attributes}], ...]}
+        - is_on = null -> không báo is_on, {attributes} có thể bỏ.
+        - Cùng device xuất hiện nhiều lần -> gộp, report sau ghi đè report trước.
+    Trả về {device_id: {is_on, key khác...}} (cùng dạng với apply_device_updates).
+    Raise ValueError nếu sai format.
+    """
+    reports = data.get('reports') if isinstance(data, dict) else None
+    if not isinstance(reports, list) or not reports:
+        raise ValueError('Expected a non-empty list of reports.')
+    if len(reports) > get_config()['MAX_REPORTS']:
+        raise ValueError(f"At most {get_config()['MAX_REPORTS']} reports per batch.")
+
+    merged = {}
+    for index, report in enumerate(reports):
+        if not isinstance(report, list) or not 2 <= len(report) <= 3:
+            raise ValueError(f'Report {index}: expected [device_id, is_on, attributes].')
+        device_id, is_on = report[0], report[1]
+        attributes = report[2] if len(report) == 3 else {}
+        if (
+            not isinstance(device_id, int) or isinstance(device_id, bool)
+            or not (is_on is None or isinstance(is_on, bool))
+            or not isinstance(attributes, dict)
+        ):
+            raise ValueError(f'Report {index}: expected [device_id, is_on, attributes].')
+
+        state = merged.setdefault(device_id, {})
+        state.update((key, value) for key, value in attributes.items() if key != 'is_on')
+        if is_on is not None:
+            state['is_on'] = is_on
+    return merged
+
+
+def ingest_reports(gateway, reports):
+    """
+    Áp dụng lô report của gateway:
+        - 1 query đọc state hiện tại của các device (chỉ device trong nhà của chủ gateway),
+          device đang có trong device_state_cache thì so với cache (mới hơn DB).
+        - Report sai schema của loại device (key lạ, ngoài khoảng,...) -> bỏ device đó, báo lại lỗi.
+        - Bỏ các giá trị không đổi: gateway thường báo lại toàn bộ state mỗi chu kỳ,
+          device không đổi gì -> không ghi, không tăng version, không broadcast.
+        - Phần đổi ghi bằng 1 lần apply_device_updates.
+    Trả về (states để publish_device_states, list device_id không tìm thấy / không thuộc user,
+    {device_id: lỗi schema}).
+    """
+    rows = Device.objects.filter(id__in=list(reports), room__user_id=gateway.user_id).values(
+        'id', 'device_type', 'is_on', 'attributes'
+    )
+    current = {row['id']: row for row in rows}
+
+    updates, rejected = {}, {}
+    for device_id, report in reports.items():
+        state = current.get(device_id)
+        if state is None:
+            continue
+        try:
+            get_schema(state['device_type']).validate_state(report)
+        except AttributeSchemaError as e:
+            rejected[device_id] = e.errors
+            continue
+        state = device_state_cache.peek(device_id) or state
+        attributes = state['attributes'] or {}
+        changed = {
+            key: value for key, value in report.items()
+            if key != 'is_on' and attributes.get(key, _MISSING) != value
+        }
+        if 'is_on' in report and report['is_on'] != state['is_on']:
+            changed['is_on'] = report['is_on']
+        if changed:
+            updates[device_id] = changed
+
+    states = apply_device_updates(updates, user_ids={gateway.user_id}) if updates else []
+    unknown = sorted(set(reports) - set(current))
+    return states, unknown, rejected
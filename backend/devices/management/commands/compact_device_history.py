@@ -0,0 +1,16 @@
+# devices/management/commands/compact_device_history.py
+# python manage.py compact_device_history   (cron mỗi 5 phút)
+from django.core.management.base import BaseCommand
+
+from devices.history import compact
+
+
+class Command(BaseCommand):
+    help = "Gom lịch sử state device thành bucket phút/giờ và xoá dữ liệu thô đã hết hạn."
+
+    def handle(self, *args, **options):
+        minutes, hours, raw_deleted, minute_deleted = compact()
+        self.stdout.write(
+            f"minute buckets: {minutes}, hour buckets: {hours}, "
+            f"deleted events: {raw_deleted}, deleted minute buckets: {minute_deleted}"
+        )
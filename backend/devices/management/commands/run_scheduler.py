@@ -0,0 +1,13 @@
+# python manage.py run_scheduler   (1 process cho cả hệ thống, chạy cùng daphne)
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from devices.schedules import SchedulerWorker
+
+
+class Command(BaseCommand):
+    help = "Chạy các schedule / automation tới giờ, ghi state device và broadcast cho các room."
+
+    def handle(self, *args, **options):
+        asyncio.run(SchedulerWorker().run())
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0002_device_attributes_device_device_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
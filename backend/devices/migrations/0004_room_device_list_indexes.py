@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0003_device_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['room', 'device_type'], name='devices_dev_room_id_01c6a8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['room', 'is_on'], name='devices_dev_room_id_a86249_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['user', 'id'], name='devices_roo_user_id_fd7894_idx'),
+        ),
+    ]
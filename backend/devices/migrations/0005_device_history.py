@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0004_room_device_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceStateEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField()),
+                ('is_on', models.BooleanField()),
+                ('brightness', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='state_events', to='devices.device')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['device', 'recorded_at'], name='devices_dev_device__4013ce_idx'), models.Index(fields=['recorded_at'], name='devices_dev_recorde_2b1047_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeviceUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('on_seconds', models.FloatField(default=0)),
+                ('brightness_seconds', models.FloatField(default=0)),
+                ('ends_on', models.BooleanField(default=False)),
+                ('ends_brightness', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='devices.device')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['granularity', 'bucket_start'], name='devices_dev_granula_4e242d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('device', 'granularity', 'bucket_start'), name='unique_device_usage_bucket')],
+            },
+        ),
+    ]
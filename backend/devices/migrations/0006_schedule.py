@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_device_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Schedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('trigger', models.CharField(choices=[('once', 'Once'), ('daily', 'Daily'), ('sunrise', 'Sunrise'), ('sunset', 'Sunset')], max_length=10)),
+                ('run_at', models.DateTimeField(blank=True, null=True)),
+                ('time_of_day', models.TimeField(blank=True, null=True)),
+                ('timezone', models.CharField(default='UTC', max_length=64)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('offset_minutes', models.IntegerField(default=0)),
+                ('attributes', models.JSONField(default=dict)),
+                ('enabled', models.BooleanField(default=True)),
+                ('next_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('devices', models.ManyToManyField(related_name='schedules', to='devices.device')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='devices_sch_user_id_a091db_idx'), models.Index(fields=['enabled', 'next_run_at'], name='devices_sch_enabled_f77dfd_idx')],
+            },
+        ),
+    ]
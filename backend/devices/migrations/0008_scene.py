@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_gateway'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scene',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('revision', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scenes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SceneTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attributes', models.JSONField(default=dict)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scene_targets', to='devices.device')),
+                ('scene', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='targets', to='devices.scene')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='scene',
+            index=models.Index(fields=['user', 'id'], name='devices_sce_user_id_222fd7_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='scenetarget',
+            constraint=models.UniqueConstraint(fields=('scene', 'device'), name='unique_scene_device'),
+        ),
+    ]
@@ -1,4 +1,7 @@
 # devices/models.py
+import hashlib
+import secrets
+
 from django.db import models
 from django.conf import settings
 
@@ -14,6 +17,12 @@ class Room(models.Model):
     )
     name = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            # List room của user theo cursor (ORDER BY id).
+            models.Index(fields=['user', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.name} (của {self.user.email})"
 
@@ -46,5 +55,189 @@ class Device(models.Model):
     
     attributes = models.JSONField(default=dict, blank=True)
 
+    # Tăng 1 mỗi lần state (is_on/attributes) đổi -> client phát hiện mất update để xin resync.
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Filter ?room=&device_type= và ?room=&is_on= của DeviceViewSet.
+            models.Index(fields=['room', 'device_type']),
+            models.Index(fields=['room', 'is_on']),
+        ]
+
     def __str__(self):
-        return f"{self.name} ({self.get_device_type_display()}) in {self.room.name}"
\ No newline at end of file
+        return f"{self.name} ({self.get_device_type_display()}) in {self.room.name}"
+
+class DeviceStateEvent(models.Model):
+    """
+    Lịch sử state (append-only): mỗi dòng = device chuyển sang state mới lúc recorded_at.
+        - Ghi theo lô (bulk_create) lúc device_state_cache flush / REST ghi, không ghi trên hot path.
+        - Chỉ giữ RAW_RETENTION_DAYS ngày, sau đó compact_device_history gom vào DeviceUsageRollup rồi xoá.
+    """
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.CASCADE,
+        related_name='state_events'
+    )
+    recorded_at = models.DateTimeField()
+    is_on = models.BooleanField()
+    brightness = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['device', 'recorded_at']),
+            # Compaction / xoá theo khoảng thời gian.
+            models.Index(fields=['recorded_at']),
+        ]
+
+
+class DeviceUsageRollup(models.Model):
+    """
+    Thống kê sử dụng theo bucket thời gian (phút / giờ):
+        - on_seconds: số giây device bật trong bucket.
+        - brightness_seconds: tích phân brightness theo thời gian bật -> avg = brightness_seconds / on_seconds.
+        - ends_on / ends_brightness: state ở cuối bucket (bucket phút), để lần compact sau nối tiếp.
+    """
+    class Granularity(models.TextChoices):
+        MINUTE = 'minute', 'Minute'
+        HOUR = 'hour', 'Hour'
+
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.CASCADE,
+        related_name='usage_rollups'
+    )
+    granularity = models.CharField(max_length=10, choices=Granularity.choices)
+    bucket_start = models.DateTimeField()
+    on_seconds = models.FloatField(default=0)
+    brightness_seconds = models.FloatField(default=0)
+    ends_on = models.BooleanField(default=False)
+    ends_brightness = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'granularity', 'bucket_start'], name='unique_device_usage_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'bucket_start']),
+        ]
+
+    @property
+    def avg_brightness(self):
+        return self.brightness_seconds / self.on_seconds if self.on_seconds else None
+
+
+class Schedule(models.Model):
+    """
+    Hẹn giờ / automation của user: tới giờ -> áp dụng attributes (có thể có is_on) cho các device.
+        - once: chạy 1 lần lúc run_at.
+        - daily: mỗi ngày lúc time_of_day, theo timezone của schedule.
+        - sunrise / sunset: lúc mặt trời mọc / lặn ở (latitude, longitude), lệch offset_minutes phút.
+    next_run_at do server tính lại mỗi lần lưu / chạy; worker run_scheduler giữ (next_run_at, id)
+    trong heap, không quét bảng.
+    """
+    class Trigger(models.TextChoices):
+        ONCE = 'once', 'Once'
+        DAILY = 'daily', 'Daily'
+        SUNRISE = 'sunrise', 'Sunrise'
+        SUNSET = 'sunset', 'Sunset'
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='schedules'
+    )
+    name = models.CharField(max_length=100)
+    trigger = models.CharField(max_length=10, choices=Trigger.choices)
+    run_at = models.DateTimeField(null=True, blank=True)
+    time_of_day = models.TimeField(null=True, blank=True)
+    timezone = models.CharField(max_length=64, default='UTC')
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    offset_minutes = models.IntegerField(default=0)
+
+    devices = models.ManyToManyField(Device, related_name='schedules')
+    # Giống message WebSocket: {"is_on": false} / {"brightness": 30}.
+    attributes = models.JSONField(default=dict)
+
+    enabled = models.BooleanField(default=True)
+    next_run_at = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            # Worker load các schedule còn lần chạy lúc khởi động.
+            models.Index(fields=['enabled', 'next_run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_trigger_display()})"
+
+
+class Scene(models.Model):
+    """
+    Preset state cho nhiều device (có thể ở nhiều room): "xem phim", "ra khỏi nhà",...
+    Áp dụng = 1 request POST /api/scenes/<id>/apply/ -> 1 câu UPDATE cho mọi device, 1 broadcast / room.
+    revision tăng mỗi lần sửa scene -> plan đã resolve trong cache (devices/scenes.py) tự hết hiệu lực.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='scenes'
+    )
+    name = models.CharField(max_length=100)
+    revision = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class SceneTarget(models.Model):
+    # State đích của 1 device trong scene, giống message WebSocket: {"is_on": true, "brightness": 30}.
+    scene = models.ForeignKey(Scene, on_delete=models.CASCADE, related_name='targets')
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='scene_targets')
+    attributes = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scene', 'device'], name='unique_scene_device'),
+        ]
+
+    def __str__(self):
+        return f"{self.scene.name}: {self.device.name}"
+
+
+class Gateway(models.Model):
+    """
+    Gateway vật lý (hub Zigbee, ESP32,...) báo state thật của device trong nhà của user.
+        - Xác thực bằng key (tạo 1 lần, chỉ trả về lúc tạo); DB chỉ giữ SHA-256 của key.
+        - Chỉ được báo state device thuộc các room của user.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='gateways'
+    )
+    name = models.CharField(max_length=100)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def set_new_key(self):
+        # Trả về key thô để gửi cho client đúng 1 lần.
+        key = secrets.token_urlsafe(32)
+        self.key_hash = self.hash_key(key)
+        return key
+
+    def __str__(self):
+        return f"{self.name} (của {self.user.email})"
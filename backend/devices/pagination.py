@@ -0,0 +1,20 @@
+# devices/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Phân trang keyset theo id: ?page_size=100 -> trang đầu, sau đó đi theo link next/previous (?cursor=...).
+    Trang sau không phải OFFSET qua các trang trước -> nhanh đều cho tài khoản có rất nhiều device.
+    Không truyền cursor/page_size -> trả list như cũ (app Flutter hiện tại vẫn chạy).
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,135 @@
+# devices/realtime.py
+import json
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from home_electronics_backend.metrics import GROUP_SEND
+
+from .state_cache import device_state_cache
+from .wire import encode_binary
+
+try:
+    # Không bắt buộc: encode nhanh hơn json ~5-10 lần, không có thì dùng json.
+    import orjson
+except ImportError:
+    orjson = None
+
+# Group của các worker run_scheduler: REST báo schedule đổi, worker cập nhật heap.
+SCHEDULES_GROUP = 'schedules'
+
+
+def room_group_name(room_id):
+    # Tên group của room trên channel layer: room_1, room_2,...
+    return f'room_{room_id}'
+
+
+def encode_frame(frame):
+    # dict -> text gửi xuống WebSocket (JSON gọn, không khoảng trắng).
+    if orjson is not None:
+        try:
+            return orjson.dumps(frame).decode()
+        except TypeError:
+            # orjson không nhận số nguyên > 64 bit,... -> để json xử lý.
+            pass
+    return json.dumps(frame, separators=(',', ':'))
+
+
+def state_payload(state):
+    # attributes chỉ gồm các key vừa đổi; version để client phát hiện mất update.
+    return {
+        'device_id': state['device_id'],
+        'room_id': state.get('room_id'),
+        'is_on': state['is_on'],
+        'attributes': state['attributes'],
+        'version': state.get('version'),
+    }
+
+
+def state_frame(states, batch):
+    if batch:
+        return {'type': 'batch', 'devices': [state_payload(state) for state in states]}
+    return state_payload(states[0])
+
+
+def state_event(states, batch=None, persisted=None):
+    """
+    Event device_state_update cho group_send, frame gửi xuống client được encode 1 lần ở phía gửi
+    ('text' cho socket JSON, 'bytes' cho socket msgpack.v1, xem wire.py):
+    consumer của từng socket trong room chỉ forward, không dựng dict / encode lại,
+    channel layer cũng chỉ phải chuyển chuỗi đã encode thay vì cả cấu trúc state.
+        - batch: frame 'batch' (mặc định khi có nhiều hơn 1 state), kèm 'texts' = frame JSON của từng
+          device cho client cũ không hiểu frame batch (không chọn subprotocol, xem wire.py).
+        - persisted: token của lần ghi thẳng DB -> kèm 'states' để consumer merge vào cache (absorb).
+    """
+    if batch is None:
+        batch = len(states) > 1
+    frame = state_frame(states, batch)
+    event = {'type': 'device_state_update', 'text': encode_frame(frame), 'bytes': encode_binary(frame)}
+    if batch:
+        event['texts'] = [encode_frame(state_payload(state)) for state in states]
+    if persisted:
+        event.update(persisted=persisted, states=states, batch=batch)
+    return event
+
+
+async def send_room_event(channel_layer, room_id, event):
+    # group_send qua channel layer (Redis), có đo thời gian.
+    with GROUP_SEND.time():
+        await channel_layer.group_send(room_group_name(room_id), event)
+
+
+async def publish_device_states(channel_layer, states, persisted=False):
+    """
+    Broadcast state đã ghi (apply_device_updates) giống consumer: 1 event cho mỗi room,
+    1 device -> frame state, nhiều device -> frame batch (client vẽ lại 1 lần).
+    persisted=True: state đã nằm trên DB -> event mang 1 id duy nhất của lần ghi, cache của
+    process này và consumer ở mọi process merge luôn vào device_state_cache (DeviceStateCache.absorb).
+    """
+    token = uuid.uuid4().hex if persisted else None
+    if token:
+        for state in states:
+            device_state_cache.absorb(state, token)
+
+    by_room = {}
+    for state in states:
+        by_room.setdefault(state['room_id'], []).append(state)
+    for room_id, room_states in by_room.items():
+        await send_room_event(channel_layer, room_id, state_event(room_states, persisted=token))
+
+
+def notify_room_devices_changed(room_id, added=(), removed=()):
+    """
+    Báo cho các DeviceConsumer đang mở của room biết danh sách device đã đổi
+    (tạo mới, chuyển room, xoá) -> consumer cập nhật device_rooms trong bộ nhớ.
+    Gửi sau khi transaction commit để consumer không thấy dữ liệu chưa ghi.
+    """
+    message = {
+        'type': 'room_devices_changed',
+        'room_id': room_id,
+        'added': list(added),
+        'removed': list(removed),
+    }
+    channel_layer = get_channel_layer()
+    transaction.on_commit(
+        lambda: async_to_sync(channel_layer.group_send)(room_group_name(room_id), message)
+    )
+
+
+def notify_schedule_changed(schedule_id, next_run_at):
+    """
+    Báo worker run_scheduler thời điểm chạy mới của schedule (None = xoá / tắt / không còn lần chạy nào)
+    -> worker sửa heap trong bộ nhớ, không phải quét lại bảng Schedule.
+    Gửi sau khi transaction commit.
+    """
+    message = {
+        'type': 'schedule.changed',
+        'schedule_id': schedule_id,
+        'next_run_at': next_run_at.timestamp() if next_run_at else None,
+    }
+    channel_layer = get_channel_layer()
+    transaction.on_commit(
+        lambda: async_to_sync(channel_layer.group_send)(SCHEDULES_GROUP, message)
+    )
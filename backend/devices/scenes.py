@@ -0,0 +1,64 @@
+# devices/scenes.py
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .attribute_schemas import AttributeSchemaError, get_schema
+from .models import Scene, SceneTarget
+from .state_merge import apply_device_updates
+
+DEFAULTS = {
+    # Plan đã resolve của scene được giữ bao lâu (giây). Sửa scene -> revision đổi, key cũ tự bỏ.
+    'PLAN_TIMEOUT': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SCENES', {})}
+
+
+def plan_key(scene_id, revision):
+    return f'devices:scene:{scene_id}:{revision}'
+
+
+def resolve_plan(scene):
+    """
+    Scene -> plan {device_id: {is_on, key khác...}} dạng updates của apply_device_updates, 1 query:
+        - Chỉ device còn thuộc nhà của chủ scene.
+        - Target không còn hợp lệ với loại device hiện tại (device đã đổi loại) -> bỏ.
+    """
+    rows = SceneTarget.objects.filter(
+        scene_id=scene.pk, device__room__user_id=scene.user_id,
+    ).values_list('device_id', 'device__device_type', 'attributes')
+
+    plan = {}
+    for device_id, device_type, attributes in rows:
+        try:
+            plan[device_id] = get_schema(device_type).validate_state(attributes)
+        except AttributeSchemaError:
+            continue
+    return plan
+
+
+def get_plan(scene):
+    # Plan trong cache (theo revision của scene), miss -> resolve rồi giữ PLAN_TIMEOUT giây.
+    key = plan_key(scene.pk, scene.revision)
+    plan = cache.get(key)
+    if plan is None:
+        plan = resolve_plan(scene)
+        cache.set(key, plan, get_config()['PLAN_TIMEOUT'])
+    return plan
+
+
+def apply_scene(scene):
+    """
+    Áp dụng scene: plan trong cache + 1 lần apply_device_updates (1 câu merge_states cho mọi device,
+    1 câu bulk_create lịch sử). Trả về list state để publish_device_states (1 event cho mỗi room).
+    """
+    plan = get_plan(scene)
+    return apply_device_updates(plan, user_ids={scene.user_id}) if plan else []
+
+
+def invalidate_scene_plans(device_ids):
+    # Device đổi loại -> target của device có thể không còn hợp lệ, bỏ plan của các scene chứa device đó.
+    Scene.objects.filter(targets__device_id__in=list(device_ids)).update(revision=F('revision') + 1)
@@ -0,0 +1,279 @@
+# devices/schedules.py
+import asyncio
+import heapq
+import logging
+import math
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from home_electronics_backend.log import log_event
+from home_electronics_backend.metrics import timed_sync_to_async
+
+from .attribute_schemas import AttributeSchemaError, get_schema
+from .models import Schedule
+from .realtime import SCHEDULES_GROUP, publish_device_states
+from .state_merge import apply_device_updates
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Số schedule tối đa chạy trong 1 lô (1 lần apply_device_updates).
+    'BATCH_SIZE': 500,
+    # Chu kỳ (giây) load lại toàn bộ heap từ DB, phòng trường hợp mất message schedule.changed.
+    'RELOAD_INTERVAL': 3600,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SCHEDULER', {})}
+
+
+# --- Thời điểm chạy ---
+def sun_time(day, latitude, longitude, trigger):
+    """
+    Giờ mặt trời mọc / lặn (UTC) của ngày day theo công thức rút gọn của NOAA, sai số ~1-2 phút.
+    None nếu hôm đó mặt trời không mọc / không lặn (vùng cực).
+    """
+    gamma = 2 * math.pi / 365 * (day.timetuple().tm_yday - 1)
+    eqtime = 229.18 * (
+        0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+        - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma)
+    )
+    decl = (
+        0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+        - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+        - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma)
+    )
+    lat = math.radians(latitude)
+    cos_hour_angle = math.cos(math.radians(90.833)) / (math.cos(lat) * math.cos(decl)) - math.tan(lat) * math.tan(decl)
+    if not -1 <= cos_hour_angle <= 1:
+        return None
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+    if trigger == Schedule.Trigger.SUNRISE:
+        minutes = 720 - 4 * (longitude + hour_angle) - eqtime
+    else:
+        minutes = 720 - 4 * (longitude - hour_angle) - eqtime
+    return datetime.combine(day, dt_time(0), tzinfo=dt_timezone.utc) + timedelta(minutes=minutes)
+
+
+def compute_next_run(schedule, after):
+    """
+    Lần chạy kế tiếp sau thời điểm after (datetime aware), None nếu không còn lần nào
+    (once đã qua giờ, schedule tắt, vùng cực cả năm không có mặt trời mọc / lặn).
+    """
+    if not schedule.enabled:
+        return None
+
+    if schedule.trigger == Schedule.Trigger.ONCE:
+        return schedule.run_at if schedule.run_at and schedule.run_at > after else None
+
+    if schedule.trigger == Schedule.Trigger.DAILY:
+        tz = ZoneInfo(schedule.timezone)
+        day = after.astimezone(tz).date()
+        for offset in range(2):
+            candidate = datetime.combine(day + timedelta(days=offset), schedule.time_of_day, tzinfo=tz)
+            if candidate > after:
+                return candidate.astimezone(dt_timezone.utc)
+        return None
+
+    # sunrise / sunset: thử từng ngày (UTC) từ hôm qua, vùng cực có thể phải chờ cả tháng.
+    offset = timedelta(minutes=schedule.offset_minutes)
+    day = after.astimezone(dt_timezone.utc).date() - timedelta(days=1)
+    for i in range(370):
+        candidate = sun_time(day + timedelta(days=i), schedule.latitude, schedule.longitude, schedule.trigger)
+        if candidate is not None and candidate + offset > after:
+            return candidate + offset
+    return None
+
+
+# --- Heap trong bộ nhớ của worker ---
+class ScheduleQueue:
+    """
+    Heap (timestamp chạy, schedule_id) + dict schedule_id -> timestamp hiện tại của schedule.
+        - Đổi / xoá schedule: chỉ sửa dict, O(log n). Entry cũ vẫn nằm trong heap,
+          bị bỏ qua lúc pop vì không khớp dict.
+        - Heap phình quá 2 lần số schedule (đổi giờ nhiều) -> dựng lại từ dict.
+    100k schedule ~ vài MB, push/pop vài micro giây trên 1 core.
+    """
+    def __init__(self):
+        self._heap = []
+        self._due = {}   # schedule_id -> timestamp
+
+    def __len__(self):
+        return len(self._due)
+
+    def set(self, schedule_id, run_at):
+        # run_at: timestamp (giây) hoặc None = bỏ schedule khỏi queue.
+        if run_at is None:
+            self._due.pop(schedule_id, None)
+            return
+        if self._due.get(schedule_id) == run_at:
+            return
+        self._due[schedule_id] = run_at
+        heapq.heappush(self._heap, (run_at, schedule_id))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, sid) for sid, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def load(self, items):
+        # Thay toàn bộ queue bằng [(schedule_id, timestamp)], heapify O(n).
+        self._due = dict(items)
+        self._heap = [(due, sid) for sid, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_time(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit):
+        # Lấy tối đa limit schedule có timestamp <= now, sớm nhất trước.
+        due = []
+        while len(due) < limit:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, schedule_id = heapq.heappop(self._heap)
+            del self._due[schedule_id]
+            due.append(schedule_id)
+        return due
+
+
+# --- Chạy schedule ---
+def run_schedules(schedule_ids, now):
+    """
+    Chạy các schedule tới giờ trong 1 lô:
+        - 2 query load schedule + device đích (chỉ device còn thuộc nhà của chủ schedule).
+        - attributes không còn hợp lệ với loại device hiện tại (device đã đổi loại) -> bỏ device đó, log.
+        - Gộp update theo device (schedule chạy sau ghi đè), ghi bằng 1 lần apply_device_updates.
+        - Tính next_run_at mới, ghi bằng 1 câu bulk_update.
+    Trả về (states để broadcast, {schedule_id: next_run_at}) -> worker đưa lại vào heap.
+    Schedule chưa tới giờ trên DB (đã bị sửa) thì không chạy, chỉ trả lại next_run_at hiện tại.
+    """
+    schedules = list(Schedule.objects.filter(id__in=schedule_ids).order_by('next_run_at', 'id'))
+    due = [s for s in schedules if s.enabled and s.next_run_at is not None and s.next_run_at <= now]
+
+    targets = {}
+    rows = Schedule.devices.through.objects.filter(
+        schedule_id__in=[s.id for s in due],
+        device__room__user_id=F('schedule__user_id'),
+    ).values_list('schedule_id', 'device_id', 'device__device_type')
+    for schedule_id, device_id, device_type in rows:
+        targets.setdefault(schedule_id, []).append((device_id, device_type))
+
+    updates = {}
+    for schedule in due:
+        for device_id, device_type in targets.get(schedule.id, ()):
+            try:
+                attributes = get_schema(device_type).validate_state(schedule.attributes)
+            except AttributeSchemaError as exc:
+                log_event(
+                    logger, logging.WARNING, 'scheduler.skip',
+                    schedule_id=schedule.id, device_id=device_id, errors=exc.errors,
+                )
+                continue
+            updates.setdefault(device_id, {}).update(attributes)
+        schedule.last_run_at = now
+        schedule.next_run_at = compute_next_run(schedule, now)
+
+    with transaction.atomic():
+        states = apply_device_updates(updates) if updates else []
+        Schedule.objects.bulk_update(due, ['last_run_at', 'next_run_at'])
+
+    return states, {s.id: s.next_run_at for s in schedules if s.enabled}
+
+
+class SchedulerWorker:
+    """
+    Vòng lặp của run_scheduler (1 process, 1 event loop):
+        - Khởi động: load (id, next_run_at) của mọi schedule đang bật vào ScheduleQueue.
+        - Ngủ tới lần chạy sớm nhất, hoặc tới khi nhận schedule.changed từ REST (group 'schedules').
+        - Tới giờ: chạy theo lô BATCH_SIZE, ghi qua apply_device_updates, broadcast từng room
+          bằng publish_device_states (cùng event device_state_update với consumer).
+    Chạy 1 worker cho cả hệ thống (2 worker -> schedule chạy 2 lần).
+    """
+    def __init__(self, channel_layer=None):
+        self.channel_layer = channel_layer or get_channel_layer()
+        self.queue = ScheduleQueue()
+
+    @timed_sync_to_async('scheduler.load', thread_sensitive=False)
+    def _load(self):
+        rows = Schedule.objects.filter(enabled=True, next_run_at__isnull=False).values_list('id', 'next_run_at')
+        return [(schedule_id, next_run_at.timestamp()) for schedule_id, next_run_at in rows.iterator(chunk_size=5000)]
+
+    async def load(self):
+        self.queue.load(await self._load())
+        log_event(logger, logging.INFO, 'scheduler.load', schedules=len(self.queue))
+
+    # Ghi DB (merge_states, lịch sử, next_run_at) -> chạy trên thread sync dùng chung,
+    # không chen ngang giữa evict() và save() của một request REST.
+    @timed_sync_to_async('scheduler.run')
+    def _run(self, schedule_ids, now):
+        return run_schedules(schedule_ids, now)
+
+    async def run_due(self, now=None):
+        """
+        Chạy hết các schedule tới giờ. Trả về số schedule đã lấy ra khỏi queue.
+        Lô lỗi -> log, đưa lại vào queue chạy lại sau 60 giây.
+        """
+        now = now or timezone.now()
+        count = 0
+        while True:
+            schedule_ids = self.queue.pop_due(now.timestamp(), get_config()['BATCH_SIZE'])
+            if not schedule_ids:
+                return count
+            count += len(schedule_ids)
+            try:
+                states, next_runs = await self._run(schedule_ids, now)
+            except Exception:
+                logger.exception('Running schedules %s failed', schedule_ids)
+                for schedule_id in schedule_ids:
+                    self.queue.set(schedule_id, now.timestamp() + 60)
+                continue
+
+            for schedule_id, next_run_at in next_runs.items():
+                self.queue.set(schedule_id, next_run_at.timestamp() if next_run_at else None)
+            await publish_device_states(self.channel_layer, states, persisted=True)
+            log_event(logger, logging.INFO, 'scheduler.run', schedules=len(schedule_ids), devices=len(states))
+
+    def handle(self, message):
+        if message.get('type') == 'schedule.changed':
+            self.queue.set(message['schedule_id'], message['next_run_at'])
+
+    async def run(self):
+        channel = await self.channel_layer.new_channel()
+        reload_interval = get_config()['RELOAD_INTERVAL']
+        receive = None
+        try:
+            while True:
+                # Load lại định kỳ + join lại group (group trên Redis có hạn).
+                await self.channel_layer.group_add(SCHEDULES_GROUP, channel)
+                await self.load()
+                reload_at = time.monotonic() + reload_interval
+
+                while time.monotonic() < reload_at:
+                    await self.run_due()
+                    if receive is None:
+                        receive = asyncio.ensure_future(self.channel_layer.receive(channel))
+                    next_time = self.queue.next_time()
+                    timeout = reload_at - time.monotonic()
+                    if next_time is not None:
+                        timeout = min(timeout, next_time - time.time())
+                    done, _ = await asyncio.wait({receive}, timeout=max(0, timeout))
+                    if done:
+                        self.handle(receive.result())
+                        receive = None
+        finally:
+            if receive is not None:
+                receive.cancel()
+            await self.channel_layer.group_discard(SCHEDULES_GROUP, channel)
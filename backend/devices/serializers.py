@@ -1,8 +1,35 @@
 # /home/trand/D/personal/home_electronics_backend/devices/serializers.py
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from rest_framework import serializers
-from .models import Room, Device
+from .attribute_schemas import AttributeSchemaError, get_schema
+from .models import Room, Device, Gateway, Scene, SceneTarget, Schedule
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=id,is_on -> chỉ trả các field được chọn (dashboard không cần attributes,...).
+    Chỉ áp dụng cho serializer gốc của GET request; serializer lồng bên trong giữ nguyên.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get('request'))
+        if requested is None:
+            return
+        for field_name in set(self.fields) - requested:
+            self.fields.pop(field_name)
 
-class DeviceSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def requested_fields(request):
+        if request is None or request.method != 'GET':
+            return None
+        fields = request.query_params.get('fields')
+        if not fields:
+            return None
+        return {field.strip() for field in fields.split(',') if field.strip()}
+
+
+class DeviceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Device
         fields = [
@@ -13,7 +40,8 @@ class DeviceSerializer(serializers.ModelSerializer):
             'is_on', 
             'room',
             'device_type', 
-            'attributes'
+            'attributes',
+            'version',
         ]
         # Khi tạo mới Device:
         #   - room vẫn phải có trong request.data (nhưng view sẽ xử lí)
@@ -22,9 +50,57 @@ class DeviceSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'room': {'required': False}
         }
+        # version do server tăng, client chỉ đọc.
+        read_only_fields = ['version']
+
+    def validate_attributes(self, value):
+        # attributes được merge theo key vào attributes hiện có -> phải là object.
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object.")
+        return value
+
+    def validate(self, attrs):
+        """
+        attributes kiểm tra theo schema của loại device (devices/attribute_schemas.py):
+            - Tạo mới / đổi loại device: điền default của loại đó cho key không gửi
+              (đổi loại: kết quả thay toàn bộ attributes cũ, xem views.retype_change).
+            - Update: chỉ kiểm tra các key gửi lên (được merge vào attributes hiện có).
+        """
+        current_type = getattr(self.instance, 'device_type', None)
+        device_type = attrs.get('device_type', current_type or Device.DeviceType.BINARY_SWITCH)
+        type_changed = device_type != current_type
+        if 'attributes' in attrs or type_changed:
+            try:
+                attrs['attributes'] = get_schema(device_type).validate(
+                    attrs.get('attributes', {}), partial=not type_changed,
+                )
+            except AttributeSchemaError as e:
+                raise serializers.ValidationError({"attributes": e.errors})
+        return attrs
+
+
+class DeviceBulkSerializer(DeviceSerializer):
+    """
+    Dùng cho /api/devices/bulk/:
+        - room là id thô -> không query Room cho từng item như PrimaryKeyRelatedField.
+          View load id các room của user 1 lần, truyền vào context['room_ids'].
+        - id chỉ dùng khi bulk update (xác định device cần sửa).
+    """
+    id = serializers.IntegerField(required=False)
+    room = serializers.IntegerField(required=False)
+
+    def validate_room(self, value):
+        if value not in self.context['room_ids']:
+            raise serializers.ValidationError("Room not found.")
+        return value
+
+    def validate(self, attrs):
+        if self.instance is None and 'room' not in attrs:
+            raise serializers.ValidationError({"room": "This field is required."})
+        return super().validate(attrs)
 
 
-class RoomSerializer(serializers.ModelSerializer):
+class RoomSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     devices = DeviceSerializer(many=True, read_only=True)
     # Room trả về luôn list devices bên trong -> Rất hợp UI Flutter màn hình Room detail
     # user readonly -> Room luôn thuộc về user đang login.
@@ -32,4 +108,188 @@ class RoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = Room
         fields = ['id', 'name', 'user', 'devices']
-        read_only_fields = ['user']
\ No newline at end of file
+        read_only_fields = ['user']
+
+
+class ScheduleSerializer(serializers.ModelSerializer):
+    """
+    devices: list id device, chỉ nhận device trong các room của user đang login.
+    next_run_at / last_run_at do server tính.
+    """
+    devices = serializers.PrimaryKeyRelatedField(many=True, queryset=Device.objects.none())
+
+    class Meta:
+        model = Schedule
+        fields = [
+            'id',
+            'name',
+            'trigger',
+            'run_at',
+            'time_of_day',
+            'timezone',
+            'latitude',
+            'longitude',
+            'offset_minutes',
+            'devices',
+            'attributes',
+            'enabled',
+            'next_run_at',
+            'last_run_at',
+        ]
+        read_only_fields = ['next_run_at', 'last_run_at']
+        # Model có default={} nhưng schedule không có attributes thì chạy cũng không làm gì -> bắt buộc khi tạo.
+        extra_kwargs = {
+            'attributes': {'required': True},
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            self.fields['devices'].child_relation.queryset = Device.objects.filter(room__user=request.user)
+
+    def validate_timezone(self, value):
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise serializers.ValidationError("Unknown time zone.")
+        return value
+
+    def validate_attributes(self, value):
+        if not isinstance(value, dict) or not value:
+            raise serializers.ValidationError("Expected a non-empty object.")
+        return value
+
+    def validate_targets(self, attrs):
+        # attributes phải hợp lệ với schema của mọi loại device trong schedule (1 lần cho mỗi loại).
+        if 'attributes' not in attrs and 'devices' not in attrs:
+            return
+        attributes = attrs.get('attributes', getattr(self.instance, 'attributes', None))
+        if attributes is None:
+            # Không có attributes để kiểm tra -> lỗi "This field is required." của field (extra_kwargs).
+            return
+        devices = attrs['devices'] if 'devices' in attrs else self.instance.devices.all()
+        for device_type in sorted({device.device_type for device in devices}):
+            try:
+                get_schema(device_type).validate_state(attributes)
+            except AttributeSchemaError as e:
+                raise serializers.ValidationError({"attributes": {device_type: e.errors}})
+
+    def validate(self, attrs):
+        # Field bắt buộc theo trigger (PATCH -> lấy giá trị cũ của field không gửi lên).
+        def value(field):
+            return attrs[field] if field in attrs else getattr(self.instance, field, None)
+
+        required = {
+            Schedule.Trigger.ONCE: ['run_at'],
+            Schedule.Trigger.DAILY: ['time_of_day'],
+            Schedule.Trigger.SUNRISE: ['latitude', 'longitude'],
+            Schedule.Trigger.SUNSET: ['latitude', 'longitude'],
+        }.get(value('trigger'), [])
+        errors = {field: "This field is required for this trigger." for field in required if value(field) is None}
+        if errors:
+            raise serializers.ValidationError(errors)
+        self.validate_targets(attrs)
+        return attrs
+
+
+class SceneTargetSerializer(serializers.Serializer):
+    # device là id thô -> cả scene check quyền / loại device bằng 1 query (SceneSerializer.validate_targets).
+    device = serializers.IntegerField()
+    attributes = serializers.DictField()
+
+    def validate_attributes(self, value):
+        if not value:
+            raise serializers.ValidationError("Expected a non-empty object.")
+        return value
+
+
+class SceneSerializer(serializers.ModelSerializer):
+    """
+    {name, targets: [{device, attributes}, ...]}: attributes dạng message WebSocket ({is_on, brightness,...}),
+    kiểm tra theo schema của loại device. Gửi targets khi update -> thay toàn bộ targets cũ.
+    """
+    targets = SceneTargetSerializer(many=True)
+
+    class Meta:
+        model = Scene
+        fields = ['id', 'name', 'targets']
+
+    def validate_targets(self, value):
+        if not value:
+            raise serializers.ValidationError("Expected a non-empty list of targets.")
+        device_ids = [target['device'] for target in value]
+        if len(set(device_ids)) != len(device_ids):
+            raise serializers.ValidationError("Each device may appear only once.")
+
+        request = self.context['request']
+        device_types = dict(
+            Device.objects.filter(id__in=device_ids, room__user=request.user).values_list('id', 'device_type')
+        )
+        errors = []
+        for target in value:
+            device_type = device_types.get(target['device'])
+            if device_type is None:
+                errors.append({"device": "Device not found."})
+                continue
+            try:
+                get_schema(device_type).validate_state(target['attributes'])
+            except AttributeSchemaError as e:
+                errors.append({"attributes": e.errors})
+                continue
+            errors.append({})
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return value
+
+    @staticmethod
+    def save_targets(scene, targets):
+        SceneTarget.objects.bulk_create([
+            SceneTarget(scene=scene, device_id=target['device'], attributes=target['attributes'])
+            for target in targets
+        ])
+
+    def create(self, validated_data):
+        targets = validated_data.pop('targets')
+        scene = Scene.objects.create(**validated_data)
+        self.save_targets(scene, targets)
+        return scene
+
+    def update(self, instance, validated_data):
+        # Mọi lần sửa đều tăng revision -> plan cũ trong cache không còn được dùng.
+        targets = validated_data.pop('targets', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.revision += 1
+        instance.save()
+        if targets is not None:
+            instance.targets.all().delete()
+            self.save_targets(instance, targets)
+        return instance
+
+    def to_representation(self, instance):
+        # targets đã prefetch (SceneViewSet.get_queryset) -> không query thêm.
+        return {
+            'id': instance.pk,
+            'name': instance.name,
+            'targets': [
+                {'device': target.device_id, 'attributes': target.attributes}
+                for target in instance.targets.all()
+            ],
+        }
+
+
+class GatewaySerializer(serializers.ModelSerializer):
+    # key thô chỉ có trong response lúc tạo (view gán vào instance), DB chỉ giữ hash.
+    key = serializers.CharField(read_only=True, required=False)
+
+    class Meta:
+        model = Gateway
+        fields = ['id', 'name', 'created_at', 'last_seen_at', 'key']
+        read_only_fields = ['created_at', 'last_seen_at']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if not getattr(instance, 'key', None):
+            data.pop('key', None)
+        return data
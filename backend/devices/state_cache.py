@@ -0,0 +1,403 @@
+# devices/state_cache.py
+import asyncio
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from home_electronics_backend.metrics import timed_sync_to_async
+
+from .history import brightness_of
+from .http_cache import bump_revisions
+from .models import Device, DeviceStateEvent
+from .state_merge import combine_changes, merge_states
+
+DEFAULTS = {
+    # Chu kỳ (giây) ghi các thay đổi đang chờ xuống DB.
+    'FLUSH_INTERVAL': 0.5,
+    # Số device "dirty" tối đa trước khi ép flush ngay (giới hạn độ bền).
+    'MAX_PENDING': 200,
+    # Số entry tối đa giữ trong bộ nhớ (chỉ evict entry đã sạch).
+    'MAX_ENTRIES': 10000,
+    # Entry sạch load quá ENTRY_TTL giây -> đọc lại từ DB lần dùng kế tiếp
+    # (giới hạn thời gian cache cũ khi process khác ghi mà process này không nhận được event).
+    'ENTRY_TTL': 30,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DEVICE_STATE_CACHE', {})}
+
+
+class DeviceStateCache:
+    """
+    Cache trạng thái device trong bộ nhớ, theo kiểu write-behind:
+        - Lần đầu đụng tới device -> load 1 lần từ DB (room_id, user_id, device_type, is_on, attributes, version).
+        - Các lần sau: merge ngay trong bộ nhớ, trả phần thay đổi (delta) về để broadcast luôn.
+        - Mỗi lần có thay đổi -> version + 1. Không đổi gì -> không có delta, không broadcast.
+        - Các thay đổi được gộp lại (chỉ các key đổi + số lần tăng version), cứ FLUSH_INTERVAL giây
+          ghi 1 lần bằng merge_states (merge ngay trên DB, xem state_merge.py).
+          Kéo slider brightness 30 lần/giây -> chỉ còn 1 câu UPDATE cho mỗi chu kỳ.
+          Worker khác / REST ghi key khác của cùng device trong lúc đó -> không bị ghi đè mất.
+        - Nếu số device dirty vượt MAX_PENDING -> flush ngay, không chờ hết chu kỳ.
+        - Thay đổi is_on/brightness được ghi thêm vào lịch sử (DeviceStateEvent) cùng lúc flush.
+    Cache là của từng process (mỗi worker daphne có 1 cache riêng), process khác / scheduler ghi thẳng DB:
+        - Entry sạch (không có change chờ) được làm mới từ DB mỗi lần load room (snapshot) và khi quá ENTRY_TTL.
+        - Chỉ giữ entry của room có socket trong process này (watch / unwatch): socket cuối rời room
+          -> bỏ entry sạch của room, event ghi thẳng DB lúc không có ai nghe không làm cache cũ.
+    Load từ DB chạy trên thread pool (các room load song song), flush chạy trên thread dùng chung
+    với REST view (xem flush()).
+    """
+    def __init__(self):
+        self._entries = {}   # device_id -> {'room_id', 'user_id', 'device_type', 'is_on', 'attributes', 'version'}
+        self._changes = {}   # device_id -> change chưa ghi {'is_on', 'attributes', 'bumps'}
+        self._events = {}    # device_id -> [(thời điểm, is_on, brightness)] chờ ghi lịch sử
+        self._watchers = Counter()   # room_id -> số socket đang mở room đó trong process này
+        # REST view chạy trên thread khác event loop -> cần lock khi đụng vào dict.
+        self._lock = threading.Lock()
+        self._flush_task = None
+
+    async def get(self, device_id):
+        """
+        Trả entry của device, load từ DB nếu chưa có.
+        Raise Device.DoesNotExist nếu device không tồn tại.
+        """
+        entry = self._entries.get(device_id)
+        if entry is None or self._expired(device_id, entry):
+            loaded = await self._load(device_id)
+            with self._lock:
+                entry = self._store(device_id, loaded)
+        return entry
+
+    async def get_many(self, device_ids):
+        """
+        Như get() nhưng cho nhiều device: các device chưa có trong cache được load bằng 1 query.
+        Device không tồn tại thì không có trong dict trả về.
+        """
+        missing = [
+            device_id for device_id in device_ids
+            if device_id not in self._entries or self._expired(device_id, self._entries[device_id])
+        ]
+        if missing:
+            loaded = await self._load_many(missing)
+            with self._lock:
+                for device_id, entry in loaded.items():
+                    self._store(device_id, entry)
+        with self._lock:
+            return {
+                device_id: self._entries[device_id]
+                for device_id in device_ids
+                if device_id in self._entries
+            }
+
+    async def get_room(self, room_id):
+        return await self.get_rooms([room_id])
+
+    async def get_rooms(self, room_ids):
+        """
+        Entry của tất cả device trong các room, load bằng 1 query (snapshot lúc connect / subscribe).
+        Entry sạch lấy luôn bản trên DB, entry còn change chưa flush thì giữ (mới hơn DB).
+        """
+        loaded = await self._load_rooms(room_ids)
+        with self._lock:
+            return {device_id: self._store(device_id, entry) for device_id, entry in loaded.items()}
+
+    def _store(self, device_id, loaded):
+        """
+        Đưa entry vừa load từ DB vào cache (gọi trong lock), trả về entry trong cache.
+            - Chưa có -> dùng entry vừa load.
+            - Có change chờ flush, hoặc version trên DB thấp hơn (flush đang chạy) -> giữ entry trong cache.
+            - Còn lại -> cập nhật entry cũ theo DB (giữ nguyên object: consumer có thể đang giữ entry).
+        """
+        entry = self._entries.get(device_id)
+        if entry is None:
+            entry = self._entries[device_id] = loaded
+        elif device_id not in self._changes and loaded['version'] >= entry['version']:
+            entry.update(loaded)
+        return entry
+
+    def _expired(self, device_id, entry):
+        return (
+            device_id not in self._changes
+            and time.monotonic() - entry['loaded_at'] > get_config()['ENTRY_TTL']
+        )
+
+    # --- Room có socket trong process này ---
+    def watch(self, room_ids):
+        with self._lock:
+            self._watchers.update(room_ids)
+
+    def unwatch(self, room_ids):
+        # Socket cuối của room đóng -> bỏ entry sạch của room (không còn consumer nhận event để giữ entry mới).
+        with self._lock:
+            released = set()
+            for room_id in room_ids:
+                self._watchers[room_id] -= 1
+                if self._watchers[room_id] <= 0:
+                    del self._watchers[room_id]
+                    released.add(room_id)
+            if released:
+                self._release([
+                    device_id for device_id, entry in self._entries.items() if entry['room_id'] in released
+                ])
+
+    def _release(self, device_ids):
+        # Gọi trong lock: bỏ các entry sạch (entry còn change chờ được bỏ sau khi flush).
+        for device_id in device_ids:
+            entry = self._entries.get(device_id)
+            if entry is not None and device_id not in self._changes and entry['room_id'] not in self._watchers:
+                del self._entries[device_id]
+
+    @staticmethod
+    def _entry_from_row(row):
+        return {
+            'room_id': row['room_id'],
+            'user_id': row['room__user_id'],
+            'device_type': row['device_type'],
+            'is_on': row['is_on'],
+            'attributes': row['attributes'] or {},
+            'version': row['version'],
+            'loaded_at': time.monotonic(),
+        }
+
+    @staticmethod
+    def full_state(device_id, entry):
+        return {
+            'device_id': device_id,
+            'room_id': entry['room_id'],
+            'is_on': entry['is_on'],
+            'attributes': dict(entry['attributes']),
+            'version': entry['version'],
+        }
+
+    @timed_sync_to_async('state_cache.load', thread_sensitive=False)
+    def _load(self, device_id):
+        row = Device.objects.values(
+            'room_id', 'room__user_id', 'device_type', 'is_on', 'attributes', 'version'
+        ).get(id=device_id)
+        return self._entry_from_row(row)
+
+    @timed_sync_to_async('state_cache.load_many', thread_sensitive=False)
+    def _load_many(self, device_ids):
+        rows = Device.objects.filter(id__in=device_ids).values(
+            'id', 'room_id', 'room__user_id', 'device_type', 'is_on', 'attributes', 'version'
+        )
+        return {row['id']: self._entry_from_row(row) for row in rows}
+
+    @timed_sync_to_async('state_cache.load_rooms', thread_sensitive=False)
+    def _load_rooms(self, room_ids):
+        rows = Device.objects.filter(room_id__in=room_ids).order_by('id').values(
+            'id', 'room_id', 'room__user_id', 'device_type', 'is_on', 'attributes', 'version'
+        )
+        return {row['id']: self._entry_from_row(row) for row in rows}
+
+    def apply(self, device_id, new_attributes):
+        """
+        Merge new_attributes vào entry đã load (gọi get() trước).
+        Giống logic cũ của update_device_state: is_on là field riêng, các key khác vào attributes.
+        Trả về delta { device_id, room_id, is_on, attributes (chỉ các key đổi), version },
+        hoặc None nếu không có gì thay đổi.
+        """
+        with self._lock:
+            entry = self._entries[device_id]
+            has_changed = False
+
+            if 'is_on' in new_attributes and isinstance(new_attributes['is_on'], bool):
+                if entry['is_on'] != new_attributes['is_on']:
+                    entry['is_on'] = new_attributes['is_on']
+                    has_changed = True
+
+            current_attributes = entry['attributes']
+            changed_attributes = {}
+            for key, value in new_attributes.items():
+                if key != 'is_on':
+                    if current_attributes.get(key) != value:
+                        current_attributes[key] = value
+                        changed_attributes[key] = value
+                        has_changed = True
+
+            if not has_changed:
+                return None
+
+            entry['version'] += 1
+            self._changes[device_id] = combine_changes(self._changes.get(device_id), {
+                'is_on': entry['is_on'] if 'is_on' in new_attributes else None,
+                'attributes': changed_attributes,
+                'bumps': 1,
+            })
+            pending = len(self._changes)
+            self._record_event(device_id, entry)
+
+            # is_on luôn đi kèm (client cũ đọc is_on ở mọi message), attributes chỉ gồm key đổi.
+            delta = {
+                'device_id': device_id,
+                'room_id': entry['room_id'],
+                'is_on': entry['is_on'],
+                'attributes': changed_attributes,
+                'version': entry['version'],
+            }
+
+        self._schedule_flush(force=pending >= get_config()['MAX_PENDING'])
+        return delta
+
+    def peek(self, device_id):
+        # Bản sao is_on/attributes trong cache (có thể mới hơn DB do chưa flush), None nếu chưa load.
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                return None
+            return {'is_on': entry['is_on'], 'attributes': dict(entry['attributes'])}
+
+    def absorb(self, state, token):
+        """
+        State đã được ghi thẳng xuống DB ở process khác (scheduler,...), nhận qua broadcast.
+        Device có trong cache -> merge vào entry (không thành change chờ flush, DB đã có),
+        version = max(version trong cache + 1, version trên DB): cache có thể đang đi trước DB
+        (change chưa flush), client không được bỏ qua state này vì tưởng là cũ.
+        Mỗi socket trong room đều gọi với cùng token -> chỉ merge lần đầu.
+        Trả về state để gửi xuống client.
+        """
+        with self._lock:
+            entry = self._entries.get(state['device_id'])
+            if entry is None:
+                return state
+            absorbed = entry.get('absorbed')
+            if absorbed is None or absorbed[0] != token:
+                entry['is_on'] = state['is_on']
+                entry['attributes'].update(state['attributes'])
+                entry['version'] = max(entry['version'] + 1, state['version'])
+                absorbed = entry['absorbed'] = (token, entry['version'])
+            return {**state, 'version': absorbed[1]}
+
+    def _record_event(self, device_id, entry):
+        """
+        Event lịch sử chờ flush. Cùng is_on với event chờ trước đó (vd: đang kéo slider)
+        -> thay luôn event đó, mỗi chu kỳ flush chỉ còn 1 event cho mỗi đoạn bật/tắt.
+        """
+        event = (timezone.now(), entry['is_on'], brightness_of(entry['attributes']))
+        events = self._events.setdefault(device_id, [])
+        if events and events[-1][1] == event[1]:
+            if events[-1][2] != event[2]:
+                events[-1] = event
+        else:
+            events.append(event)
+
+    @staticmethod
+    def _history_rows(device_id, events):
+        return [
+            DeviceStateEvent(device_id=device_id, recorded_at=recorded_at, is_on=is_on, brightness=brightness)
+            for recorded_at, is_on, brightness in events
+        ]
+
+    def evict(self, device_id):
+        """
+        Bỏ device khỏi cache (REST update/delete, device chuyển room,...).
+        Trả về (change chưa ghi hoặc None, list DeviceStateEvent chưa ghi),
+        để caller tự ghi cùng transaction với thay đổi của mình.
+        """
+        with self._lock:
+            self._entries.pop(device_id, None)
+            events = self._history_rows(device_id, self._events.pop(device_id, ()))
+            return self._changes.pop(device_id, None), events
+
+    def clear(self):
+        # Bỏ toàn bộ cache, kể cả thay đổi chưa ghi (dùng cho test).
+        with self._lock:
+            self._entries.clear()
+            self._changes.clear()
+            self._events.clear()
+            self._watchers.clear()
+
+    # --- Flush ---
+    def _schedule_flush(self, force=False):
+        if force:
+            asyncio.get_running_loop().create_task(self.flush())
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        interval = get_config()['FLUSH_INTERVAL']
+        while self._changes:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    @timed_sync_to_async('state_cache.flush')
+    def flush(self):
+        """
+        Ghi tất cả change đang chờ xuống DB bằng merge_states (Postgres: 1 câu UPDATE ... RETURNING).
+        Chạy trên thread sync dùng chung với các REST view (thread_sensitive)
+        -> không chen ngang giữa evict() và lần ghi của một request REST.
+        Ghi xong -> entry lấy lại state trên DB (đã gồm thay đổi của writer khác) + các change mới hơn,
+        đổi revision HTTP của các user liên quan (ETag / response cache của REST).
+        """
+        with self._lock:
+            if not self._changes:
+                return 0
+            changes = self._changes
+            self._changes = {}
+            user_ids = {self._entries[device_id]['user_id'] for device_id in changes}
+            pending_events = self._events
+            self._events = {}
+            events = [
+                event
+                for device_id, device_events in pending_events.items()
+                for event in self._history_rows(device_id, device_events)
+            ]
+
+        try:
+            rows = merge_states(changes)
+        except Exception:
+            # Ghi lỗi -> trả change và event lịch sử về hàng chờ (trước các change / event mới hơn)
+            # để lần flush sau thử tiếp.
+            with self._lock:
+                for device_id, change in changes.items():
+                    if device_id in self._entries:
+                        newer = self._changes.get(device_id)
+                        self._changes[device_id] = combine_changes(change, newer) if newer else change
+                for device_id, device_events in pending_events.items():
+                    if device_id in self._entries:
+                        self._events[device_id] = device_events + self._events.get(device_id, [])
+            raise
+
+        with self._lock:
+            for device_id, row in rows.items():
+                entry = self._entries.get(device_id)
+                if entry is None:
+                    continue
+                newer = self._changes.get(device_id)
+                if newer:
+                    row = {
+                        'is_on': newer['is_on'] if newer['is_on'] is not None else row['is_on'],
+                        'attributes': {**row['attributes'], **newer['attributes']},
+                        'version': row['version'] + newer['bumps'],
+                    }
+                entry.update(row, loaded_at=time.monotonic())
+            # Room không còn socket nào trong lúc chờ flush -> entry giờ đã sạch, bỏ luôn.
+            self._release(rows)
+
+        try:
+            DeviceStateEvent.objects.bulk_create(events)
+        except IntegrityError:
+            # Device bị xoá (ở process khác) trong lúc event còn chờ -> bỏ event của device đó.
+            existing = set(Device.objects.filter(id__in={e.device_id for e in events}).values_list('id', flat=True))
+            DeviceStateEvent.objects.bulk_create([e for e in events if e.device_id in existing])
+
+        bump_revisions(user_ids)
+        self._trim()
+        return len(changes)
+
+    def _trim(self):
+        max_entries = get_config()['MAX_ENTRIES']
+        with self._lock:
+            overflow = len(self._entries) - max_entries
+            if overflow <= 0:
+                return
+            # dict giữ thứ tự insert -> bỏ các entry sạch cũ nhất.
+            for device_id in [d for d in self._entries if d not in self._changes][:overflow]:
+                del self._entries[device_id]
+
+
+device_state_cache = DeviceStateCache()
@@ -0,0 +1,186 @@
+# devices/state_merge.py
+import json
+
+from django.db import connection, transaction
+
+from .history import record_state_events
+from .http_cache import bump_revisions
+from .models import Device, Room
+
+# Ghi state (is_on / attributes / version) của device ngay trên DB, không đọc ra rồi ghi lại:
+#     - attributes = attributes || thay đổi  (merge nông theo key, như jsonb || của Postgres)
+#     - is_on      = giá trị mới nếu có, không thì giữ nguyên
+#     - version    = version + số lần đổi
+# Nhiều writer (flush của các worker, REST, ...) cùng ghi 1 device -> không ai ghi đè mất key của ai,
+# không cần khoá row trước khi đọc.
+#
+# 1 thay đổi (change) = {'is_on': bool | None, 'attributes': {key đổi}, 'bumps': số lần tăng version}.
+
+
+def combine_changes(older, newer):
+    # Gộp 2 change liên tiếp của cùng 1 device, change sau ghi đè change trước.
+    if older is None:
+        return newer
+    return {
+        'is_on': newer['is_on'] if newer['is_on'] is not None else older['is_on'],
+        'attributes': {**older['attributes'], **newer['attributes']},
+        'bumps': older['bumps'] + newer['bumps'],
+    }
+
+
+def change_from_attributes(attributes):
+    # {is_on, key khác...} như message WebSocket -> change (is_on chỉ nhận bool, giống device_state_cache.apply).
+    is_on = attributes.get('is_on')
+    return {
+        'is_on': is_on if isinstance(is_on, bool) else None,
+        'attributes': {key: value for key, value in attributes.items() if key != 'is_on'},
+        'bumps': 1,
+    }
+
+
+def apply_device_updates(updates, user_ids=None):
+    """
+    Ghi thẳng xuống DB (không qua cache write-behind của consumer), cho code chạy ngoài consumer:
+    scheduler, script,... updates = {device_id: {is_on, key khác...}}.
+        - 1 câu merge_states, 1 câu bulk_create lịch sử, đổi revision HTTP của các user liên quan.
+        - Device không còn tồn tại -> bỏ qua.
+        - user_ids: chủ các device nếu caller đã biết (gateway,...) -> khỏi query Room.
+    Trả về list state để broadcast (publish_device_states):
+    {device_id, room_id, is_on, attributes (chỉ các key gửi lên), version}.
+    """
+    changes = {device_id: change_from_attributes(attributes) for device_id, attributes in updates.items()}
+    with transaction.atomic():
+        rows = merge_states(changes)
+        record_state_events([
+            Device(id=device_id, is_on=row['is_on'], attributes=row['attributes'])
+            for device_id, row in rows.items()
+        ])
+    if user_ids is None:
+        user_ids = set(
+            Room.objects.filter(id__in={row['room_id'] for row in rows.values()}).values_list('user_id', flat=True)
+        )
+    bump_revisions(user_ids)
+    return [
+        {
+            'device_id': device_id,
+            'room_id': row['room_id'],
+            'is_on': row['is_on'],
+            'attributes': changes[device_id]['attributes'],
+            'version': row['version'],
+        }
+        for device_id, row in rows.items()
+    ]
+
+
+def merge_state(device_id, change, expected_version=None):
+    """
+    Ghi 1 change. expected_version -> compare-and-set: chỉ ghi nếu version trên DB đúng bằng giá trị này.
+    Trả về {'room_id', 'is_on', 'attributes', 'version'} sau khi ghi, hoặc None (không có device / sai version).
+    """
+    expected = {device_id: expected_version} if expected_version is not None else None
+    return merge_states({device_id: change}, expected).get(device_id)
+
+
+def merge_states(changes, expected_versions=None):
+    """
+    Ghi nhiều change: {device_id: change}. Postgres: 1 câu UPDATE ... FROM (VALUES ...) RETURNING.
+    Trả về {device_id: {'room_id', 'is_on', 'attributes', 'version'}} của các row đã ghi.
+    """
+    if not changes:
+        return {}
+    expected_versions = expected_versions or {}
+    if connection.vendor == 'postgresql':
+        rows = _merge_postgresql(changes, expected_versions)
+    elif connection.vendor == 'sqlite':
+        rows = _merge_sqlite(changes, expected_versions)
+    else:
+        rows = _merge_locked(changes, expected_versions)
+    return {
+        device_id: {
+            'room_id': room_id,
+            'is_on': bool(is_on),
+            'attributes': attributes if isinstance(attributes, dict) else json.loads(attributes or '{}'),
+            'version': version,
+        }
+        for device_id, room_id, is_on, attributes, version in rows
+    }
+
+
+def _merge_postgresql(changes, expected_versions):
+    table = connection.ops.quote_name(Device._meta.db_table)
+    values, params = [], []
+    for device_id, change in changes.items():
+        values.append('(%s::bigint, %s::jsonb, %s::boolean, %s::bigint, %s::bigint)')
+        params.extend([
+            device_id,
+            json.dumps(change['attributes']),
+            change['is_on'],
+            change['bumps'],
+            expected_versions.get(device_id),
+        ])
+    sql = (
+        f'UPDATE {table} AS d SET '
+        f"attributes = COALESCE(d.attributes, '{{}}'::jsonb) || v.attributes, "
+        f'is_on = COALESCE(v.is_on, d.is_on), '
+        f'version = d.version + v.bumps '
+        f'FROM (VALUES {", ".join(values)}) AS v(id, attributes, is_on, bumps, expected) '
+        f'WHERE d.id = v.id AND (v.expected IS NULL OR d.version = v.expected) '
+        f'RETURNING d.id, d.room_id, d.is_on, d.attributes, d.version'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _merge_sqlite(changes, expected_versions):
+    """
+    SQLite (dev/test): không có jsonb || -> ghép lại object từ json_each (key cũ không bị đổi + key mới),
+    merge nông đúng như Postgres (json_patch merge lồng nhau và xoá key null -> không dùng).
+    json_each trả true/false thành 1/0, object/array thành text -> đổi lại về JSON theo type.
+    """
+    table = connection.ops.quote_name(Device._meta.db_table)
+    values, params = [], []
+    for device_id, change in changes.items():
+        values.append('(%s, %s, %s, %s, %s)')
+        params.extend([
+            device_id,
+            json.dumps(change['attributes']),
+            change['is_on'],
+            change['bumps'],
+            expected_versions.get(device_id),
+        ])
+    sql = (
+        f'WITH v(id, attributes, is_on, bumps, expected) AS (VALUES {", ".join(values)}) '
+        f'UPDATE {table} SET attributes = ('
+        f"SELECT json_group_object(key, CASE type WHEN 'true' THEN json('true') WHEN 'false' THEN json('false') "
+        f"WHEN 'object' THEN json(value) WHEN 'array' THEN json(value) ELSE value END) FROM ("
+        f"SELECT key, value, type FROM json_each(COALESCE({table}.attributes, '{{}}')) "
+        f'WHERE key NOT IN (SELECT key FROM json_each(v.attributes)) '
+        f'UNION ALL SELECT key, value, type FROM json_each(v.attributes))), '
+        f'is_on = COALESCE(v.is_on, {table}.is_on), '
+        f'version = {table}.version + v.bumps '
+        f'FROM v WHERE {table}.id = v.id AND (v.expected IS NULL OR {table}.version = v.expected) '
+        f'RETURNING {table}.id, {table}.room_id, {table}.is_on, {table}.attributes, {table}.version'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _merge_locked(changes, expected_versions):
+    # DB khác: khoá row (SELECT ... FOR UPDATE) rồi merge trong Python.
+    rows = []
+    with transaction.atomic():
+        devices = Device.objects.select_for_update().filter(pk__in=list(changes)).order_by('pk')
+        for device in devices:
+            expected = expected_versions.get(device.pk)
+            if expected is not None and device.version != expected:
+                continue
+            change = changes[device.pk]
+            device.attributes = {**(device.attributes or {}), **change['attributes']}
+            if change['is_on'] is not None:
+                device.is_on = change['is_on']
+            device.version += change['bumps']
+            device.save(update_fields=['is_on', 'attributes', 'version'])
+            rows.append((device.pk, device.room_id, device.is_on, device.attributes, device.version))
+    return rows
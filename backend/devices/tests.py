@@ -1,3 +1,1328 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from home_electronics_backend.channel_layers import HashRing, ShardedChannelLayer
+from home_electronics_backend.log import QueueListenerHandler, SamplingFilter, log_event
+from home_electronics_backend.metrics import HTTP_RESPONSES, WS_CONNECTIONS
+
+from .attribute_schemas import ATTRIBUTE_SCHEMAS
+from .history import compact
+from .models import Device, DeviceStateEvent, DeviceUsageRollup, Room, Scene, Schedule
+from .realtime import state_event
+from .schedules import ScheduleQueue, SchedulerWorker, compute_next_run
+from .state_cache import device_state_cache
+from .state_merge import merge_state
+from .wire import ATTRIBUTE_KEYS, JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL, decode_binary, encode_binary
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class DeviceStateCacheTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamp = Device.objects.create(
+            room=self.room, name='Lamp', icon_asset='lamp.png', is_on=True,
+            device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+        )
+
+    async def open_socket(self):
+        from home_electronics_backend.asgi import application
+        socket = WebsocketCommunicator(application, f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}', subprotocols=[JSON_SUBPROTOCOL])
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket, await socket.receive_json_from()
+
+    def test_reconnect_sees_write_made_outside_the_cache(self):
+        async def run():
+            socket, snapshot = await self.open_socket()
+            self.assertTrue(snapshot['devices'][0]['is_on'])
+            await socket.disconnect()
+
+            # Process khác (scheduler, worker khác,...) ghi thẳng DB lúc không có socket nào trong room.
+            await sync_to_async(merge_state)(self.lamp.pk, {'is_on': False, 'attributes': {}, 'bumps': 1})
+
+            socket, snapshot = await self.open_socket()
+            self.assertEqual((snapshot['devices'][0]['is_on'], snapshot['devices'][0]['version']), (False, 1))
+            await socket.send_json_to({'device_id': self.lamp.id, 'attributes': {'is_on': True}})
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['is_on'], frame['version']), (True, 2))
+            await device_state_cache.flush()
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.is_on, self.lamp.version), (True, 2))
+        # Không còn socket nào -> entry sạch đã bị bỏ.
+        self.assertIsNone(device_state_cache.peek(self.lamp.pk))
+
+    @override_settings(DEVICE_STATE_CACHE={'FLUSH_INTERVAL': 3600, 'MAX_PENDING': 200})
+    def test_changes_stay_in_memory_until_one_flush(self):
+        async def run():
+            await device_state_cache.get(self.lamp.pk)
+            for brightness in range(20, 50, 10):
+                delta = device_state_cache.apply(self.lamp.pk, {'brightness': brightness})
+            self.assertEqual((delta['attributes'], delta['version']), ({'brightness': 40}, 3))
+            self.assertIsNone(device_state_cache.apply(self.lamp.pk, {'brightness': 40}))
+
+            self.assertEqual(await sync_to_async(Device.objects.values_list('version', flat=True).get)(pk=self.lamp.pk), 0)
+            self.assertEqual(await device_state_cache.flush(), 1)
+            self.assertEqual(await device_state_cache.flush(), 0)
+
+        async_to_sync(run)()
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.attributes, self.lamp.version), ({'brightness': 40}, 3))
+        # Kéo slider (cùng is_on) -> 1 event lịch sử với giá trị cuối.
+        self.assertEqual(list(DeviceStateEvent.objects.values_list('is_on', 'brightness')), [(True, 40)])
+
+    @override_settings(DEVICE_STATE_CACHE={'FLUSH_INTERVAL': 3600, 'MAX_PENDING': 200})
+    def test_failed_flush_keeps_history_events(self):
+        failing = True
+
+        def fail_writes(execute, sql, params, many, context):
+            if failing and not sql.lstrip().upper().startswith('SELECT'):
+                raise OperationalError('database is locked')
+            return execute(sql, params, many, context)
+
+        async def run():
+            nonlocal failing
+            await device_state_cache.get(self.lamp.pk)
+            device_state_cache.apply(self.lamp.pk, {'is_on': False})
+            with self.assertRaises(OperationalError):
+                await device_state_cache.flush()
+
+            failing = False
+            device_state_cache.apply(self.lamp.pk, {'is_on': True})
+            self.assertEqual(await device_state_cache.flush(), 1)
+
+        # flush chạy trên thread sync dùng chung (thread này) -> wrapper áp lên đúng connection của nó.
+        with connection.execute_wrapper(fail_writes):
+            async_to_sync(run)()
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.is_on, self.lamp.version), (True, 2))
+        # Event của lần flush lỗi vẫn được ghi, trước event mới hơn.
+        self.assertEqual(
+            list(DeviceStateEvent.objects.order_by('recorded_at', 'id').values_list('is_on', flat=True)),
+            [False, True],
+        )
+
+    @override_settings(DEVICE_STATE_CACHE={'FLUSH_INTERVAL': 3600, 'MAX_PENDING': 2})
+    def test_max_pending_forces_flush(self):
+        plug = Device.objects.create(room=self.room, name='Plug', icon_asset='plug.png')
+        stored = sync_to_async(lambda: dict(Device.objects.values_list('pk', 'is_on')))
+
+        async def run():
+            for device in (self.lamp, plug):
+                await device_state_cache.get(device.pk)
+            device_state_cache.apply(self.lamp.pk, {'is_on': False})
+            await asyncio.sleep(0.1)
+            self.assertEqual(await stored(), {self.lamp.pk: True, plug.pk: False})
+
+            device_state_cache.apply(plug.pk, {'is_on': True})
+            await asyncio.sleep(0.1)
+            self.assertEqual(await stored(), {self.lamp.pk: False, plug.pk: True})
+
+        async_to_sync(run)()
+
+    def test_rest_update_keeps_pending_socket_change(self):
+        async def apply_from_socket():
+            await device_state_cache.get(self.lamp.pk)
+            device_state_cache.apply(self.lamp.pk, {'brightness': 70})
+
+        async_to_sync(apply_from_socket)()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(f'/api/devices/{self.lamp.pk}/', {'name': 'Desk lamp'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.name, self.lamp.attributes), ('Desk lamp', {'brightness': 70}))
+        # Event lịch sử của change đó cũng được ghi cùng transaction, không bị mất khi evict.
+        self.assertEqual(list(DeviceStateEvent.objects.values_list('is_on', 'brightness')), [(True, 70)])
+        # Change đã ghi cùng lần save của REST -> không còn gì chờ flush.
+        self.assertEqual(async_to_sync(device_state_cache.flush)(), 0)
+
+    def test_deleting_room_evicts_its_devices(self):
+        async def apply_from_socket():
+            await device_state_cache.get(self.lamp.pk)
+            device_state_cache.apply(self.lamp.pk, {'brightness': 70})
+
+        async_to_sync(apply_from_socket)()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.delete(f'/api/rooms/{self.room.pk}/').status_code, 204)
+        self.assertIsNone(device_state_cache.peek(self.lamp.pk))
+        # Không còn change nào chờ ghi cho device đã xoá.
+        self.assertEqual(async_to_sync(device_state_cache.flush)(), 0)
+
+    def test_snapshot_refreshes_clean_entry_but_keeps_pending_change(self):
+        async def run():
+            socket, _ = await self.open_socket()
+            await sync_to_async(merge_state)(self.lamp.pk, {'is_on': False, 'attributes': {}, 'bumps': 1})
+            second, snapshot = await self.open_socket()
+            self.assertFalse(snapshot['devices'][0]['is_on'])
+
+            await socket.send_json_to({'device_id': self.lamp.id, 'attributes': {'brightness': 40}})
+            await socket.receive_json_from()
+            # Change chưa flush -> snapshot lấy từ cache, không lấy bản cũ trên DB.
+            third, snapshot = await self.open_socket()
+            self.assertEqual((snapshot['devices'][0]['attributes'], snapshot['devices'][0]['version']), ({'brightness': 40}, 2))
+            for each in (socket, second, third):
+                await each.disconnect()
+            await device_state_cache.flush()
+
+        async_to_sync(run)()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class DeviceSocketTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamps = [
+            Device.objects.create(
+                room=self.room, name=f'Lamp {i}', icon_asset='lamp.png',
+                device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+            )
+            for i in range(2)
+        ]
+
+    async def open_socket(self, *subprotocols):
+        from home_electronics_backend.asgi import application
+        path = f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}'
+        socket = WebsocketCommunicator(application, path, subprotocols=list(subprotocols))
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    def test_snapshot_on_connect_has_full_state_of_every_device(self):
+        lamp_1, lamp_2 = self.lamps
+
+        async def run():
+            first = await self.open_socket(JSON_SUBPROTOCOL)
+            snapshot = await first.receive_json_from()
+            self.assertEqual(snapshot, {'type': 'snapshot', 'devices': [
+                {'device_id': lamp.id, 'room_id': self.room.id, 'is_on': False, 'attributes': {'brightness': 10}, 'version': 0}
+                for lamp in self.lamps
+            ]})
+
+            await first.send_json_to({'device_id': lamp_2.id, 'attributes': {'is_on': True}})
+            await first.receive_json_from()
+            # Socket mở sau nhận state đầy đủ (kể cả change chưa flush), không chỉ delta.
+            second = await self.open_socket(JSON_SUBPROTOCOL)
+            devices = (await second.receive_json_from())['devices']
+            self.assertEqual(
+                [(d['device_id'], d['is_on'], d['attributes'], d['version']) for d in devices],
+                [(lamp_1.id, False, {'brightness': 10}, 0), (lamp_2.id, True, {'brightness': 10}, 1)],
+            )
+            self.assertTrue(await second.receive_nothing())
+
+            await device_state_cache.flush()
+            await first.disconnect()
+            await second.disconnect()
+
+        async_to_sync(run)()
+
+    def test_legacy_client_gets_one_device_per_frame(self):
+        lamp_1, lamp_2 = self.lamps
+
+        async def run():
+            # App đã phát hành: không chọn subprotocol, đọc data['device_id'] ở mọi frame.
+            legacy = await self.open_socket()
+            current = await self.open_socket(JSON_SUBPROTOCOL)
+            self.assertEqual((await current.receive_json_from())['type'], 'snapshot')
+            self.assertTrue(await legacy.receive_nothing())
+
+            await current.send_json_to({'type': 'batch', 'updates': [
+                {'device_id': lamp_1.id, 'attributes': {'is_on': True}},
+                {'device_id': lamp_2.id, 'attributes': {'is_on': True}},
+            ]})
+            self.assertEqual((await current.receive_json_from())['type'], 'batch')
+            frames = [await legacy.receive_json_from() for _ in self.lamps]
+            self.assertEqual([(frame['device_id'], frame['is_on']) for frame in frames], [(lamp_1.id, True), (lamp_2.id, True)])
+            self.assertTrue(await legacy.receive_nothing())
+
+            await device_state_cache.flush()
+            await legacy.disconnect()
+            await current.disconnect()
+
+        async_to_sync(run)()
+
+    def test_batch_is_broadcast_as_one_frame(self):
+        lamp_1, lamp_2 = self.lamps
+
+        async def run():
+            socket = await self.open_socket(JSON_SUBPROTOCOL)
+            await socket.receive_json_from()   # snapshot
+
+            await socket.send_json_to({'type': 'batch', 'updates': [
+                {'device_id': lamp_1.id, 'attributes': {'brightness': 40}},
+                {'device_id': lamp_2.id, 'attributes': {'is_on': True}},
+                {'device_id': lamp_1.id, 'attributes': {'brightness': 60}},
+            ]})
+            frame = await socket.receive_json_from()
+            self.assertEqual(frame['type'], 'batch')
+            self.assertEqual(
+                [(d['device_id'], d['is_on'], d['attributes'], d['version']) for d in frame['devices']],
+                [(lamp_1.id, False, {'brightness': 60}, 1), (lamp_2.id, True, {}, 1)],
+            )
+            self.assertTrue(await socket.receive_nothing())
+            self.assertEqual(await device_state_cache.flush(), 2)
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(
+            list(Device.objects.filter(room=self.room).order_by('pk').values_list('is_on', 'attributes')),
+            [(False, {'brightness': 60}), (True, {'brightness': 10})],
+        )
+
+    def test_batch_with_foreign_device_is_rejected_as_a_whole(self):
+        stranger = get_user_model().objects.create_user(email='stranger@example.com', password='x', name='stranger')
+        foreign = Device.objects.create(room=Room.objects.create(user=stranger, name='Other'), name='Plug', icon_asset='plug.png')
+        lamp_1, _ = self.lamps
+
+        async def run():
+            socket = await self.open_socket(JSON_SUBPROTOCOL)
+            await socket.receive_json_from()   # snapshot
+
+            await socket.send_json_to({'type': 'batch', 'updates': [
+                {'device_id': lamp_1.id, 'attributes': {'brightness': 90}},
+                {'device_id': foreign.id, 'attributes': {'is_on': True}},
+            ]})
+            self.assertEqual(await socket.receive_json_from(), {'error': 'Permission denied.'})
+            self.assertTrue(await socket.receive_nothing())
+            # Không device nào của batch được áp dụng (kể cả device hợp lệ).
+            self.assertEqual(await device_state_cache.flush(), 0)
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(
+            list(Device.objects.order_by('pk').values_list('is_on', 'attributes')),
+            [(False, {'brightness': 10}), (False, {'brightness': 10}), (False, {})],
+        )
+
+    def test_device_ids_follow_rest_changes(self):
+        lamp_1, _ = self.lamps
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        async def run():
+            socket = await self.open_socket(JSON_SUBPROTOCOL)
+            await socket.receive_json_from()   # snapshot
+
+            # Device tạo sau khi connect -> điều khiển được ngay, không phải connect lại.
+            response = await sync_to_async(client.post)('/api/devices/', {
+                'room': self.room.pk, 'name': 'Plug', 'icon_asset': 'plug.png',
+            }, format='json')
+            plug_id = response.json()['id']
+            await socket.send_json_to({'device_id': plug_id, 'attributes': {'is_on': True}})
+            self.assertEqual((await socket.receive_json_from())['device_id'], plug_id)
+
+            # Device đã xoá -> bị từ chối theo device ids của connection, không cần query lại.
+            await device_state_cache.flush()
+            await sync_to_async(client.delete)(f'/api/devices/{lamp_1.id}/')
+            await socket.send_json_to({'device_id': lamp_1.id, 'attributes': {'is_on': True}})
+            self.assertEqual(await socket.receive_json_from(), {'error': 'Permission denied.'})
+            await socket.disconnect()
+
+        async_to_sync(run)()
+
+    def test_updates_are_versioned_deltas_and_resync_sends_full_state(self):
+        lamp_1, lamp_2 = self.lamps
+
+        async def run():
+            socket = await self.open_socket(JSON_SUBPROTOCOL)
+            await socket.receive_json_from()   # snapshot
+
+            await socket.send_json_to({'device_id': lamp_1.id, 'attributes': {'brightness': 40}})
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['is_on'], frame['attributes'], frame['version']), (False, {'brightness': 40}, 1))
+
+            # Chỉ gửi key thực sự đổi, version tăng 1 mỗi lần đổi.
+            await socket.send_json_to({'device_id': lamp_1.id, 'attributes': {'is_on': True, 'brightness': 40}})
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['is_on'], frame['attributes'], frame['version']), (True, {}, 2))
+
+            # Không đổi gì -> không broadcast.
+            await socket.send_json_to({'device_id': lamp_1.id, 'attributes': {'is_on': True}})
+            self.assertTrue(await socket.receive_nothing(0.2))
+
+            await socket.send_json_to({'type': 'resync', 'device_ids': [lamp_1.id, 'x', 999999]})
+            self.assertEqual(await socket.receive_json_from(), {'type': 'resync', 'devices': [{
+                'device_id': lamp_1.id, 'room_id': self.room.id, 'is_on': True,
+                'attributes': {'brightness': 40}, 'version': 2,
+            }]})
+            await socket.send_json_to({'type': 'resync'})
+            frame = await socket.receive_json_from()
+            self.assertEqual([(d['device_id'], d['version']) for d in frame['devices']], [(lamp_1.id, 2), (lamp_2.id, 0)])
+
+            await device_state_cache.flush()
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        lamp_1.refresh_from_db()
+        self.assertEqual((lamp_1.is_on, lamp_1.attributes, lamp_1.version), (True, {'brightness': 40}, 2))
+
+    def test_connection_gauge_drops_room_series_after_last_socket(self):
+        async def run():
+            sockets = [await self.open_socket() for _ in range(2)]
+            self.assertEqual(WS_CONNECTIONS.labels(self.room.id).value, 2)
+            for socket in sockets:
+                await socket.disconnect()
+
+        async_to_sync(run)()
+        # Không còn socket nào trong room -> không còn series của room.
+        self.assertNotIn((str(self.room.id),), WS_CONNECTIONS._children)
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    Số query của list rooms/devices không được tăng theo số room/device (chống N+1).
+    """
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.client.force_authenticate(self.user)
+
+    def create_rooms(self, count, devices_per_room=3):
+        for i in range(count):
+            room = Room.objects.create(user=self.user, name=f'Room {i}')
+            Device.objects.bulk_create(
+                Device(room=room, name=f'Device {j}', icon_asset='lightbulb.png')
+                for j in range(devices_per_room)
+            )
+        # Ghi thẳng ORM không qua viewset -> tự bỏ response cache.
+        cache.clear()
+
+    def test_room_list_query_count_is_constant(self):
+        self.create_rooms(2)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/rooms/')
+        self.assertEqual(len(response.json()), 2)
+
+        self.create_rooms(30)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/rooms/')
+        self.assertEqual(len(response.json()), 32)
+        self.assertEqual(len(response.json()[-1]['devices']), 3)
+
+    def test_room_retrieve_query_count(self):
+        self.create_rooms(1, devices_per_room=20)
+        room = Room.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/rooms/{room.pk}/')
+        self.assertEqual(len(response.json()['devices']), 20)
+
+    def test_device_list_query_count_is_constant(self):
+        self.create_rooms(10)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/devices/')
+        self.assertEqual(len(response.json()), 30)
+
+    def test_device_update_does_not_load_owner(self):
+        self.create_rooms(1, devices_per_room=1)
+        device = Device.objects.get()
+        # get_object (device + room) + merge state (UPDATE ... RETURNING) + UPDATE name, trong 1 savepoint
+        with self.assertNumQueries(5):
+            response = self.client.patch(f'/api/devices/{device.pk}/', {'name': 'Lamp'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(user=self.user, name='Living room')
+
+    def test_unchanged_home_returns_304_without_queries(self):
+        response = self.client.get('/api/rooms/')
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/rooms/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_changes_etag_and_cached_response(self):
+        response = self.client.get('/api/devices/')
+        etag = response['ETag']
+        self.assertEqual(response.json(), [])
+
+        self.client.post('/api/devices/', {'room': self.room.pk, 'name': 'Lamp', 'icon_asset': 'lightbulb.png'}, format='json')
+
+        response = self.client.get('/api/devices/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 1)
+
+
+class DeviceBulkTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email='owner@example.com', password='x', name='owner')
+        other = User.objects.create_user(email='other@example.com', password='x', name='other')
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(user=self.user, name='Living room')
+        self.other_room = Room.objects.create(user=other, name='Not mine')
+
+    def test_bulk_create_validates_batch_and_applies_defaults(self):
+        items = [
+            {'room': self.room.pk, 'name': f'Light {i}', 'icon_asset': 'lightbulb.png', 'device_type': 'dimmableLight'}
+            for i in range(20)
+        ]
+        response = self.client.post('/api/devices/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Device.objects.filter(room=self.room).count(), 20)
+        self.assertEqual(response.json()[0]['attributes'], {'brightness': 100})
+
+    def test_bulk_create_reports_errors_per_item_and_writes_nothing(self):
+        items = [
+            {'room': self.room.pk, 'name': 'Lamp', 'icon_asset': 'lightbulb.png'},
+            {'room': self.other_room.pk, 'name': 'Lamp', 'icon_asset': 'lightbulb.png'},
+        ]
+        response = self.client.post('/api/devices/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [{}, {'room': ['Room not found.']}])
+        self.assertFalse(Device.objects.exists())
+
+    def test_bulk_update_and_delete(self):
+        devices = Device.objects.bulk_create(
+            Device(room=self.room, name=f'Switch {i}', icon_asset='tv.png') for i in range(5)
+        )
+        ids = [device.pk for device in devices]
+
+        response = self.client.patch('/api/devices/bulk/', [{'id': i, 'is_on': True} for i in ids], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Device.objects.filter(is_on=True).count(), 5)
+
+        response = self.client.delete('/api/devices/bulk/', {'ids': ids[:3]}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Device.objects.count(), 2)
+
+    def test_bulk_rejects_ids_that_are_not_integers(self):
+        device = Device.objects.create(room=self.room, name='Switch', icon_asset='tv.png')
+        response = self.client.patch('/api/devices/bulk/', [{'id': [device.pk], 'is_on': True}, {'id': True}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [{'id': ['A valid integer is required.']}] * 2)
+
+        response = self.client.delete('/api/devices/bulk/', {'ids': [[device.pk], device.pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [{'id': ['A valid integer is required.']}, {}])
+        self.assertTrue(Device.objects.exists())
+
+
+class DeviceListingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.client.force_authenticate(self.user)
+        room = Room.objects.create(user=self.user, name='Living room')
+        Device.objects.bulk_create(
+            Device(room=room, name=f'Device {i}', icon_asset='tv.png', is_on=i % 2 == 0) for i in range(7)
+        )
+
+    def test_cursor_pagination_with_filter_and_sparse_fields(self):
+        page = self.client.get('/api/devices/?page_size=3&is_on=true&fields=id,is_on').json()
+        self.assertEqual(len(page['results']), 3)
+        self.assertEqual(set(page['results'][0]), {'id', 'is_on'})
+
+        page = self.client.get(page['next']).json()
+        self.assertEqual(len(page['results']), 1)
+        self.assertIsNone(page['next'])
+
+    def test_list_without_page_params_is_unpaginated(self):
+        response = self.client.get('/api/devices/')
+        self.assertEqual(len(response.json()), 7)
+
+
+class DeviceHistoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.client.force_authenticate(self.user)
+        room = Room.objects.create(user=self.user, name='Living room')
+        self.device = Device.objects.create(room=room, name='Lamp', icon_asset='lightbulb.png')
+
+    def test_compaction_rolls_events_into_usage_buckets(self):
+        start = datetime(2026, 1, 1, 10, 0, 30, tzinfo=dt_timezone.utc)
+        DeviceStateEvent.objects.bulk_create([
+            DeviceStateEvent(device=self.device, recorded_at=start, is_on=True, brightness=40),
+            DeviceStateEvent(device=self.device, recorded_at=start + timedelta(minutes=45), is_on=True, brightness=80),
+            DeviceStateEvent(device=self.device, recorded_at=start + timedelta(minutes=90), is_on=False, brightness=80),
+        ])
+        # 2 lần compact liên tiếp phải nối tiếp nhau, không đếm trùng.
+        compact(now=start + timedelta(minutes=30))
+        compact(now=start + timedelta(hours=4))
+        self.assertTrue(DeviceUsageRollup.objects.filter(granularity=DeviceUsageRollup.Granularity.HOUR).exists())
+
+        response = self.client.get('/api/devices/usage/?start=2026-01-01T00:00:00Z&end=2026-01-02T00:00:00Z')
+        usage = response.json()['devices'][0]
+        self.assertEqual(usage['device_id'], self.device.pk)
+        self.assertEqual(usage['on_hours'], 1.5)
+        self.assertEqual(usage['avg_brightness'], 60.0)
+
+    def test_usage_rejects_invalid_datetimes(self):
+        for query in ('start=2024-13-01T00:00:00', 'start=yesterday', 'days=30&end=2024-02-30T00:00:00'):
+            response = self.client.get(f'/api/devices/usage/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+
+class BroadcastEncodingTests(SimpleTestCase):
+    def test_event_carries_frame_encoded_once(self):
+        state = {'device_id': 1, 'room_id': 2, 'is_on': True, 'attributes': {'brightness': 40}, 'version': 3}
+        event = state_event([state])
+        # Chỉ có frame đã encode, không kèm cấu trúc state -> consumer forward nguyên text / bytes.
+        self.assertEqual(set(event), {'type', 'text', 'bytes'})
+        self.assertEqual(json.loads(event['text']), state)
+        self.assertEqual(decode_binary(event['bytes']), state)
+        self.assertLess(len(event['bytes']), len(event['text']) / 2)
+
+        batch = json.loads(state_event([state, {**state, 'device_id': 5}], batch=True)['text'])
+        self.assertEqual((batch['type'], [d['device_id'] for d in batch['devices']]), ('batch', [1, 5]))
+
+
+class ShardedChannelLayerTests(SimpleTestCase):
+    def test_adding_a_shard_only_moves_groups_to_the_new_shard(self):
+        hosts = [f'redis://redis-{i}:6379' for i in range(4)]
+        before, after = HashRing(hosts), HashRing(hosts + ['redis://redis-4:6379'])
+        groups = [f'room_{i}' for i in range(5000)]
+        moved = [group for group in groups if before.get(group) != after.get(group)]
+        self.assertTrue(all(after.get(group) == 4 for group in moved))
+        self.assertLess(len(moved), len(groups) * 0.3)
+
+    def test_one_redis_message_fans_out_to_local_sockets(self):
+        channel_layer = ShardedChannelLayer(hosts=['redis://redis-0:6379', 'redis://redis-1:6379'])
+
+        async def run():
+            # Chỉ dựng state trong bộ nhớ, không kết nối Redis.
+            layer = channel_layer._get_layer()
+            channels = [f'asgispecific.{layer.worker}!{i}' for i in range(3)]
+            for channel in channels:
+                layer.channels[channel] = asyncio.Queue(layer.capacity)
+            group = layer._get_group_channel_name('room_1')
+            layer.groups[group] = set(channels[:2])
+
+            layer.dispatch(group, channel_layer.serialize({'type': 'device_state_update', 'text': '{}'}))
+            self.assertEqual([layer.channels[channel].qsize() for channel in channels], [1, 1, 0])
+            # Message tới channel của worker này qua inbox (send() từ worker khác).
+            layer.dispatch(layer.inbox, channel_layer.serialize({'channel': channels[2], 'message': {'type': 'x'}}))
+            self.assertEqual(await layer.receive(channels[2]), {'type': 'x'})
+
+        async_to_sync(run)()
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    def make_logger(self, level, *filters):
+        stream = io.StringIO()
+        handler = QueueListenerHandler(stream=stream)
+        for log_filter in filters:
+            handler.addFilter(log_filter)
+        self.addCleanup(handler.close)
+        logger = logging.getLogger(f'devices.tests.{self.id()}')
+        logger.propagate = False
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        return logger, handler, stream
+
+    def test_event_is_written_as_json_line(self):
+        logger, handler, stream = self.make_logger(logging.INFO)
+        log_event(logger, logging.INFO, 'ws.connect', room_id=3, user_id=7)
+        handler.stop()
+
+        line = json.loads(stream.getvalue())
+        self.assertEqual(line['event'], 'ws.connect')
+        self.assertEqual((line['room_id'], line['user_id']), (3, 7))
+
+    def test_payload_is_not_logged_below_debug(self):
+        logger, handler, stream = self.make_logger(logging.INFO)
+        log_event(logger, logging.DEBUG, 'ws.receive', payload='{"device_id": 1}')
+        handler.stop()
+        self.assertEqual(stream.getvalue(), '')
+
+    def test_rate_limit_reports_dropped_events(self):
+        logger, handler, stream = self.make_logger(logging.DEBUG, SamplingFilter(rate_limits={'ws.receive': 2}))
+        for _ in range(10):
+            log_event(logger, logging.DEBUG, 'ws.receive')
+        # Warning không bị giới hạn.
+        log_event(logger, logging.WARNING, 'ws.receive')
+        handler.stop()
+
+        lines = stream.getvalue().splitlines()
+        # 2 event/giây + 1 warning (hiếm khi vắt qua 2 giây -> tối đa 5).
+        self.assertLessEqual(len(lines), 5)
+        self.assertGreaterEqual(len(lines), 3)
+
+
+class MetricsTests(APITestCase):
+    def test_metrics_endpoint_exposes_view_latency(self):
+        user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.client.force_authenticate(user)
+        responses = HTTP_RESPONSES.labels('RoomViewSet', 'list', 200)
+        before = responses.value
+
+        self.client.get('/api/rooms/')
+        self.assertEqual(responses.value, before + 1)
+
+        self.client.force_authenticate(None)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_seconds histogram', body)
+        self.assertIn('http_request_seconds_bucket{view="RoomViewSet",action="list",le="+Inf"}', body)
+
+    def test_metrics_token(self):
+        with self.settings(METRICS={'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MultiplexedSocketTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        User = get_user_model()
+        self.user = User.objects.create_user(email='owner@example.com', password='x', name='owner')
+        other = User.objects.create_user(email='other@example.com', password='x', name='other')
+        self.rooms = [Room.objects.create(user=self.user, name=f'Room {i}') for i in range(2)]
+        self.other_room = Room.objects.create(user=other, name='Other')
+        self.devices = [
+            Device.objects.create(
+                room=room, name='Lamp', icon_asset='lamp.png',
+                device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+            )
+            for room in self.rooms
+        ]
+
+    async def open_socket(self):
+        from home_electronics_backend.asgi import application
+        socket = WebsocketCommunicator(application, f'/ws/devices/?token={AccessToken.for_user(self.user)}')
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    def test_subscribe_route_and_unsubscribe(self):
+        room_ids = [room.id for room in self.rooms]
+        lamp_1, lamp_2 = self.devices
+
+        async def run():
+            socket = await self.open_socket()
+            await socket.send_json_to({'type': 'subscribe', 'room_ids': room_ids + [self.other_room.id]})
+
+            error = await socket.receive_json_from()
+            self.assertEqual(error['room_ids'], [self.other_room.id])
+            snapshots = [await socket.receive_json_from() for _ in room_ids]
+            self.assertEqual([frame['room_id'] for frame in snapshots], room_ids)
+
+            # Lệnh được route theo device -> broadcast về group của room chứa device.
+            await socket.send_json_to({'device_id': lamp_2.id, 'attributes': {'brightness': 50}})
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['device_id'], frame['room_id'], frame['version']), (lamp_2.id, room_ids[1], 1))
+
+            await socket.send_json_to({'type': 'unsubscribe', 'room_ids': [room_ids[1]]})
+            await socket.send_json_to({'device_id': lamp_2.id, 'attributes': {'brightness': 60}})
+            self.assertEqual(await socket.receive_json_from(), {'error': 'Permission denied.'})
+            self.assertNotIn((str(room_ids[1]),), WS_CONNECTIONS._children)
+
+            await socket.send_json_to({'device_id': lamp_1.id, 'attributes': {'is_on': True}})
+            self.assertEqual((await socket.receive_json_from())['room_id'], room_ids[0])
+
+            await device_state_cache.flush()
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        lamp_2.refresh_from_db()
+        self.assertEqual(lamp_2.attributes, {'brightness': 50})
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WebSocketThrottlingTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamp = Device.objects.create(
+            room=self.room, name='Lamp', icon_asset='lamp.png',
+            device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+        )
+
+    async def open_socket(self):
+        from home_electronics_backend.asgi import application
+        socket = WebsocketCommunicator(application, f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}', subprotocols=[JSON_SUBPROTOCOL])
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        await socket.receive_json_from()   # snapshot
+        return socket
+
+    @override_settings(DEVICE_WS_THROTTLE={'COALESCE_WINDOW': 0.2, 'RATE': 1000, 'BURST': 1000})
+    def test_slider_updates_are_coalesced(self):
+        async def run():
+            socket = await self.open_socket()
+            for brightness in range(20, 30):
+                await socket.send_json_to({'device_id': self.lamp.id, 'attributes': {'brightness': brightness}})
+
+            # Update đầu áp dụng ngay, các update còn lại gộp thành 1 lần khi hết cửa sổ.
+            first = await socket.receive_json_from()
+            last = await socket.receive_json_from(timeout=2)
+            self.assertEqual((first['attributes'], first['version']), ({'brightness': 20}, 1))
+            self.assertEqual((last['attributes'], last['version']), ({'brightness': 29}, 2))
+            await asyncio.sleep(0.3)
+            self.assertTrue(await socket.receive_nothing())
+            await socket.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(DEVICE_WS_THROTTLE={'COALESCE_WINDOW': 2, 'RATE': 1000, 'BURST': 1000})
+    def test_coalesced_update_is_applied_by_latest_sender(self):
+        from home_electronics_backend.asgi import application
+        other_room = Room.objects.create(user=self.user, name='Other')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        async def run():
+            socket = await self.open_socket()
+            await socket.send_json_to({'device_id': self.lamp.id, 'attributes': {'brightness': 20}})
+            self.assertEqual((await socket.receive_json_from())['attributes'], {'brightness': 20})
+
+            # Device chuyển room trong cửa sổ gộp -> socket mở cửa sổ mất quyền,
+            # update của socket ở room mới vẫn phải được áp dụng khi hết cửa sổ.
+            await device_state_cache.flush()
+            response = await sync_to_async(client.patch)(f'/api/devices/{self.lamp.id}/', {'room': other_room.pk}, format='json')
+            self.assertEqual(response.status_code, 200)
+            moved = WebsocketCommunicator(application, f'/ws/devices/{other_room.id}/?token={AccessToken.for_user(self.user)}', subprotocols=[JSON_SUBPROTOCOL])
+            self.assertTrue((await moved.connect())[0])
+            await moved.receive_json_from()   # snapshot
+            await moved.send_json_to({'device_id': self.lamp.id, 'attributes': {'brightness': 30}})
+
+            frame = await moved.receive_json_from(timeout=3)
+            self.assertEqual((frame['device_id'], frame['attributes']), (self.lamp.id, {'brightness': 30}))
+            await moved.disconnect()
+            await socket.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(DEVICE_WS_THROTTLE={'COALESCE_WINDOW': 0, 'RATE': 0.1, 'BURST': 2})
+    def test_rate_limit_sends_one_backpressure_error(self):
+        async def run():
+            socket = await self.open_socket()
+            for brightness in range(20, 25):
+                await socket.send_json_to({'device_id': self.lamp.id, 'attributes': {'brightness': brightness}})
+
+            frames = [await socket.receive_json_from() for _ in range(3)]
+            self.assertEqual([frame.get('version') for frame in frames[:2]], [1, 2])
+            self.assertEqual(frames[2]['error'], 'Rate limit exceeded.')
+            self.assertGreater(frames[2]['retry_after'], 0)
+            self.assertTrue(await socket.receive_nothing())
+            await socket.disconnect()
+
+        async_to_sync(run)()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class BinaryProtocolTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamp = Device.objects.create(
+            room=self.room, name='Lamp', icon_asset='lamp.png',
+            device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+        )
+
+    def test_unknown_integer_key_is_rejected(self):
+        with self.assertRaises(ValueError):
+            decode_binary(encode_binary({'device_id': 1, 'attributes': {99: 1}}))
+        with self.assertRaises(ValueError):
+            decode_binary(bytes([0x81, 0x63, 0x01]))   # {99: 1}
+        with self.assertRaises(ValueError):
+            decode_binary(b'\xc1')
+
+    def test_binary_and_json_sockets_share_a_room(self):
+        from home_electronics_backend.asgi import application
+        path = f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}'
+
+        async def run():
+            binary = WebsocketCommunicator(application, path, subprotocols=[MSGPACK_SUBPROTOCOL])
+            connected, subprotocol = await binary.connect()
+            self.assertEqual((connected, subprotocol), (True, MSGPACK_SUBPROTOCOL))
+            text = WebsocketCommunicator(application, path, subprotocols=[JSON_SUBPROTOCOL])
+            self.assertTrue((await text.connect())[0])
+
+            snapshot = decode_binary(await binary.receive_from())
+            self.assertEqual(snapshot['devices'][0]['attributes'], {'brightness': 10})
+            await text.receive_json_from()
+
+            # {device_id: .., attributes: {is_on: true, brightness: 70}} với key số.
+            await binary.send_to(bytes_data=bytes([0x82, 0x01, self.lamp.id, 0x04, 0x82, 0x00, 0xc3, 0x01, 70]))
+            frame = decode_binary(await binary.receive_from())
+            self.assertEqual((frame['attributes'], frame['is_on'], frame['version']), ({'brightness': 70}, True, 1))
+            self.assertEqual(await text.receive_json_from(), frame)
+
+            await binary.send_to(bytes_data=encode_binary({'type': 'resync'}))
+            self.assertEqual(decode_binary(await binary.receive_from())['type'], 'resync')
+
+            await device_state_cache.flush()
+            await binary.disconnect()
+            await text.disconnect()
+
+        async_to_sync(run)()
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.is_on, self.lamp.attributes), (True, {'brightness': 70}))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class AttributeSchemaTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_every_schema_key_has_a_wire_id(self):
+        for device_type, spec in ATTRIBUTE_SCHEMAS.items():
+            self.assertLessEqual(set(spec), set(ATTRIBUTE_KEYS[device_type]), device_type)
+
+    def test_rest_rejects_unknown_and_out_of_range_attributes(self):
+        device = {'room': self.room.pk, 'name': 'Lamp', 'icon_asset': 'lamp.png', 'device_type': 'dimmableLight'}
+        attributes = {'brightness': 150, 'junk': 1}
+        response = self.client.post('/api/devices/', {**device, 'attributes': attributes}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['attributes']), {'brightness', 'junk'})
+
+        created = self.client.post('/api/devices/', device, format='json').json()
+        self.assertEqual(created['attributes'], {'brightness': 100})
+        url = f"/api/devices/{created['id']}/"
+        response = self.client.patch(url, {'attributes': {'brightness': '5'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        # Switch không có brightness.
+        switch = {**device, 'device_type': 'binarySwitch', 'attributes': {'brightness': 5}}
+        response = self.client.post('/api/devices/', switch, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Device.objects.get().version, 0)
+
+    def test_changing_type_rebuilds_attributes_from_new_schema(self):
+        device = {'room': self.room.pk, 'name': 'Lamp', 'icon_asset': 'lamp.png', 'device_type': 'dimmableLight'}
+        created = self.client.post('/api/devices/', {**device, 'attributes': {'brightness': 40}}, format='json').json()
+        url = f"/api/devices/{created['id']}/"
+
+        response = self.client.patch(url, {'device_type': 'binarySwitch'}, format='json')
+        self.assertEqual((response.status_code, response.json()['attributes']), (200, {}))
+        self.assertEqual(Device.objects.get().attributes, {})
+        # Write tiếp theo không còn vướng key của loại cũ.
+        self.assertEqual(self.client.patch(url, {'name': 'Plug', 'attributes': {}}, format='json').status_code, 200)
+
+        response = self.client.patch('/api/devices/bulk/', [{'id': created['id'], 'device_type': 'dimmableLight'}], format='json')
+        self.assertEqual(response.json()[0]['attributes'], {'brightness': 100})
+        self.assertEqual(Device.objects.get().attributes, {'brightness': 100})
+
+    def test_socket_rejects_whole_message_before_applying(self):
+        from home_electronics_backend.asgi import application
+        lamp = Device.objects.create(
+            room=self.room, name='Lamp', icon_asset='lamp.png',
+            device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+        )
+        switch = Device.objects.create(room=self.room, name='Plug', icon_asset='plug.png')
+
+        async def run():
+            path = f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}'
+            socket = WebsocketCommunicator(application, path, subprotocols=[JSON_SUBPROTOCOL])
+            await socket.connect()
+            await socket.receive_json_from()   # snapshot
+
+            await socket.send_json_to({'device_id': lamp.id, 'attributes': {'brightness': 50, 'junk': True}})
+            frame = await socket.receive_json_from()
+            self.assertEqual(frame['errors'], {str(lamp.id): {'junk': 'Unknown attribute for this device type.'}})
+
+            await socket.send_json_to({'type': 'batch', 'updates': [
+                {'device_id': lamp.id, 'attributes': {'brightness': 60}},
+                {'device_id': switch.id, 'attributes': {'is_on': 'yes'}},
+            ]})
+            self.assertEqual(set((await socket.receive_json_from())['errors']), {str(switch.id)})
+            self.assertTrue(await socket.receive_nothing())
+            self.assertEqual(device_state_cache.peek(lamp.id)['attributes'], {'brightness': 10})
+            await socket.disconnect()
+
+        async_to_sync(run)()
+
+
+class AtomicStateMergeTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamp = Device.objects.create(
+            room=self.room, name='Lamp', icon_asset='lamp.png',
+            device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_concurrent_writers_keep_every_key(self):
+        writers = 8
+        errors, gave_up = [], []
+
+        def write(i):
+            try:
+                for _ in range(100):
+                    try:
+                        merge_state(self.lamp.pk, {'is_on': None, 'attributes': {f'key{i}': i}, 'bumps': 1})
+                        return
+                    except OperationalError:
+                        # SQLite in-memory (shared cache) báo "table is locked" ngay, không chờ lock.
+                        time.sleep(0.01)
+                gave_up.append(i)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if gave_up:
+            self.fail(f'Writers {gave_up} still got "table is locked" after 100 attempts.')
+        self.assertEqual(errors, [])
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.attributes, {'brightness': 10, **{f'key{i}': i for i in range(writers)}})
+        self.assertEqual(self.lamp.version, writers)
+
+    def test_compare_and_set_rejects_stale_version(self):
+        change = {'is_on': True, 'attributes': {'brightness': 50}, 'bumps': 1}
+        self.assertEqual(merge_state(self.lamp.pk, change, expected_version=0)['version'], 1)
+        self.assertIsNone(merge_state(self.lamp.pk, change, expected_version=0))
+
+        response = self.client.patch(
+            f'/api/devices/{self.lamp.pk}/', {'attributes': {'brightness': 20}, 'version': 0}, format='json'
+        )
+        self.assertEqual((response.status_code, response.json()['version']), (409, 1))
+
+    def test_rest_patch_merges_with_pending_socket_change(self):
+        async def apply_from_socket():
+            await device_state_cache.get(self.lamp.pk)
+            device_state_cache.apply(self.lamp.pk, {'brightness': 70, 'is_on': True})
+
+        async_to_sync(apply_from_socket)()
+        # Writer khác (worker khác) ghi key riêng trong lúc cache chưa flush.
+        merge_state(self.lamp.pk, {'is_on': None, 'attributes': {'scene': 'night'}, 'bumps': 1})
+
+        response = self.client.patch(
+            f'/api/devices/{self.lamp.pk}/', {'attributes': {'brightness': 90}}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['attributes'], {'brightness': 90, 'scene': 'night'})
+        self.assertEqual((response.json()['is_on'], response.json()['version']), (True, 3))
+        # Lịch sử của change socket chưa flush được ghi cùng lần PATCH, trước event của PATCH.
+        events = DeviceStateEvent.objects.filter(device=self.lamp).order_by('recorded_at', 'id')
+        self.assertEqual(list(events.values_list('is_on', 'brightness')), [(True, 70), (True, 90)])
+
+
+class ScheduleTimingTests(SimpleTestCase):
+    def test_queue_skips_replaced_and_removed_entries(self):
+        queue = ScheduleQueue()
+        queue.load([(1, 30.0), (2, 10.0), (3, 20.0)])
+        queue.set(2, 40.0)
+        queue.set(3, None)
+        self.assertEqual(queue.next_time(), 30.0)
+        self.assertEqual(queue.pop_due(35.0, limit=10), [1])
+        self.assertEqual(queue.pop_due(50.0, limit=10), [2])
+        self.assertIsNone(queue.next_time())
+
+    def test_next_run_of_daily_and_sunset_triggers(self):
+        after = datetime(2026, 6, 21, 12, 0, tzinfo=dt_timezone.utc)
+        daily = Schedule(trigger=Schedule.Trigger.DAILY, time_of_day=datetime(2026, 1, 1, 23).time(), timezone='Asia/Ho_Chi_Minh')
+        # 23:00 giờ Việt Nam = 16:00 UTC.
+        self.assertEqual(compute_next_run(daily, after), datetime(2026, 6, 21, 16, 0, tzinfo=dt_timezone.utc))
+
+        sunset = Schedule(trigger=Schedule.Trigger.SUNSET, latitude=21.03, longitude=105.85, offset_minutes=-30)
+        next_run = compute_next_run(sunset, after)
+        # Hà Nội lặn ~18:40 (11:40 UTC), hôm nay đã qua -> mai, sớm 30 phút.
+        self.assertEqual(next_run.date(), datetime(2026, 6, 22).date())
+        self.assertEqual((next_run.hour, next_run.minute // 10), (11, 1))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ScheduleWorkerTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamps = [
+            Device.objects.create(
+                room=self.room, name=f'Lamp {i}', icon_asset='lamp.png', is_on=True,
+                device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 80},
+            )
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_due_schedule_updates_devices_and_broadcasts_once_per_room(self):
+        response = self.client.post('/api/schedules/', {
+            'name': 'Lights off',
+            'trigger': 'daily',
+            'time_of_day': '23:00',
+            'devices': [lamp.id for lamp in self.lamps],
+            'attributes': {'is_on': False},
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(response.json()['next_run_at'])
+        schedule = Schedule.objects.get()
+
+        async def run():
+            from home_electronics_backend.asgi import application
+            socket = WebsocketCommunicator(application, f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}', subprotocols=[JSON_SUBPROTOCOL])
+            await socket.connect()
+            await socket.receive_json_from()   # snapshot
+
+            worker = SchedulerWorker()
+            await worker.load()
+            self.assertEqual(await worker.run_due(now=schedule.next_run_at), 1)
+
+            frame = await socket.receive_json_from()
+            self.assertEqual(frame['type'], 'batch')
+            self.assertEqual({(d['is_on'], d['version']) for d in frame['devices']}, {(False, 1)})
+            self.assertTrue(await socket.receive_nothing())
+            # Lần chạy kế tiếp (ngày mai) đã nằm lại trong heap.
+            self.assertEqual(len(worker.queue), 1)
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(set(Device.objects.values_list('is_on', 'version')), {(False, 1)})
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.next_run_at - schedule.last_run_at, timedelta(days=1))
+
+    def test_skips_devices_whose_type_no_longer_fits_attributes(self):
+        response = self.client.post('/api/schedules/', {
+            'name': 'Dim',
+            'trigger': 'daily',
+            'time_of_day': '23:00',
+            'devices': [lamp.id for lamp in self.lamps],
+            'attributes': {'brightness': 20},
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        schedule = Schedule.objects.get()
+        # Đổi loại sau khi lưu schedule -> brightness không còn hợp lệ với lamps[1].
+        response = self.client.patch(f'/api/devices/{self.lamps[1].id}/', {'device_type': 'binarySwitch'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        async def run():
+            worker = SchedulerWorker()
+            await worker.load()
+            self.assertEqual(await worker.run_due(now=schedule.next_run_at), 1)
+
+        with self.assertLogs('devices.schedules', logging.WARNING) as logs:
+            async_to_sync(run)()
+        self.assertEqual([record.event for record in logs.records], ['scheduler.skip'])
+        self.assertEqual(logs.records[0].fields['device_id'], self.lamps[1].id)
+        self.assertEqual(Device.objects.get(pk=self.lamps[0].pk).attributes, {'brightness': 20})
+        self.assertEqual(Device.objects.get(pk=self.lamps[1].pk).attributes, {})
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.last_run_at, schedule.next_run_at - timedelta(days=1))
+
+    def test_rejects_devices_of_other_users(self):
+        other = get_user_model().objects.create_user(email='other@example.com', password='x', name='other')
+        other_lamp = Device.objects.create(room=Room.objects.create(user=other, name='Other'), name='Lamp', icon_asset='lamp.png')
+        response = self.client.post('/api/schedules/', {
+            'name': 'Lights off',
+            'trigger': 'once',
+            'run_at': '2030-01-01T00:00:00Z',
+            'devices': [other_lamp.id],
+            'attributes': {'is_on': False},
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('devices', response.json())
+
+    def test_attributes_are_required(self):
+        response = self.client.post('/api/schedules/', {
+            'name': 'Lights off',
+            'trigger': 'once',
+            'run_at': '2030-01-01T00:00:00Z',
+            'devices': [self.lamps[0].id],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['attributes'], ['This field is required.'])
+        self.assertFalse(Schedule.objects.exists())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class GatewayIngestionTests(TransactionTestCase):
+    def setUp(self):
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        self.lamps = [
+            Device.objects.create(
+                room=self.room, name=f'Lamp {i}', icon_asset='lamp.png',
+                device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 10},
+            )
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/gateways/', {'name': 'Hub'}, format='json')
+        self.key = response.json()['key']
+        self.gateway_client = APIClient()
+        self.gateway_client.credentials(HTTP_AUTHORIZATION=f'Gateway {self.key}')
+
+    async def open_app_socket(self):
+        from home_electronics_backend.asgi import application
+        socket = WebsocketCommunicator(application, f'/ws/devices/{self.room.id}/?token={AccessToken.for_user(self.user)}', subprotocols=[JSON_SUBPROTOCOL])
+        await socket.connect()
+        await socket.receive_json_from()   # snapshot
+        return socket
+
+    def test_http_batch_dedupes_persists_and_fans_out(self):
+        lamp_1, lamp_2 = self.lamps
+        # Key chỉ trả về lúc tạo.
+        self.assertNotIn('key', self.client.get('/api/gateways/').json()[0])
+
+        async def run():
+            socket = await self.open_app_socket()
+            report = await sync_to_async(self.gateway_client.post)('/api/gateway/reports/', {'reports': [
+                [lamp_1.id, True, {'brightness': 10}],
+                [lamp_2.id, False, {'brightness': 300}],
+                [999, True],
+            ]}, format='json')
+            self.assertEqual((report.json()['changed'], report.json()['unknown']), (1, [999]))
+            # Sai schema -> bỏ riêng device đó.
+            self.assertEqual(set(report.json()['rejected'][str(lamp_2.id)]), {'brightness'})
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['device_id'], frame['is_on'], frame['attributes'], frame['version']), (lamp_1.id, True, {}, 1))
+
+            # Báo lại đúng state hiện tại -> không ghi, không broadcast.
+            report = await sync_to_async(self.gateway_client.post)('/api/gateway/reports/', {'reports': [
+                [lamp_1.id, True, {'brightness': 10}],
+            ]}, format='json')
+            self.assertEqual(report.json()['changed'], 0)
+            self.assertTrue(await socket.receive_nothing())
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(list(Device.objects.order_by('id').values_list('is_on', 'version')), [(True, 1), (False, 0)])
+
+        bad = APIClient()
+        bad.credentials(HTTP_AUTHORIZATION='Gateway wrong')
+        self.assertEqual(bad.post('/api/gateway/reports/', {'reports': [[lamp_1.id, False]]}, format='json').status_code, 401)
+
+    def test_websocket_reports_are_acked_and_broadcast(self):
+        lamp = self.lamps[0]
+
+        async def run():
+            from home_electronics_backend.asgi import application
+            app_socket = await self.open_app_socket()
+            gateway = WebsocketCommunicator(application, f'/ws/gateway/?key={self.key}')
+            connected, _ = await gateway.connect()
+            self.assertTrue(connected)
+
+            await gateway.send_json_to({'seq': 7, 'reports': [[lamp.id, None, {'brightness': 55}]]})
+            self.assertEqual(await gateway.receive_json_from(), {'type': 'ack', 'seq': 7, 'changed': 1, 'unknown': [], 'rejected': {}})
+            frame = await app_socket.receive_json_from()
+            self.assertEqual((frame['attributes'], frame['version']), ({'brightness': 55}, 1))
+
+            await gateway.send_json_to({'seq': 8, 'reports': [['x']]})
+            self.assertEqual((await gateway.receive_json_from())['type'], 'error')
+            await gateway.disconnect()
+            await app_socket.disconnect()
+
+            denied = WebsocketCommunicator(application, '/ws/gateway/?key=wrong')
+            connected, _ = await denied.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(run)()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SceneTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        device_state_cache.clear()
+        self.addCleanup(device_state_cache.clear)
+        User = get_user_model()
+        self.user = User.objects.create_user(email='owner@example.com', password='x', name='owner')
+        other = User.objects.create_user(email='other@example.com', password='x', name='other')
+        self.rooms = [Room.objects.create(user=self.user, name=f'Room {i}') for i in range(2)]
+        self.lamps = Device.objects.bulk_create([
+            Device(
+                room=self.rooms[i % 2], name=f'Lamp {i}', icon_asset='lamp.png',
+                device_type=Device.DeviceType.DIMMABLE_LIGHT, attributes={'brightness': 100},
+            )
+            for i in range(40)
+        ])
+        self.other_lamp = Device.objects.create(
+            room=Room.objects.create(user=other, name='Other'), name='Lamp', icon_asset='lamp.png',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_scene(self, targets):
+        return self.client.post('/api/scenes/', {'name': 'Movie', 'targets': targets}, format='json')
+
+    def test_targets_are_validated_per_device(self):
+        response = self.create_scene([
+            {'device': self.lamps[0].id, 'attributes': {'brightness': 500}},
+            {'device': self.other_lamp.id, 'attributes': {'is_on': False}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['targets']
+        self.assertEqual((set(errors[0]['attributes']), errors[1]['device']), ({'brightness'}, 'Device not found.'))
+        self.assertFalse(Scene.objects.exists())
+
+    def test_apply_writes_once_and_broadcasts_once_per_room(self):
+        from home_electronics_backend.asgi import application
+        targets = [{'device': lamp.id, 'attributes': {'is_on': True, 'brightness': 20}} for lamp in self.lamps]
+        scene_id = self.create_scene(targets).json()['id']
+        url = f'/api/scenes/{scene_id}/apply/'
+
+        async def run():
+            path = f'/ws/devices/{self.rooms[0].id}/?token={AccessToken.for_user(self.user)}'
+            socket = WebsocketCommunicator(application, path, subprotocols=[JSON_SUBPROTOCOL])
+            await socket.connect()
+            await socket.receive_json_from()   # snapshot
+
+            response = await sync_to_async(self.client.post)(url)
+            self.assertEqual(len(response.json()['devices']), 40)
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['type'], len(frame['devices'])), ('batch', 20))
+            self.assertTrue(await socket.receive_nothing())
+            await socket.disconnect()
+
+        async_to_sync(run)()
+        rows = Device.objects.filter(room__user=self.user).values_list('is_on', 'attributes', 'version')
+        self.assertEqual({(is_on, attributes['brightness'], version) for is_on, attributes, version in rows}, {(True, 20, 1)})
+
+        # Plan đã cache: lookup scene, merge state, lịch sử (+ savepoint của transaction).
+        with self.assertNumQueries(5):
+            self.assertEqual(self.client.post(url).status_code, 200)
+
+        # Sửa scene -> plan mới.
+        self.client.patch(f'/api/scenes/{scene_id}/', {'targets': targets[:1]}, format='json')
+        self.assertEqual(len(self.client.post(url).json()['devices']), 1)
 
-# Create your tests here.
@@ -0,0 +1,104 @@
+# devices/throttling.py
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+
+from home_electronics_backend.log import log_event
+
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Cửa sổ gộp update của cùng 1 device (giây). 0 -> tắt, update nào cũng áp dụng ngay.
+    'COALESCE_WINDOW': 0.05,
+    # Token bucket cho mỗi connection: RATE message/giây, dồn tối đa BURST message.
+    'RATE': 20,
+    'BURST': 40,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DEVICE_WS_THROTTLE', {})}
+
+
+class TokenBucket:
+    """
+    Mỗi message tốn 1 token, token hồi lại RATE token/giây, tối đa BURST token.
+    take() trả về 0 nếu được phép, hoặc số giây cần chờ tới khi có token.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class UpdateCoalescer:
+    """
+    Gộp update của cùng 1 device (vd: kéo slider brightness) trong cả process:
+        - Update đầu tiên -> áp dụng ngay (bấm 1 lần không bị trễ), mở cửa sổ COALESCE_WINDOW giây.
+        - Update tới trong cửa sổ -> merge vào phần chờ (key sau ghi đè key trước), không áp dụng.
+        - Hết cửa sổ: có phần chờ -> áp dụng 1 lần (qua callback của consumer gửi update cuối cùng)
+          và mở cửa sổ mới, không có -> đóng cửa sổ.
+    Kéo slider 60 frame/giây -> ~20 lần áp dụng + broadcast/giây với cửa sổ 0.05s, giá trị cuối luôn được áp dụng.
+    """
+    def __init__(self):
+        self._pending = {}   # device_id -> (attributes đang chờ, callback của consumer gửi sau cùng)
+        self._open = set()   # device đang trong cửa sổ
+
+    def submit(self, device_id, attributes, apply):
+        """
+        True -> caller áp dụng ngay. False -> đã gộp vào phần chờ, apply(device_id, attributes)
+        sẽ được gọi khi hết cửa sổ.
+        """
+        window = get_config()['COALESCE_WINDOW']
+        if window <= 0:
+            return True
+        if device_id not in self._open:
+            self._open.add(device_id)
+            asyncio.get_running_loop().create_task(self._drain(device_id, window))
+            return True
+        # Giữ callback của consumer gửi sau cùng: consumer mở cửa sổ có thể đã mất quyền với device.
+        pending, _ = self._pending.get(device_id, ({}, None))
+        self._pending[device_id] = ({**pending, **attributes}, apply)
+        return False
+
+    def take_pending(self, device_id):
+        # Batch áp dụng ngay device này -> lấy phần chờ ra để batch merge (giá trị batch mới hơn).
+        attributes, _ = self._pending.pop(device_id, ({}, None))
+        return attributes
+
+    async def _drain(self, device_id, window):
+        try:
+            while True:
+                await asyncio.sleep(window)
+                pending = self._pending.pop(device_id, None)
+                if pending is None:
+                    return
+                attributes, apply = pending
+                try:
+                    await apply(device_id, attributes)
+                except (PermissionDenied, Device.DoesNotExist):
+                    # Device bị xoá / chuyển room trong lúc chờ -> bỏ phần chờ.
+                    log_event(logger, logging.WARNING, 'ws.coalesce_dropped', device_id=device_id, attributes=attributes)
+                except Exception:
+                    logger.exception('Coalesced update for device %s failed', device_id)
+        finally:
+            self._open.discard(device_id)
+            self._pending.pop(device_id, None)
+
+
+update_coalescer = UpdateCoalescer()
@@ -1,12 +1,17 @@
 # devices/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RoomViewSet, DeviceViewSet
+from .views import RoomViewSet, DeviceViewSet, GatewayReportView, GatewayViewSet, SceneViewSet, ScheduleViewSet, WireSchemaView
 
 router = DefaultRouter()
 router.register(r'rooms', RoomViewSet, basename='room')
 router.register(r'devices', DeviceViewSet, basename='device')
+router.register(r'schedules', ScheduleViewSet, basename='schedule')
+router.register(r'scenes', SceneViewSet, basename='scene')
+router.register(r'gateways', GatewayViewSet, basename='gateway')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('gateway/reports/', GatewayReportView.as_view(), name='gateway-reports'),
+    path('ws-schema/', WireSchemaView.as_view(), name='ws-schema'),
 ]
\ No newline at end of file
@@ -1,8 +1,75 @@
 # /home/trand/D/personal/home_electronics_backend/devices/views.py
-from rest_framework import viewsets, permissions, serializers
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions, mixins, viewsets, permissions, serializers, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from .models import Room, Device
-from .serializers import RoomSerializer, DeviceSerializer
+from rest_framework.views import APIView
+from home_electronics_backend.metrics import ViewMetricsMixin
+from .history import record_state_events, usage_summary
+from .http_cache import ConditionalCacheMixin, bump_revision
+from .ingestion import GatewayAuthentication, ingest_reports, parse_reports
+from .models import Room, Device, DeviceStateEvent, Gateway, Scene, Schedule
+from .scenes import apply_scene, invalidate_scene_plans
+from .schedules import compute_next_run
+from .serializers import (
+    RoomSerializer, DeviceSerializer, DeviceBulkSerializer, GatewaySerializer, SceneSerializer, ScheduleSerializer,
+    SparseFieldsMixin,
+)
+from .realtime import notify_room_devices_changed, notify_schedule_changed, publish_device_states
+from .state_cache import device_state_cache
+from .state_merge import combine_changes, merge_state, merge_states
+from .wire import schema as wire_schema
+
+# Số item tối đa trong 1 request /api/devices/bulk/
+BULK_MAX_ITEMS = 500
+
+
+def is_device_id(value):
+    # id trong body bulk phải là số nguyên JSON (list / object không hash được, true không phải id 1).
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class VersionConflict(exceptions.APIException):
+    # PATCH kèm version nhưng device đã bị writer khác đổi (WebSocket, REST khác,...).
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Device was modified by another writer.'
+    default_code = 'version_conflict'
+
+    def __init__(self, version):
+        super().__init__()
+        # Trả kèm version hiện tại -> client lấy lại state rồi thử lại.
+        self.detail = {'detail': self.detail, 'version': version}
+
+
+def state_change(validated_data):
+    """
+    Tách is_on/attributes khỏi validated_data thành 1 change (xem state_merge.py), +1 version.
+    attributes chỉ gồm các key gửi lên -> merge vào attributes hiện có, không thay cả object.
+    """
+    return {
+        'is_on': validated_data.pop('is_on', None),
+        'attributes': validated_data.pop('attributes', None) or {},
+        'bumps': 1,
+    }
+
+
+def retype_change(change, validated_data):
+    """
+    Device đổi loại: attributes thay toàn bộ bằng attributes của loại mới (default + key gửi lên,
+    xem DeviceSerializer.validate), không merge -> key của loại cũ (kể cả change socket chưa flush)
+    không còn nằm lại. Trả về (change chỉ còn is_on / bumps, attributes mới để ghi thẳng).
+    """
+    return {**change, 'attributes': {}}, validated_data['attributes']
+
 
 class IsOwner(permissions.BasePermission):
     """
@@ -10,31 +77,58 @@ class IsOwner(permissions.BasePermission):
     Với thao tác ghi (Put/ Patch/ Delete):
         - Nếu object là Room -> User phải là chủ của Room
         - Nếu object là Device -> User phải là chủ của Room chứa Device.
+    So sánh theo id (user_id) -> không phải load thêm User từ DB.
     """
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
         if isinstance(obj, Room):
-            return obj.user == request.user
+            return obj.user_id == request.user.id
         if isinstance(obj, Device):
-            return obj.room.user == request.user
+            return obj.room.user_id == request.user.id
         return False
 
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(ViewMetricsMixin, ConditionalCacheMixin, viewsets.ModelViewSet):
     """
     Mọi endpoint rooms/:
         - /api/rooms/ (list, create)
         - /api/rooms/<id>/ (retrieve, update, delete)
+    list/retrieve hỗ trợ ETag/Last-Modified (304) + cache response theo user.
     """
     serializer_class = RoomSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
 
-    # Lấy Room
+    # Lấy Room, kèm luôn devices bằng 1 query prefetch (RoomSerializer lồng DeviceSerializer)
+    # -> list N room chỉ tốn 2 query thay vì N + 1.
+    # ?fields=id,name (không có devices) -> bỏ luôn query prefetch.
     def get_queryset(self):
-        return Room.objects.filter(user=self.request.user)
+        queryset = Room.objects.filter(user=self.request.user).order_by('id')
+        requested = SparseFieldsMixin.requested_fields(self.request)
+        if requested is None or 'devices' in requested:
+            queryset = queryset.prefetch_related(
+                Prefetch('devices', queryset=Device.objects.order_by('id'))
+            )
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        bump_revision(self.request.user.id)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_revision(self.request.user.id)
+
+    def perform_destroy(self, instance):
+        # Xoá room -> xoá luôn device (CASCADE), báo cho WebSocket đang mở của room.
+        room_id = instance.pk
+        device_ids = list(instance.devices.values_list('id', flat=True))
+        instance.delete()
+        # Giống DeviceViewSet.perform_destroy: bỏ entry (kể cả change chưa flush) của các device đã xoá.
+        for device_id in device_ids:
+            device_state_cache.evict(device_id)
+        bump_revision(self.request.user.id)
+        if device_ids:
+            notify_room_devices_changed(room_id, removed=device_ids)
 
     # Ghi đè phương thức update để xử lý PUT như PATCH cho nhất quán
     def update(self, request, *args, **kwargs):
@@ -50,25 +144,44 @@ class RoomViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class DeviceViewSet(viewsets.ModelViewSet):
+class DeviceViewSet(ViewMetricsMixin, ConditionalCacheMixin, viewsets.ModelViewSet):
     """
     Chỉ trả devices thuộc những room của user đang login.
+    list/retrieve hỗ trợ ETag/Last-Modified (304) + cache response theo user.
     """
     serializer_class = DeviceSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
 
+    # select_related('room') -> IsOwner và Device.__str__ không phải query thêm room.
+    # Filter: ?room=<id>&device_type=<type>&is_on=true|false
     def get_queryset(self):
-        return Device.objects.filter(room__user=self.request.user)
+        queryset = Device.objects.filter(room__user=self.request.user).select_related('room').order_by('id')
+        if self.action != 'list':
+            return queryset
+
+        params = self.request.query_params
+        if 'room' in params:
+            try:
+                queryset = queryset.filter(room_id=int(params['room']))
+            except ValueError:
+                raise serializers.ValidationError({"room": "A valid integer is required."})
+        if 'device_type' in params:
+            queryset = queryset.filter(device_type=params['device_type'])
+        if 'is_on' in params:
+            is_on = params['is_on'].lower()
+            if is_on not in ('true', 'false'):
+                raise serializers.ValidationError({"is_on": "Must be 'true' or 'false'."})
+            queryset = queryset.filter(is_on=is_on == 'true')
+        return queryset
 
     def perform_create(self, serializer):
         """
         1. Lấy room từ body
         2. Tìm Room; nếu không thấy -> lỗi "Room not found"
         3. Check room.user == request.user, nếu không -> forbid.
-        4. Lấy device_type (default = binarySwitch)
-        5. Lấy attributes (default {})
-            - Nếu là dimmableLight và chưa có brightness -> set brightness = 100.
-        6. save.
+        4. device_type (default = binarySwitch) và attributes đã được DeviceSerializer kiểm tra
+           theo schema của loại device, key không gửi đã điền default (vd: brightness = 100).
+        5. save.
         """
         room_id = self.request.data.get('room')
         if not room_id:
@@ -76,16 +189,13 @@ class DeviceViewSet(viewsets.ModelViewSet):
             
         try:
             room = Room.objects.get(pk=room_id)
-            if room.user != self.request.user:
+            if room.user_id != self.request.user.id:
                 self.permission_denied(self.request, message="You do not have permission to add a device to this room.")
-            
-            device_type = self.request.data.get('device_type', Device.DeviceType.BINARY_SWITCH)
-            attributes = self.request.data.get('attributes', {})
-
-            if device_type == Device.DeviceType.DIMMABLE_LIGHT and 'brightness' not in attributes:
-                attributes['brightness'] = 100
 
-            serializer.save(device_type=device_type, attributes=attributes)
+            device = serializer.save()
+            record_state_events([device])
+            bump_revision(self.request.user.id)
+            notify_room_devices_changed(room.pk, added=[device.pk])
 
         except Room.DoesNotExist:
             raise serializers.ValidationError({"room": "Room not found."})
@@ -98,4 +208,437 @@ class DeviceViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    def get_expected_version(self):
+        # Client gửi kèm version đang thấy -> compare-and-set, device đã đổi -> 409.
+        version = self.request.data.get('version') if isinstance(self.request.data, dict) else None
+        if version is None:
+            return None
+        try:
+            return int(version)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError({"version": "A valid integer is required."})
+
+    def perform_update(self, serializer):
+        device = serializer.instance
+        old_room_id = device.room_id
+        data = dict(serializer.validated_data)
+        expected_version = self.get_expected_version()
+        retyped = data.get('device_type', device.device_type) != device.device_type
+
+        # WebSocket có thể còn change chưa flush (write-behind)
+        # -> lấy ra khỏi cache, merge cùng change của request trong 1 câu UPDATE trên DB,
+        # lịch sử chưa ghi của change đó ghi cùng transaction.
+        # Đổi qua REST cũng tăng version -> client WebSocket thấy nhảy cóc và resync.
+        pending, pending_events = device_state_cache.evict(device.pk)
+        if expected_version is not None and pending is not None:
+            # version client thấy đã gồm các lần đổi chưa flush.
+            expected_version -= pending['bumps']
+
+        change = combine_changes(pending, state_change(data))
+        if retyped:
+            change, data['attributes'] = retype_change(change, serializer.validated_data)
+
+        with transaction.atomic():
+            state = merge_state(device.pk, change, expected_version)
+            if state is None:
+                # Sai version: bỏ thay đổi của request, vẫn ghi change WebSocket đã lấy khỏi cache.
+                if pending is not None:
+                    merge_state(device.pk, pending)
+            elif data:
+                for field, value in data.items():
+                    setattr(device, field, value)
+                device.save(update_fields=list(data))
+                if retyped:
+                    state['attributes'] = data['attributes']
+                if 'device_type' in data:
+                    invalidate_scene_plans([device.pk])
+            DeviceStateEvent.objects.bulk_create(pending_events)
+
+        self.evict_after_write([device.pk])
+        if state is None:
+            version = Device.objects.filter(pk=device.pk).values_list('version', flat=True).first()
+            raise VersionConflict(version)
+
+        device.is_on, device.attributes, device.version = state['is_on'], state['attributes'], state['version']
+        if {'is_on', 'attributes'} & set(serializer.validated_data):
+            record_state_events([device])
+        bump_revision(self.request.user.id)
+
+        # Device chuyển sang room khác -> cập nhật device_rooms của consumer ở cả 2 room.
+        if device.room_id != old_room_id:
+            notify_room_devices_changed(old_room_id, removed=[device.pk])
+            notify_room_devices_changed(device.room_id, added=[device.pk])
+
+    @staticmethod
+    def evict_after_write(device_ids):
+        """
+        Consumer đọc DB song song (không qua thread dùng chung) -> có thể đã load lại bản cũ
+        giữa lúc evict và lúc ghi -> bỏ lần nữa sau khi ghi.
+        Change / lịch sử socket kịp áp dụng lên entry load lại đó vẫn được ghi (merge trên DB).
+        """
+        changes, events = {}, []
+        for device_id in device_ids:
+            change, device_events = device_state_cache.evict(device_id)
+            if change is not None:
+                changes[device_id] = change
+            events.extend(device_events)
+        if changes or events:
+            with transaction.atomic():
+                merge_states(changes)
+                DeviceStateEvent.objects.bulk_create(events)
+
+    def perform_destroy(self, instance):
+        device_id, room_id = instance.pk, instance.room_id
+        instance.delete()
+        device_state_cache.evict(device_id)
+        bump_revision(self.request.user.id)
+        notify_room_devices_changed(room_id, removed=[device_id])
+
+    # --- Bulk: /api/devices/bulk/ ---
+    """
+    - POST   /api/devices/bulk/  [{room, name, icon_asset, device_type, attributes, ...}, ...]
+    - PATCH  /api/devices/bulk/  [{id, <field cần sửa>...}, ...]
+    - DELETE /api/devices/bulk/  {"ids": [1, 2, 3]}
+    Cả batch được check với room của user bằng 1 query, ghi bằng bulk_create/bulk_update/1 câu DELETE.
+    Có item lỗi -> không ghi gì, trả 400 với {"errors": [...]} đúng thứ tự item gửi lên ({} = item hợp lệ).
+    """
+    def get_bulk_items(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise serializers.ValidationError({"detail": "Expected a non-empty list of items."})
+        if len(items) > BULK_MAX_ITEMS:
+            raise serializers.ValidationError({"detail": f"At most {BULK_MAX_ITEMS} items per request."})
+        return items
+
+    def get_bulk_context(self):
+        return {
+            **self.get_serializer_context(),
+            'room_ids': set(Room.objects.filter(user=self.request.user).values_list('id', flat=True)),
+        }
+
+    @staticmethod
+    def bulk_error_response(errors):
+        return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        items = self.get_bulk_items(request)
+        context = self.get_bulk_context()
+
+        item_serializers = [DeviceBulkSerializer(data=item, context=context) for item in items]
+        errors = [{} if serializer.is_valid() else serializer.errors for serializer in item_serializers]
+        if any(errors):
+            return self.bulk_error_response(errors)
+
+        devices = []
+        for serializer in item_serializers:
+            data = dict(serializer.validated_data)
+            data.pop('id', None)
+            room_id = data.pop('room')
+            devices.append(Device(room_id=room_id, **data))
+
+        with transaction.atomic():
+            devices = Device.objects.bulk_create(devices)
+            record_state_events(devices)
+
+        bump_revision(request.user.id)
+        added = defaultdict(list)
+        for device in devices:
+            added[device.room_id].append(device.pk)
+        for room_id, device_ids in added.items():
+            notify_room_devices_changed(room_id, added=device_ids)
+
+        return Response(DeviceSerializer(devices, many=True).data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request):
+        items = self.get_bulk_items(request)
+        context = self.get_bulk_context()
+
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        devices = self.get_queryset().in_bulk([i for i in ids if is_device_id(i)])
+
+        item_serializers, errors = [], []
+        for item, device_id in zip(items, ids):
+            if not is_device_id(device_id):
+                item_serializers.append(None)
+                errors.append({"id": ["A valid integer is required."]})
+                continue
+            device = devices.get(device_id)
+            if device is None:
+                item_serializers.append(None)
+                errors.append({"id": ["Device not found."]})
+                continue
+            serializer = DeviceBulkSerializer(device, data=item, partial=True, context=context)
+            item_serializers.append(serializer)
+            errors.append({} if serializer.is_valid() else serializer.errors)
+        if any(errors):
+            return self.bulk_error_response(errors)
+
+        moved = []
+        fields = set()
+        retyped = []
+        changes, pending_events = {}, []
+        with transaction.atomic():
+            for serializer in item_serializers:
+                device = serializer.instance
+                old_room_id = device.room_id
+
+                # Giống perform_update(): change WebSocket chưa flush + change của item -> merge trên DB.
+                data = dict(serializer.validated_data)
+                data.pop('id', None)
+                pending, device_events = device_state_cache.evict(device.pk)
+                changes[device.pk] = combine_changes(pending, state_change(data))
+                pending_events.extend(device_events)
+                if data.get('device_type', device.device_type) != device.device_type:
+                    changes[device.pk], device.attributes = retype_change(changes[device.pk], serializer.validated_data)
+                    retyped.append(device)
+                if 'room' in data:
+                    device.room_id = data.pop('room')
+                    fields.add('room')
+                for field, value in data.items():
+                    setattr(device, field, value)
+                fields.update(data)
+
+                if device.room_id != old_room_id:
+                    moved.append((device.pk, old_room_id, device.room_id))
+
+            updated = [serializer.instance for serializer in item_serializers]
+            if fields:
+                Device.objects.bulk_update(updated, sorted(fields))
+            if retyped:
+                # Chỉ ghi đè attributes của device đổi loại, device khác merge qua merge_states.
+                Device.objects.bulk_update(retyped, ['attributes'])
+            if 'device_type' in fields:
+                invalidate_scene_plans(
+                    serializer.instance.pk for serializer in item_serializers
+                    if 'device_type' in serializer.validated_data
+                )
+            states = merge_states(changes)
+            for device in updated:
+                state = states[device.pk]
+                device.is_on, device.attributes, device.version = state['is_on'], state['attributes'], state['version']
+            DeviceStateEvent.objects.bulk_create(pending_events)
+            record_state_events([
+                serializer.instance for serializer in item_serializers
+                if {'is_on', 'attributes'} & set(serializer.validated_data)
+            ])
+
+        # Như perform_update: bỏ entry có thể đã được load lại từ bản cũ trong lúc ghi.
+        self.evict_after_write([device.pk for device in updated])
+
+        bump_revision(request.user.id)
+        for device_id, old_room_id, new_room_id in moved:
+            notify_room_devices_changed(old_room_id, removed=[device_id])
+            notify_room_devices_changed(new_room_id, added=[device_id])
+
+        return Response(DeviceSerializer(updated, many=True).data)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not ids:
+            raise serializers.ValidationError({"ids": "Expected a non-empty list of device ids."})
+        if len(ids) > BULK_MAX_ITEMS:
+            raise serializers.ValidationError({"ids": f"At most {BULK_MAX_ITEMS} items per request."})
+
+        rooms = dict(
+            self.get_queryset()
+            .filter(pk__in=[i for i in ids if is_device_id(i)])
+            .values_list('id', 'room_id')
+        )
+        errors = [
+            {"id": ["A valid integer is required."]} if not is_device_id(device_id)
+            else {} if device_id in rooms else {"id": ["Device not found."]}
+            for device_id in ids
+        ]
+        if any(errors):
+            return self.bulk_error_response(errors)
+
+        with transaction.atomic():
+            Device.objects.filter(pk__in=list(rooms)).delete()
+
+        removed = defaultdict(list)
+        for device_id, room_id in rooms.items():
+            device_state_cache.evict(device_id)
+            removed[room_id].append(device_id)
+
+        bump_revision(request.user.id)
+        for room_id, device_ids in removed.items():
+            notify_room_devices_changed(room_id, removed=device_ids)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # --- Thống kê sử dụng: /api/devices/usage/ ---
+    @action(detail=False, methods=['get'], url_path='usage')
+    def usage(self, request):
+        """
+        On-hours + brightness trung bình của từng device, đọc từ bucket đã compact.
+            - ?days=30 (mặc định) hoặc ?start=<ISO datetime>&end=<ISO datetime>
+            - ?room=<id> để chỉ lấy device của 1 room
+        """
+        params = request.query_params
+        try:
+            # parse_datetime: None nếu sai format, ValueError nếu đúng format nhưng sai giá trị (tháng 13,...).
+            end = parse_datetime(params['end']) if 'end' in params else timezone.now()
+            start = parse_datetime(params['start']) if 'start' in params else None
+        except ValueError:
+            end = start = None
+        if 'start' not in params:
+            try:
+                days = int(params.get('days', 30))
+            except ValueError:
+                raise serializers.ValidationError({"days": "A valid integer is required."})
+            start = end - timedelta(days=max(1, min(days, 366))) if end else None
+        if start is None or end is None:
+            raise serializers.ValidationError({"detail": "start/end must be ISO 8601 datetimes."})
+
+        devices = self.get_queryset()
+        if 'room' in params:
+            try:
+                devices = devices.filter(room_id=int(params['room']))
+            except ValueError:
+                raise serializers.ValidationError({"room": "A valid integer is required."})
+
+        return Response({
+            'start': start,
+            'end': end,
+            'devices': usage_summary(devices.values('id'), start, end),
+        })
+
+
+class ScheduleViewSet(ViewMetricsMixin, viewsets.ModelViewSet):
+    """
+    /api/schedules/ (list, create), /api/schedules/<id>/ (retrieve, update, delete).
+    Mỗi lần lưu -> tính lại next_run_at, báo worker run_scheduler sửa heap (không quét bảng).
+    """
+    serializer_class = ScheduleSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Schedule.objects.filter(user=self.request.user).prefetch_related(
+            Prefetch('devices', queryset=Device.objects.only('id'))
+        ).order_by('id')
+
+    def save_schedule(self, serializer, **kwargs):
+        with transaction.atomic():
+            schedule = serializer.save(**kwargs)
+            schedule.next_run_at = compute_next_run(schedule, timezone.now())
+            schedule.save(update_fields=['next_run_at'])
+            notify_schedule_changed(schedule.pk, schedule.next_run_at)
+
+    def perform_create(self, serializer):
+        self.save_schedule(serializer, user=self.request.user)
+
+    def perform_update(self, serializer):
+        self.save_schedule(serializer)
+
+    def update(self, request, *args, **kwargs):
+        # PUT xử lý như PATCH, giống RoomViewSet / DeviceViewSet.
+        kwargs['partial'] = True
+        return super().update(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        schedule_id = instance.pk
+        instance.delete()
+        notify_schedule_changed(schedule_id, None)
+
+
+class SceneViewSet(ViewMetricsMixin, viewsets.ModelViewSet):
+    """
+    /api/scenes/ (list, create), /api/scenes/<id>/ (retrieve, update, delete),
+    POST /api/scenes/<id>/apply/ -> áp dụng scene trong 1 request (devices/scenes.py):
+    plan lấy từ cache, 1 câu UPDATE cho mọi device, 1 broadcast cho mỗi room.
+    """
+    serializer_class = SceneSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Scene.objects.filter(user=self.request.user).prefetch_related('targets').order_by('id')
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def update(self, request, *args, **kwargs):
+        # PUT xử lý như PATCH, giống các ViewSet khác.
+        kwargs['partial'] = True
+        return super().update(request, *args, **kwargs)
+
+    @action(detail=True, methods=['post'])
+    def apply(self, request, pk=None):
+        # Không cần targets (plan nằm trong cache) -> không prefetch.
+        scene = get_object_or_404(Scene.objects.only('id', 'user_id', 'revision'), user=request.user, pk=pk)
+
+        states = apply_scene(scene)
+        if states:
+            async_to_sync(publish_device_states)(get_channel_layer(), states, persisted=True)
+        return Response({
+            'devices': [
+                {key: state[key] for key in ('device_id', 'is_on', 'attributes', 'version')}
+                for state in states
+            ],
+        })
+
+
+class GatewayViewSet(
+    ViewMetricsMixin,
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Gateway của user (đăng nhập bằng JWT như app):
+        - POST /api/gateways/ {name} -> trả về key, chỉ 1 lần duy nhất.
+        - GET /api/gateways/, DELETE /api/gateways/<id>/ (thu hồi key).
+    """
+    serializer_class = GatewaySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Gateway.objects.filter(user=self.request.user).order_by('id')
+
+    def perform_create(self, serializer):
+        gateway = Gateway(user=self.request.user, name=serializer.validated_data['name'])
+        gateway.key = gateway.set_new_key()
+        gateway.save()
+        serializer.instance = gateway
+
+
+class GatewayReportView(ViewMetricsMixin, APIView):
+    """
+    POST /api/gateway/reports/  (Authorization: Gateway <key>)
+    {"reports": [[device_id, is_on, {attributes}], ...]}
+    -> {"changed": số device đổi state, "unknown": [device_id không thuộc nhà của chủ gateway],
+        "rejected": {device_id: {key: lỗi}} report sai schema của loại device}
+    Giá trị không đổi bị bỏ, phần đổi ghi 1 lần, broadcast 1 event cho mỗi room.
+    """
+    authentication_classes = [GatewayAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        try:
+            reports = parse_reports(request.data)
+        except ValueError as e:
+            raise serializers.ValidationError({"reports": str(e)})
+
+        states, unknown, rejected = ingest_reports(request.auth, reports)
+        if states:
+            async_to_sync(publish_device_states)(get_channel_layer(), states, persisted=True)
+        return Response({'changed': len(states), 'unknown': unknown, 'rejected': rejected})
+
+
+class WireSchemaView(APIView):
+    """
+    GET /api/ws-schema/ : bảng key số nguyên của subprotocol WebSocket msgpack.v1 (devices/wire.py),
+    client / firmware lấy 1 lần rồi cache, bảng chỉ thêm key chứ không đổi số cũ.
+    """
+    def get(self, request):
+        return Response(wire_schema())
@@ -0,0 +1,167 @@
+# devices/wire.py
+import msgpack
+
+from .models import Device
+
+# Subprotocol WebSocket (header Sec-WebSocket-Protocol) client chọn lúc connect:
+#     - không gửi    -> client cũ (app Flutter đã phát hành): frame text JSON, mỗi frame đúng 1 device,
+#                       không có snapshot lúc connect, broadcast batch được tách thành từng frame.
+#     - 'json.v1'    -> frame text JSON, có snapshot lúc connect và frame batch.
+#     - 'msgpack.v1' -> như json.v1 nhưng frame binary MessagePack, key là số nguyên theo bảng dưới.
+# Cùng nội dung frame, chỉ khác cách encode: consumer xử lý dict như nhau cho cả 2 loại.
+JSON_SUBPROTOCOL = 'json.v1'
+MSGPACK_SUBPROTOCOL = 'msgpack.v1'
+
+# Chỉ được THÊM key mới, không đổi / dùng lại số đã cấp (client và firmware cũ vẫn decode được).
+FIELD_IDS = {
+    'type': 0,
+    'device_id': 1,
+    'room_id': 2,
+    'is_on': 3,
+    'attributes': 4,
+    'version': 5,
+    'devices': 6,
+    'updates': 7,
+    'device_ids': 8,
+    'room_ids': 9,
+    'error': 10,
+    'retry_after': 11,
+    'seq': 12,
+    'reports': 13,
+    'changed': 14,
+    'unknown': 15,
+    'errors': 16,
+    'rejected': 17,
+}
+
+TYPE_IDS = {
+    'snapshot': 0,
+    'resync': 1,
+    'batch': 2,
+    'subscribe': 3,
+    'unsubscribe': 4,
+    'ack': 5,
+    'error': 6,
+}
+
+# Key của attributes theo loại device. Cùng 1 key ở mọi loại phải cùng số, số không trùng giữa các key
+# -> decode không cần biết loại device. Key chưa có trong bảng vẫn gửi được dưới dạng chuỗi.
+ATTRIBUTE_KEYS = {
+    Device.DeviceType.BINARY_SWITCH: {'is_on': 0},
+    Device.DeviceType.DIMMABLE_LIGHT: {'is_on': 0, 'brightness': 1},
+}
+
+
+def _invert(mapping):
+    inverted = {}
+    for name, number in mapping.items():
+        if inverted.setdefault(number, name) != name:
+            raise ValueError(f'Wire id {number} is used by both {inverted[number]!r} and {name!r}.')
+    return inverted
+
+
+def _attribute_ids():
+    ids = {}
+    for keys in ATTRIBUTE_KEYS.values():
+        for name, number in keys.items():
+            if ids.setdefault(name, number) != number:
+                raise ValueError(f'Attribute {name!r} has different wire ids across device types.')
+    return ids
+
+
+ATTRIBUTE_IDS = _attribute_ids()
+FIELD_NAMES = _invert(FIELD_IDS)
+TYPE_NAMES = _invert(TYPE_IDS)
+ATTRIBUTE_NAMES = _invert(ATTRIBUTE_IDS)
+
+
+def schema():
+    # Bảng key cho client (GET /api/ws-schema/).
+    return {
+        'subprotocol': MSGPACK_SUBPROTOCOL,
+        'fields': FIELD_IDS,
+        'types': TYPE_IDS,
+        'attributes': {device_type: keys for device_type, keys in ATTRIBUTE_KEYS.items()},
+    }
+
+
+def choose_subprotocol(offered):
+    # Danh sách subprotocol client gửi -> subprotocol server chấp nhận (None = JSON mặc định, không gửi header).
+    for name in offered or ():
+        if name in (MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL):
+            return name
+    return None
+
+
+# --- dict (key chuỗi) <-> map key số ---
+def _pack_attributes(attributes):
+    return {ATTRIBUTE_IDS.get(key, key): value for key, value in attributes.items()}
+
+
+def _pack(frame):
+    packed = {}
+    for key, value in frame.items():
+        if key == 'type':
+            value = TYPE_IDS.get(value, value)
+        elif key == 'attributes' and isinstance(value, dict):
+            value = _pack_attributes(value)
+        elif key in ('devices', 'updates') and isinstance(value, list):
+            value = [_pack(item) if isinstance(item, dict) else item for item in value]
+        elif key == 'reports' and isinstance(value, list):
+            value = [
+                [*report[:2], _pack_attributes(report[2])]
+                if isinstance(report, list) and len(report) == 3 and isinstance(report[2], dict) else report
+                for report in value
+            ]
+        packed[FIELD_IDS.get(key, key)] = value
+    return packed
+
+
+def _name(names, key):
+    # Key số -> tên, key chuỗi giữ nguyên. Số chưa cấp / kiểu khác -> frame sai format.
+    if isinstance(key, str):
+        return key
+    if isinstance(key, int) and not isinstance(key, bool) and key in names:
+        return names[key]
+    raise ValueError(f'Unknown wire key {key!r}.')
+
+
+def _unpack_attributes(attributes):
+    return {_name(ATTRIBUTE_NAMES, key): value for key, value in attributes.items()}
+
+
+def _unpack(frame):
+    unpacked = {}
+    for key, value in frame.items():
+        key = _name(FIELD_NAMES, key)
+        if key == 'type' and isinstance(value, int) and not isinstance(value, bool):
+            value = _name(TYPE_NAMES, value)
+        elif key == 'attributes' and isinstance(value, dict):
+            value = _unpack_attributes(value)
+        elif key in ('devices', 'updates') and isinstance(value, list):
+            value = [_unpack(item) if isinstance(item, dict) else item for item in value]
+        elif key == 'reports' and isinstance(value, list):
+            value = [
+                [*report[:2], _unpack_attributes(report[2])]
+                if isinstance(report, list) and len(report) == 3 and isinstance(report[2], dict) else report
+                for report in value
+            ]
+        unpacked[key] = value
+    return unpacked
+
+
+def encode_binary(frame):
+    # dict frame (như encode_frame của realtime.py) -> bytes MessagePack.
+    return msgpack.packb(_pack(frame), use_bin_type=True)
+
+
+def decode_binary(data):
+    """
+    bytes MessagePack -> dict frame key chuỗi (cùng dạng json.loads của frame text).
+    Raise ValueError nếu không decode được / key số chưa cấp.
+    """
+    try:
+        frame = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except (msgpack.UnpackException, ValueError, TypeError) as e:
+        raise ValueError(f'Invalid MessagePack frame: {e}') from e
+    return _unpack(frame) if isinstance(frame, dict) else frame
@@ -0,0 +1,203 @@
+# home_electronics_backend/channel_layers.py
+
+# Channel layer cho chế độ scale ngang (settings CHANNEL_LAYER_MODE=sharded):
+#   - Group (room_<id>, schedules,...) chia lên nhiều Redis theo consistent hashing (HashRing):
+#     thêm / bớt 1 Redis chỉ chuyển ~1/N group sang shard khác.
+#   - Redis pub/sub, subscribe theo (worker, group) chứ không theo socket: 1 worker có 500 socket
+#     trong room_1 -> 1 subscription, 1 message Redis cho mỗi group_send, worker tự chia cho các socket
+#     (deserialize 1 lần).
+#   - Channel riêng của socket chỉ nằm trong bộ nhớ worker ("<prefix>specific.<worker>!<id>"),
+#     không tạo key / subscription Redis. send() tới channel của worker khác đi qua inbox của worker đó.
+#   - Không có group_expiry: worker chết -> Redis tự bỏ subscription, không còn member "ma" trong group.
+# Giống RedisPubSubChannelLayer: message không được lưu, worker không subscribe lúc publish thì không nhận.
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer, RedisSingleShardConnection
+from channels_redis.utils import _wrap_close, decode_hosts
+
+from .metrics import CHANNEL_LAYER_DROPPED
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """
+    Consistent hashing: mỗi shard có `replicas` điểm trên vòng (md5 của "<shard>:<i>"),
+    key thuộc shard của điểm đầu tiên >= hash(key). Điểm của shard tính từ địa chỉ shard,
+    không theo thứ tự trong list -> đổi thứ tự / thêm shard không xáo lại các group còn lại.
+    """
+    def __init__(self, nodes, replicas=128):
+        if not nodes:
+            raise ValueError('HashRing needs at least one node.')
+        points = sorted(
+            (self._hash(f'{node}:{i}'), index)
+            for index, node in enumerate(nodes)
+            for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [index for _, index in points]
+        self._cache = {}
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def get(self, key):
+        # key -> index của shard. Tên group lặp lại liên tục -> nhớ kết quả.
+        index = self._cache.get(key)
+        if index is None:
+            position = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+            index = self._cache[key] = self._nodes[position]
+        return index
+
+
+def shard_name(host):
+    # Tên ổn định của 1 Redis (sau decode_hosts) để đặt điểm trên vòng.
+    if 'address' in host:
+        return host['address']
+    if 'master_name' in host:
+        return f"sentinel:{host['master_name']}"
+    return f"{host.get('host')}:{host.get('port')}"
+
+
+class ShardConnection(RedisSingleShardConnection):
+    # Kết nối pub/sub tới 1 Redis, message nhận được chuyển cho ShardedLoopLayer.dispatch.
+    def _receive_message(self, message):
+        if message is not None:
+            name = message['channel']
+            if isinstance(name, bytes):
+                name = name.decode()
+            self.channel_layer.dispatch(name, message['data'])
+
+
+class ShardedChannelLayer(RedisPubSubChannelLayer):
+    """
+    CHANNEL_LAYERS backend. CONFIG: hosts (nhiều Redis), prefix, capacity (số message tối đa
+    chờ trong queue của 1 channel, đầy -> bỏ message mới của channel đó), replicas (điểm / shard trên vòng).
+    1 ShardedLoopLayer cho mỗi event loop (giống RedisPubSubChannelLayer).
+    """
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = ShardedLoopLayer(*self._args, **self._kwargs, channel_layer=self)
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
+
+
+class ShardedLoopLayer(RedisPubSubLoopLayer):
+    def __init__(self, hosts=None, prefix='asgi', capacity=1000, replicas=128, **kwargs):
+        super().__init__(hosts=hosts, prefix=prefix, **kwargs)
+        hosts = decode_hosts(hosts)
+        self._shards = [ShardConnection(host, self) for host in hosts]
+        self._ring = HashRing([shard_name(host) for host in hosts], replicas)
+        self.capacity = capacity
+        # Channel riêng của worker này: <prefix>specific.<worker>!<id>, message từ worker khác qua inbox.
+        self.worker = uuid.uuid4().hex
+        self.inbox = f'{self.prefix}__worker__{self.worker}'
+        self._inbox_ready = False
+
+    def _get_shard(self, channel_or_group_name):
+        return self._shards[self._ring.get(channel_or_group_name)]
+
+    def _inbox_of(self, channel):
+        # Channel riêng của worker khác -> inbox của worker đó, None nếu là channel có tên (không có '!').
+        if '!' not in channel:
+            return None
+        worker = channel.rsplit('!', 1)[0][-32:]
+        return f'{self.prefix}__worker__{worker}'
+
+    async def _ensure_inbox(self):
+        if not self._inbox_ready:
+            await self._get_shard(self.inbox).subscribe(self.inbox)
+            self._inbox_ready = True
+
+    async def _subscribe_to_channel(self, channel):
+        # Channel có tên (không phải new_channel) -> subscribe trên Redis như RedisPubSubLoopLayer.
+        self.channels[channel] = asyncio.Queue(self.capacity)
+        await self._get_shard(channel).subscribe(channel)
+
+    # --- Nhận message từ Redis ---
+    def dispatch(self, name, data):
+        # Gọi từ ShardConnection: deserialize 1 lần rồi chia cho các channel trong worker.
+        if name == self.inbox:
+            envelope = self.channel_layer.deserialize(data)
+            self.deliver(envelope['channel'], envelope['message'])
+        elif name in self.groups:
+            message = self.channel_layer.deserialize(data)
+            for channel in list(self.groups[name]):
+                self.deliver(channel, message)
+        elif name in self.channels:
+            self.deliver(name, self.channel_layer.deserialize(data))
+
+    def deliver(self, channel, message):
+        queue = self.channels.get(channel)
+        if queue is None:
+            return False
+        try:
+            # Bản sao nông: consumer sửa key của message không ảnh hưởng socket khác.
+            queue.put_nowait(dict(message))
+        except asyncio.QueueFull:
+            CHANNEL_LAYER_DROPPED.inc()
+            logger.warning('Channel %s is full, message dropped', channel)
+            return False
+        return True
+
+    # --- Channel layer API ---
+    async def new_channel(self, prefix='specific.'):
+        await self._ensure_inbox()
+        channel = f'{self.prefix}{prefix}{self.worker}!{uuid.uuid4().hex}'
+        self.channels[channel] = asyncio.Queue(self.capacity)
+        return channel
+
+    async def send(self, channel, message):
+        if channel in self.channels and '!' in channel:
+            if not self.deliver(channel, message):
+                raise ChannelFull(channel)
+            return
+        inbox = self._inbox_of(channel)
+        if inbox is None:
+            await super().send(channel, message)
+            return
+        await self._get_shard(inbox).publish(
+            inbox, self.channel_layer.serialize({'channel': channel, 'message': message})
+        )
+
+    async def receive(self, channel):
+        if channel not in self.channels:
+            if '!' in channel:
+                raise RuntimeError(f'Channel {channel} does not belong to this worker.')
+            await self._subscribe_to_channel(channel)
+
+        try:
+            return await self.channels[channel].get()
+        except (asyncio.CancelledError, asyncio.TimeoutError, GeneratorExit):
+            # Consumer thoát (giống RedisPubSubLoopLayer): bỏ channel, rời các group còn lại.
+            await self._drop_channel(channel)
+            raise
+
+    async def _drop_channel(self, channel):
+        self.channels.pop(channel, None)
+        try:
+            for group_channel, members in list(self.groups.items()):
+                if channel in members:
+                    members.discard(channel)
+                    if not members:
+                        del self.groups[group_channel]
+                        await self._get_shard(group_channel).unsubscribe(group_channel)
+            if '!' not in channel:
+                await self._get_shard(channel).unsubscribe(channel)
+        except BaseException:
+            logger.exception('Unexpected exception while cleaning-up channel:')
+
+    async def flush(self):
+        await super().flush()
+        self._inbox_ready = False
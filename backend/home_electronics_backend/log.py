@@ -0,0 +1,129 @@
+# home_electronics_backend/log.py
+
+# Logging có cấu trúc cho đường nóng (WebSocket consumer,...):
+#   - log_event(): 1 event = tên cố định + field rời, không format chuỗi ở phía gọi.
+#   - QueueListenerHandler: phía gọi chỉ put vào queue, format JSON + ghi stdout ở thread riêng
+#     -> event loop không bị chặn khi stdout chậm.
+#   - SamplingFilter: sample + giới hạn số event/giây theo từng loại event.
+
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+def log_event(logger, level, event, **fields):
+    """
+    logger.log() với msg = tên event, field đi kèm trong record.fields.
+    Level bị tắt -> trả về luôn, không tạo LogRecord.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'event': event, 'fields': fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    1 dòng JSON / record: {"ts", "level", "logger", "event", ...fields}.
+    Record không đi qua log_event() (Django, thư viện,...) -> event = message đã format.
+    """
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', None) or record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        dropped = getattr(record, 'dropped', 0)
+        if dropped:
+            data['dropped'] = dropped
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Handler cho dictConfig: phía gọi chỉ put record vào queue,
+    QueueListener (thread riêng) format + ghi ra handler thật (mặc định stdout, JsonFormatter).
+    Queue đầy (stdout bị nghẽn) -> bỏ record thay vì chặn event loop.
+    """
+    def __init__(self, maxsize=10000, stream=None):
+        super().__init__(queue.Queue(maxsize))
+        target = logging.StreamHandler(stream)
+        target.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, target, respect_handler_level=False)
+        self.listener.start()
+        self._stopped = False
+        atexit.register(self.stop)
+
+    def prepare(self, record):
+        # Bản gốc format msg ngay ở thread gọi -> bỏ, để thread listener format.
+        # Chỉ format sẵn traceback (exc_info không đi qua thread được an toàn).
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def stop(self):
+        # Ghi nốt record còn trong queue rồi dừng thread (gọi nhiều lần không sao).
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def close(self):
+        self.stop()
+        super().close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Filter theo tên event (record.event, đặt bởi log_event()):
+        - sample_rates: {'ws.receive': 0.01} -> giữ ~1% event loại đó.
+        - rate_limits: {'ws.receive': 50} -> tối đa 50 event/giây, phần vượt bị bỏ;
+          số event bị bỏ được ghi vào field 'dropped' của event kế tiếp được giữ.
+    Event không có trong config -> luôn giữ. WARNING trở lên luôn giữ.
+    """
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self._windows = {}   # event -> [giây hiện tại, số event đã giữ, số event đã bỏ]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+
+        rate = self.sample_rates.get(event)
+        if rate is not None and random.random() >= rate:
+            return False
+
+        limit = self.rate_limits.get(event)
+        if limit is None:
+            return True
+
+        second = int(time.monotonic())
+        with self._lock:
+            window = self._windows.setdefault(event, [second, 0, 0])
+            if window[0] != second:
+                window[0], window[1] = second, 0
+            if window[1] >= limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            record.dropped, window[2] = window[2], 0
+        return True
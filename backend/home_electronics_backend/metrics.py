@@ -0,0 +1,269 @@
+# home_electronics_backend/metrics.py
+
+# Metrics kiểu Prometheus (counter / gauge / histogram), không cần thư viện ngoài:
+#   - Ghi metric = cộng số trong bộ nhớ (1 lock / label set), không I/O.
+#   - Chỉ khi Prometheus gọi GET /metrics mới dựng text -> không ai scrape thì gần như không tốn gì.
+#   - Metric của từng process (mỗi worker daphne 1 bộ), Prometheus tự cộng theo instance.
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULTS = {
+    # Có giá trị -> /metrics yêu cầu header "Authorization: Bearer <TOKEN>".
+    'TOKEN': None,
+}
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REGISTRY = []
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """
+        Child của 1 label set (tạo lần đầu, các lần sau chỉ tra dict).
+        Code nóng nên giữ lại child thay vì gọi labels() mỗi lần.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self.child_class())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+    # Metric không có label -> gọi thẳng inc()/observe() trên metric.
+    def __getattr__(self, attr):
+        if attr.startswith('_') or self.__dict__.get('labelnames', True):
+            raise AttributeError(attr)
+        return getattr(self.labels(), attr)
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f'{name}{format_labels(labelnames, values)} {self.value}']
+
+
+class GaugeChild(CounterChild):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class HistogramChild:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # phần tử cuối = +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labelnames, values, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labelnames, values)} {total}')
+        lines.append(f'{name}_count{format_labels(labelnames, values)} {cumulative}')
+        return lines
+
+
+class Timer:
+    """
+    with histogram.time(): ...  -> observe số giây chạy trong khối with.
+    """
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Counter(Metric):
+    kind = 'counter'
+    child_class = CounterChild
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    child_class = GaugeChild
+
+    def track(self, *values):
+        # inc() series của label set, trong lock của metric -> không chen với untrack() đang bỏ series đó.
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            self._children.setdefault(key, self.child_class()).inc()
+
+    def untrack(self, *values):
+        """
+        dec() series của label set, về 0 thì bỏ luôn series.
+        Cho label theo id (room,...): chỉ giữ series còn > 0 -> số series không tăng theo mọi id từng xuất hiện.
+        """
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                return
+            child.dec()
+            if child.value <= 0:
+                del self._children[key]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.child_class = functools.partial(HistogramChild, tuple(buckets))
+
+
+# --- Metric của app ---
+# Series của room bị bỏ khi socket cuối cùng của room đóng (track / untrack).
+WS_CONNECTIONS = Gauge('ws_connections', 'WebSocket dang mo theo room.', ['room'])
+WS_CONNECTS = Counter('ws_connects_total', 'So lan WebSocket connect theo ket qua.', ['result'])
+WS_MESSAGES = Counter('ws_messages_total', 'Message WebSocket nhan duoc theo loai.', ['type'])
+WS_RECEIVE_TO_BROADCAST = Histogram(
+    'ws_receive_to_broadcast_seconds', 'Tu luc nhan message toi luc group_send xong.', ['type']
+)
+WS_AUTH = Histogram('ws_auth_seconds', 'Thoi gian TokenAuthMiddleware dung user.', ['result'])
+GROUP_SEND = Histogram('channel_layer_group_send_seconds', 'Thoi gian group_send toi channel layer.')
+CHANNEL_LAYER_DROPPED = Counter('channel_layer_dropped_total', 'Message bi bo vi queue cua channel day (layer sharded).')
+SYNC_TO_ASYNC_WAIT = Histogram(
+    'sync_to_async_wait_seconds', 'Thoi gian cho thread sync truoc khi ham bat dau chay.', ['func']
+)
+SYNC_TO_ASYNC_RUN = Histogram('sync_to_async_run_seconds', 'Thoi gian chay ham sync (chu yeu la DB).', ['func'])
+HTTP_REQUEST = Histogram('http_request_seconds', 'Thoi gian xu ly request REST theo viewset/action.', ['view', 'action'])
+HTTP_RESPONSES = Counter('http_responses_total', 'Response REST theo viewset/action/status.', ['view', 'action', 'status'])
+
+
+def timed_sync_to_async(name, thread_sensitive=True):
+    """
+    Như @sync_to_async, có đo thêm:
+        - sync_to_async_wait_seconds: từ lúc await tới lúc hàm bắt đầu chạy trên thread sync
+          (thread_sensitive -> dùng chung 1 thread với REST view, hàng đợi dài thì số này tăng).
+        - sync_to_async_run_seconds: thời gian chạy hàm (DB).
+    thread_sensitive=False: chạy trên thread pool, các lời gọi chạy song song với nhau và với REST.
+    Chỉ dùng cho hàm chỉ đọc DB. Mỗi thread có connection riêng -> đóng connection hỏng/hết hạn
+    trước và sau mỗi lần chạy (giống database_sync_to_async của Channels).
+    """
+    wait = SYNC_TO_ASYNC_WAIT.labels(name)
+    run_time = SYNC_TO_ASYNC_RUN.labels(name)
+
+    def decorator(func):
+        def run(queued_at, *args, **kwargs):
+            started = time.perf_counter()
+            wait.observe(started - queued_at)
+            if not thread_sensitive:
+                close_old_connections()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if not thread_sensitive:
+                    close_old_connections()
+                run_time.observe(time.perf_counter() - started)
+
+        run_async = sync_to_async(run, thread_sensitive=thread_sensitive)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_async(time.perf_counter(), *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ViewMetricsMixin:
+    """
+    Đo thời gian + đếm status của mọi action trong viewset (list, retrieve, bulk_update,...).
+    Đặt trước các mixin khác để đo cả phần cache/304.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        view = type(self).__name__
+        action = getattr(self, 'action', None) or request.method.lower()
+        HTTP_REQUEST.labels(view, action).observe(time.perf_counter() - start)
+        HTTP_RESPONSES.labels(view, action, response.status_code).inc()
+        return response
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = get_config()['TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,7 +1,7 @@
 # home_electronics_backend/routing.py
 
 from django.urls import path
-from devices.consumers import DeviceConsumer
+from devices.consumers import DeviceConsumer, GatewayConsumer, UserDeviceConsumer
 
 websocket_urlpatterns = [
     # Ở đây bạn định nghĩa path WebSocket hoàn chỉnh luôn.
@@ -9,4 +9,8 @@ websocket_urlpatterns = [
         # 1. Match path -> gán room_id vào scope["url_route"]["kwargs"]
         # 2. Tạo instance Consumer tương ứng.
     path("ws/devices/<int:room_id>/", DeviceConsumer.as_asgi()),
+    # 1 socket cho mọi room của user, join/rời room bằng message subscribe/unsubscribe.
+    path("ws/devices/", UserDeviceConsumer.as_asgi()),
+    # Gateway vật lý báo state theo lô (xác thực bằng key của gateway, không dùng JWT).
+    path("ws/gateway/", GatewayConsumer.as_asgi()),
 ]
@@ -72,6 +72,107 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Scale ngang: CHANNEL_LAYER_MODE=sharded, REDIS_SHARDS=redis://redis-1:6379,redis://redis-2:6379
+# -> group chia lên các Redis theo consistent hashing, mỗi worker nhận 1 message / group_send
+#    rồi tự chia cho các socket của nó (home_electronics_backend/channel_layers.py).
+if os.getenv('CHANNEL_LAYER_MODE') == 'sharded':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'home_electronics_backend.channel_layers.ShardedChannelLayer',
+            'CONFIG': {
+                'hosts': [
+                    url.strip()
+                    for url in os.getenv('REDIS_SHARDS', f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}").split(',')
+                    if url.strip()
+                ],
+                'capacity': int(os.getenv('CHANNEL_LAYER_CAPACITY', '1000')),
+            },
+        },
+    }
+
+# Write-behind cache trạng thái device cho WebSocket (devices/state_cache.py)
+DEVICE_STATE_CACHE = {
+    'FLUSH_INTERVAL': float(os.getenv('DEVICE_STATE_FLUSH_INTERVAL', '0.5')),
+    'MAX_PENDING': int(os.getenv('DEVICE_STATE_MAX_PENDING', '200')),
+    'ENTRY_TTL': float(os.getenv('DEVICE_STATE_ENTRY_TTL', '30')),
+}
+
+# Gộp update cùng device + giới hạn message/giây mỗi WebSocket (devices/throttling.py)
+DEVICE_WS_THROTTLE = {
+    'COALESCE_WINDOW': float(os.getenv('DEVICE_WS_COALESCE_WINDOW', '0.05')),
+    'RATE': float(os.getenv('DEVICE_WS_RATE', '20')),
+    'BURST': int(os.getenv('DEVICE_WS_BURST', '40')),
+}
+
+# Gateway báo state device theo lô: POST /api/gateway/reports/, ws/gateway/ (devices/ingestion.py)
+DEVICE_INGESTION = {
+    'MAX_REPORTS': int(os.getenv('DEVICE_INGESTION_MAX_REPORTS', '1000')),
+}
+
+# Worker hẹn giờ / automation: python manage.py run_scheduler (devices/schedules.py)
+SCHEDULER = {
+    'BATCH_SIZE': int(os.getenv('SCHEDULER_BATCH_SIZE', '500')),
+    'RELOAD_INTERVAL': float(os.getenv('SCHEDULER_RELOAD_INTERVAL', '3600')),
+}
+
+# Cache dùng chung giữa các worker (revision/ETag + response cache của devices/http_cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/1",
+    },
+}
+
+# GET /metrics (home_electronics_backend/metrics.py), để trống METRICS_TOKEN -> không cần token
+METRICS = {
+    'TOKEN': os.getenv('METRICS_TOKEN') or None,
+}
+
+# Logging có cấu trúc (home_electronics_backend/log.py): JSON 1 dòng/event, ghi stdout qua queue.
+# LOG_LEVEL_DEVICES=DEBUG -> log cả payload WebSocket (đã sample + giới hạn số event/giây).
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'home_electronics_backend.log.SamplingFilter',
+            'sample_rates': {
+                'ws.receive': float(os.getenv('LOG_SAMPLE_WS_RECEIVE', '0.1')),
+                'ws.broadcast': float(os.getenv('LOG_SAMPLE_WS_BROADCAST', '0.1')),
+            },
+            'rate_limits': {
+                'ws.receive': 50,
+                'ws.broadcast': 50,
+                'ws.bad_frame': 10,
+                'ws.connect': 100,
+                'ws.disconnect': 100,
+            },
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'home_electronics_backend.log.QueueListenerHandler',
+            'filters': ['sampling'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': os.getenv('LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        # Bỏ handler console mặc định của Django -> không in 2 lần.
+        'django': {
+            'handlers': ['queue'],
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'devices': {
+            'level': os.getenv('LOG_LEVEL_DEVICES', 'INFO'),
+        },
+    },
+}
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     
@@ -94,7 +195,14 @@ AUTH_USER_MODEL = 'users.CustomUser'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # Cursor pagination theo id, chỉ bật khi client gửi ?page_size= hoặc ?cursor=
+    'DEFAULT_PAGINATION_CLASS': 'devices.pagination.IdCursorPagination',
+}
+
+# Cache user active cho handshake WebSocket (users/auth_cache.py)
+ACTIVE_USER_CACHE = {
+    'TTL': int(os.getenv('ACTIVE_USER_CACHE_TTL', '60')),
 }
 
 # Cấu hình CORS - Cho phép tất cả các nguồn trong môi trường dev
@@ -133,6 +241,10 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Giữ connection giữa các request: consumer đọc DB trên thread pool (mỗi thread 1 connection),
+        # không giữ thì mỗi lần đọc phải mở connection mới.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -2,34 +2,74 @@
 
 # Giải mã token thành scope['user']
 
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
+import time
+
+from home_electronics_backend.metrics import WS_AUTH, timed_sync_to_async
+from users.auth_cache import active_user_cache
 
 User = get_user_model()
 
-@database_sync_to_async
-def get_user(user_id):
+
+class WebSocketUser(TokenUser):
+    """
+    User "nhẹ" dựng từ claim của token, không có bản ghi DB đi kèm.
+    Consumer chỉ cần id / is_anonymous -> không cần load CustomUser.
+    id ép về int để so sánh được với room.user_id, device cache,...
+    """
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+
+@timed_sync_to_async('is_active_user', thread_sensitive=False)
+def is_active_user(user_id):
+    return User.objects.filter(id=user_id, is_active=True).exists()
+
+
+async def get_user(access_token):
+    """
+    Token đã verify chữ ký -> dựng WebSocketUser từ claim.
+    Chỉ hỏi DB khi user_id chưa có trong active_user_cache (hoặc đã hết TTL).
+    """
     try:
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
+        user = WebSocketUser(access_token)
+        user_id = user.id
+    except (KeyError, TypeError, ValueError):
         return AnonymousUser()
 
+    if active_user_cache.is_active(user_id):
+        return user
+
+    if await is_active_user(user_id):
+        active_user_cache.mark_active(user_id)
+        return user
+    return AnonymousUser()
+
 class TokenAuthMiddleware:
     """
     Lấy query_string. Parse query token = "eyJ...".
     Nếu có token:
-        Dùng SimpleJWT để decode.
-        Lấy user_id từ payload
-        Query DB láy đúng user -> gắn vào scope['user']
+        Dùng SimpleJWT để decode + verify chữ ký.
+        Dựng user từ payload (user_id), chỉ query DB khi cache chưa biết user còn active
+        -> gắn vào scope['user']
     """
     def __init__(self, inner):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
         query_string = scope.get("query_string", b"").decode("utf-8")
         query_params = parse_qs(query_string)
         token = query_params.get("token", [None])[0]
@@ -37,11 +77,13 @@ class TokenAuthMiddleware:
         if token:
             try:
                 access_token = AccessToken(token)
-                user_id = access_token['user_id']
-                scope['user'] = await get_user(user_id)
+                scope['user'] = await get_user(access_token)
             except (InvalidToken, TokenError):
                 scope['user'] = AnonymousUser()
         else:
             scope['user'] = AnonymousUser()
 
-        return await self.inner(scope, receive, send)
\ No newline at end of file
+        result = 'anonymous' if scope['user'].is_anonymous else 'user'
+        WS_AUTH.labels(result).observe(time.perf_counter() - start)
+
+        return await self.inner(scope, receive, send)
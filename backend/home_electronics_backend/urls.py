@@ -8,6 +8,8 @@ from rest_framework_simplejwt.views import (
 from django.conf import settings
 from django.conf.urls.static import static
 
+from home_electronics_backend.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -17,6 +19,9 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'), # Làm mới token
 
     path('api/', include('devices.urls')),
+
+    # Prometheus scrape (METRICS_TOKEN có giá trị -> cần header Authorization: Bearer <token>)
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,56 @@
+# users/auth_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULTS = {
+    # User đã xác nhận active được tin trong bao lâu (giây) trước khi phải hỏi lại DB.
+    'TTL': 60,
+    # Số user tối đa giữ trong cache, quá thì bỏ user ít dùng nhất (LRU).
+    'MAX_ENTRIES': 10000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ACTIVE_USER_CACHE', {})}
+
+
+class ActiveUserCache:
+    """
+    Cache TTL + LRU các user_id đã được xác nhận là tồn tại và is_active.
+    Chỉ cache kết quả "active" -> user bị khoá/xoá luôn được hỏi lại DB.
+    Khi user bị deactivate/xoá, signal gọi invalidate() để bỏ ngay khỏi cache
+    (process khác tự hết hạn sau tối đa TTL giây).
+    """
+    def __init__(self):
+        self._entries = OrderedDict()   # user_id -> thời điểm hết hạn
+        self._lock = threading.Lock()
+
+    def is_active(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._entries.get(user_id)
+            if expires_at is None:
+                return False
+            if expires_at < now:
+                del self._entries[user_id]
+                return False
+            self._entries.move_to_end(user_id)
+            return True
+
+    def mark_active(self, user_id):
+        config = get_config()
+        with self._lock:
+            self._entries[user_id] = time.monotonic() + config['TTL']
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+active_user_cache = ActiveUserCache()
@@ -0,0 +1,18 @@
+# users/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth_cache import active_user_cache
+from .models import CustomUser
+
+
+# User bị khoá hoặc xoá -> WebSocket không được handshake bằng token cũ nữa.
+@receiver(post_save, sender=CustomUser)
+def invalidate_inactive_user(sender, instance, **kwargs):
+    if not instance.is_active:
+        active_user_cache.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=CustomUser)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    active_user_cache.invalidate(instance.pk)
@@ -1,3 +1,55 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from devices.models import Room
+
+from .auth_cache import active_user_cache
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WebSocketAuthTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', password='x', name='owner')
+        self.room = Room.objects.create(user=self.user, name='Room')
+        active_user_cache.invalidate(self.user.pk)
+
+    def connect(self, token):
+        from home_electronics_backend.asgi import application
+
+        async def run():
+            socket = WebsocketCommunicator(application, f'/ws/devices/{self.room.id}/?token={token}')
+            connected, _ = await socket.connect()
+            if connected:
+                await socket.disconnect()
+            return connected
+
+        return async_to_sync(run)()
+
+    def test_active_user_is_cached_after_first_handshake(self):
+        token = AccessToken.for_user(self.user)
+        self.assertTrue(self.connect(token))
+        self.assertTrue(active_user_cache.is_active(self.user.pk))
+        # Lần sau dựng user từ claim của token, không cần bản ghi user.
+        self.assertTrue(self.connect(token))
+
+    def test_deactivated_user_is_rejected_with_old_token(self):
+        token = AccessToken.for_user(self.user)
+        self.assertTrue(self.connect(token))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(active_user_cache.is_active(self.user.pk))
+        self.assertFalse(self.connect(token))
+
+    def test_token_of_deleted_user_is_rejected(self):
+        token = AccessToken.for_user(self.user)
+        self.assertTrue(self.connect(token))
+
+        user_id = self.user.pk
+        self.user.delete()
+        self.assertFalse(active_user_cache.is_active(user_id))
+        self.assertFalse(self.connect(token))
+        self.assertFalse(self.connect('not-a-token'))